@@ -0,0 +1,83 @@
+"""add wafer_iv_aggregate table
+
+Revision ID: 5b7e2d9c4f10
+Revises: a3f9c1e7d2b4
+Create Date: 2026-10-19 14:37:05.218406
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b7e2d9c4f10"
+down_revision = "a3f9c1e7d2b4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "wafer_iv_aggregate",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("wafer_id", sa.Integer(), nullable=False),
+        sa.Column("chip_state_id", sa.Integer(), nullable=False),
+        sa.Column("chip_type", sa.String(length=8), nullable=False),
+        sa.Column("voltage", sa.DECIMAL(precision=10, scale=5), nullable=True),
+        sa.Column("chips_number", sa.Integer(), nullable=False),
+        sa.Column("passed_number", sa.Integer(), nullable=False),
+        sa.Column("median", sa.Double(), nullable=True),
+        sa.Column("std", sa.Double(), nullable=True),
+        sa.Column("density", sa.Double(), nullable=True),
+        sa.Column(
+            "conditions_watermark",
+            sa.Integer(),
+            nullable=False,
+            comment="The greatest id of IV conditions of the wafer included in the aggregates",
+        ),
+        sa.Column(
+            "thresholds_version",
+            sa.VARCHAR(length=40),
+            nullable=False,
+            comment="Hash of IV thresholds the aggregates are calculated with",
+        ),
+        sa.ForeignKeyConstraint(
+            ["wafer_id"],
+            ["wafer.id"],
+            name="wafer_iv_aggregate__wafer",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["chip_state_id"],
+            ["chip_state.id"],
+            name="wafer_iv_aggregate__chip_state",
+            onupdate="CASCADE",
+            ondelete="RESTRICT",
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "wafer_id",
+            "chip_state_id",
+            "chip_type",
+            "voltage",
+            name="unique_wafer_iv_aggregate",
+        ),
+    )
+    op.create_index(
+        op.f("ix_wafer_iv_aggregate_wafer_id"),
+        "wafer_iv_aggregate",
+        ["wafer_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_wafer_iv_aggregate_chip_state_id"),
+        "wafer_iv_aggregate",
+        ["chip_state_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_wafer_iv_aggregate_chip_state_id"), table_name="wafer_iv_aggregate")
+    op.drop_index(op.f("ix_wafer_iv_aggregate_wafer_id"), table_name="wafer_iv_aggregate")
+    op.drop_table("wafer_iv_aggregate")
@@ -0,0 +1,111 @@
+"""add chip geometry columns
+
+Revision ID: 7c1d4e8a2f63
+Revises: 5b7e2d9c4f10
+Create Date: 2026-10-19 18:12:41.530127
+
+"""
+import re
+from itertools import batched
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7c1d4e8a2f63"
+down_revision = "5b7e2d9c4f10"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+# chip types with geometry at the time of the migration, the models may change later
+SIMPLE_CHIP_TYPES = frozenset({
+    "A", "B", "C", "CM", "D", "E", "F", "G", "S", "T", "V", "VH", "X", "XH", "Y", "YH",
+    "U", "UH", "I", "IH", "IM", "J", "JH", "JM", "L", "LH", "LM", "REF",
+})
+MATRIX_CHIP_TYPES = frozenset({"Q", "R", "W"})
+MATRIX_COORDINATES_RE = re.compile(r"^(?P<y>\d\d)(?P<x>\d\d)_(?P<py>\d)(?P<px>\d)$")
+SIMPLE_COORDINATES_RE = re.compile(r"(?:\d\d)+")
+
+
+def get_rectangle(
+    name: str, chip_type: str, matrix_width: int | None, matrix_height: int | None
+) -> tuple[float, float, float, float] | None:
+    """
+    Parse the geometry of a chip from its name: simple chips are named by the type followed by
+    y and x digits, matrix chips by the type, matrix y and x digits and pixel y and x digits.
+    """
+    digits = name.removeprefix(chip_type)
+    if chip_type in MATRIX_CHIP_TYPES:
+        match = MATRIX_COORDINATES_RE.match(digits)
+        if match is None or matrix_width is None or matrix_height is None:
+            return None
+        return (
+            int(match["x"]) + int(match["px"]) / (matrix_width + 1),
+            int(match["y"]) + int(match["py"]) / (matrix_height + 1),
+            1 / matrix_width,
+            1 / matrix_height,
+        )
+    if chip_type not in SIMPLE_CHIP_TYPES or not SIMPLE_COORDINATES_RE.fullmatch(digits):
+        return None
+    half = len(digits) // 2
+    return int(digits[half:]), int(digits[:half]), 1, 1
+
+
+def upgrade() -> None:
+    op.add_column(
+        "chip", sa.Column("x", sa.Double(), nullable=True, comment="X coordinate on wafer maps")
+    )
+    op.add_column(
+        "chip", sa.Column("y", sa.Double(), nullable=True, comment="Y coordinate on wafer maps")
+    )
+    op.add_column(
+        "chip", sa.Column("width", sa.Double(), nullable=True, comment="Width on wafer maps")
+    )
+    op.add_column(
+        "chip", sa.Column("height", sa.Double(), nullable=True, comment="Height on wafer maps")
+    )
+    op.create_index("ix_chip_wafer_id_x_y", "chip", ["wafer_id", "x", "y"], unique=False)
+    
+    # backfill the geometry parsed from chip names
+    connection = op.get_bind()
+    chip = sa.table(
+        "chip",
+        sa.column("id"),
+        sa.column("x"),
+        sa.column("y"),
+        sa.column("width"),
+        sa.column("height"),
+    )
+    update = (
+        sa.update(chip)
+        .where(chip.c.id == sa.bindparam("chip_id"))
+        .values(
+            x=sa.bindparam("x"),
+            y=sa.bindparam("y"),
+            width=sa.bindparam("width"),
+            height=sa.bindparam("height"),
+        )
+    )
+    rows = connection.execute(
+        sa.text(
+            "SELECT chip.id, chip.name, chip.type, matrix.width, matrix.height FROM chip "
+            "LEFT JOIN matrix ON matrix.id = chip.matrix_id"
+        )
+    ).all()
+    for rows_batch in batched(rows, BATCH_SIZE):
+        values = [
+            {"chip_id": chip_id, **dict(zip(("x", "y", "width", "height"), rectangle))}
+            for chip_id, name, chip_type, matrix_width, matrix_height in rows_batch
+            if (rectangle := get_rectangle(name, chip_type, matrix_width, matrix_height))
+        ]
+        if values:
+            connection.execute(update, values)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chip_wafer_id_x_y", table_name="chip")
+    op.drop_column("chip", "height")
+    op.drop_column("chip", "width")
+    op.drop_column("chip", "y")
+    op.drop_column("chip", "x")
@@ -0,0 +1,39 @@
+"""add iv_features table
+
+Revision ID: a3f9c1e7d2b4
+Revises: 0c81034cf2b6
+Create Date: 2026-10-19 10:12:31.482915
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a3f9c1e7d2b4"
+down_revision = "0c81034cf2b6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "iv_features",
+        sa.Column("conditions_id", sa.Integer(), nullable=False),
+        sa.Column("breakdown_voltage", sa.Float(), nullable=True),
+        sa.Column("leakage_slope", sa.Float(), nullable=True),
+        sa.Column("ideality_factor", sa.Float(), nullable=True),
+        sa.Column("series_resistance", sa.Float(), nullable=True),
+        sa.Column("zero_crossing_voltage", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["conditions_id"],
+            ["iv_conditions.id"],
+            name="iv_features__conditions",
+            onupdate="CASCADE",
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("conditions_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("iv_features")
@@ -0,0 +1,43 @@
+"""add wafer_iv_aggregate conditions count and checksum
+
+Revision ID: e4a8b6f1c935
+Revises: 7c1d4e8a2f63
+Create Date: 2026-10-19 20:05:13.674210
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e4a8b6f1c935"
+down_revision = "7c1d4e8a2f63"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # stored aggregates have no count and checksum, they are recalculated by refresh-aggregates
+    op.execute("DELETE FROM wafer_iv_aggregate")
+    op.add_column(
+        "wafer_iv_aggregate",
+        sa.Column(
+            "conditions_count",
+            sa.Integer(),
+            nullable=False,
+            comment="Number of IV conditions of the wafer included in the aggregates",
+        ),
+    )
+    op.add_column(
+        "wafer_iv_aggregate",
+        sa.Column(
+            "conditions_checksum",
+            sa.BigInteger(),
+            nullable=False,
+            comment="Checksum of ids, chips and chip states of IV conditions of the wafer",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("wafer_iv_aggregate", "conditions_checksum")
+    op.drop_column("wafer_iv_aggregate", "conditions_count")
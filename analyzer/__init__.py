@@ -19,9 +19,11 @@ from .db import (
     db_group,
     set_db,
 )
+from .eqe import eqe_group
 from .parse import parse_group
 from .show import show_group
 from .summary import summary_group
+from .trend import trend
 
 LOGO = """
 \b  █████╗  ███╗   ██╗  █████╗  ██╗   ██╗   ██╗ ███████╗ ███████╗ ██████╗
@@ -34,7 +36,9 @@ LOGO = """
 
 
 @click.group(
-    commands=[summary_group, db_group, show_group, parse_group, compare_group],
+    commands=[
+        summary_group, db_group, show_group, parse_group, compare_group, eqe_group, trend
+    ],
     help=f"{LOGO}\nVersion: {VERSION}",
 )
 @click.pass_context
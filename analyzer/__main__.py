@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import pathlib
 import sys
@@ -5,6 +6,9 @@ import sys
 import sentry_sdk
 
 if __name__ == "__main__":
+    # required for plotting in worker processes from PyInstaller executable
+    multiprocessing.freeze_support()
+    
     # frozen is True when running as a PyInstaller executable
     FROZEN = getattr(sys, "frozen", False)
     
@@ -1,40 +1,105 @@
 from decimal import Decimal
+from itertools import batched
 from time import strftime
 from typing import (
     Iterable,
+    Literal,
+    Mapping,
+    NamedTuple,
     Sequence,
-    cast,
 )
 
 import click
+import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.colors import Normalize
 from openpyxl.styles.numbers import FORMAT_PERCENTAGE_00
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
 from pandas import DataFrame
 from sqlalchemy import (
-    bindparam,
+    Select,
+    func,
     select,
 )
+from sqlalchemy.orm import Session
 
 from orm import (
     AbstractChip,
-    ChipRepository,
+    ChipGeometry,
     ChipState,
     IVMeasurement,
     IvConditions,
+    Matrix,
+    MatrixChip,
     Wafer,
+    WaferIvAggregate,
 )
 from utils import (
     EntityOption,
-    get_thresholds,
+    ThresholdMatrix,
+    from_voltage_keys,
+    validate_chip_types,
+    voltage_key_expression,
     wafer_loader,
 )
 from .context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from .excel import (
+    excel_engine_option,
+    get_report_writer,
+)
+from .summary.common import (
+    get_chip_rectangles,
+    plot_grid,
+    read_query_chunks,
+)
+from .summary.export import no_plot_option
+
+WAFER_AGGREGATES_COLUMNS = [
+    "wafer_id",
+    "chip_state_id",
+    "chip_type",
+    "voltage",
+    "chips_number",
+    "passed_number",
+    "median",
+    "std",
+    "density",
+]
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_BLOCK_SIZE = 2 ** 22
+STATE_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+STATE_CHIPS_COLUMNS = {
+    "chip": "Chip",
+    "chip_type": "Chip type",
+    "voltage": "Voltage",
+    "value_from": "From",
+    "value_to": "To",
+    "delta": "Delta",
+    "ratio": "Ratio",
+    "passed_from": "Passed from",
+    "passed_to": "Passed to",
+}
+SHEET_TITLES = {
+    "yield": "Yield",
+    "std": "Standard Deviation",
+    "leakage": "Leakage",
+    "density": "Density",
+}
+# Mersenne prime 2^31 - 1, squares of the hashes fit into signed 64-bit integers
+CHECKSUM_MODULUS = 2_147_483_647
+
+
+class ConditionsWatermark(NamedTuple):
+    """
+    State of IV conditions of a wafer the aggregates are calculated from. Any added, deleted or
+    re-stated conditions change at least one of the values.
+    """
+    max_id: int
+    count: int
+    checksum: int
 
 
 @click.command(name="wafers", help="Compare wafers")
@@ -67,209 +132,831 @@ from .context import (
     help="Output file name.",
     show_default="wafers-comparison-{datetime}.xlsx",
 )
+@click.option(
+    "--fresh",
+    is_flag=True,
+    default=False,
+    help="Aggregate all the wafers from the measurements instead of using stored aggregates.",
+)
+@click.option(
+    "--ci",
+    is_flag=True,
+    default=False,
+    help="Add sheets with bootstrap confidence intervals of yield, leakage and density. "
+         "The wafers are aggregated from the measurements.",
+)
+@click.option(
+    "--ci-level",
+    type=click.FloatRange(min=0, max=1, min_open=True, max_open=True),
+    default=0.95,
+    show_default=True,
+    help="Confidence level of the intervals.",
+)
+@click.option(
+    "--resamples",
+    type=click.IntRange(min=1),
+    default=BOOTSTRAP_RESAMPLES,
+    show_default=True,
+    help="Number of bootstrap resamples.",
+)
+@excel_engine_option
 def compare_wafers(
-    ctx: AnalyzerContext, wafers: list[Wafer], chip_states: Sequence[ChipState], file_name: str
+    ctx: AnalyzerContext,
+    wafers: list[Wafer],
+    chip_states: Sequence[ChipState],
+    file_name: str,
+    fresh: bool,
+    ci: bool,
+    ci_level: float,
+    resamples: int,
+    excel_engine: str,
 ):
-    sheets_data = get_sheets_data(wafers)
+    sheets_data = get_sheets_data(wafers, fresh, ci_level if ci else None, resamples)
     
-    if not sheets_data["frame_keys"]:
+    if not sheets_data:
         ctx.logger.warning("No data to compare")
         return
     
-    save_compare_wafers_report(file_name, sheets_data, chip_states)
+    save_compare_wafers_report(file_name, sheets_data, chip_states, excel_engine)
     ctx.logger.info(f"Wafers comparison is saved to {file_name}")
 
 
-def save_compare_wafers_report(file_name, sheets_data, chip_states):
+def save_compare_wafers_report(file_name, sheets_data, chip_states, engine="openpyxl"):
     chip_states_dict = {state.id: state.name for state in chip_states}
-    frame_keys = sheets_data.pop("frame_keys")
-    with pd.ExcelWriter(file_name) as writer:
+    with get_report_writer(file_name, engine) as writer:
         for key, data in sheets_data.items():
-            df = pd.concat(data["frames"], keys=frame_keys, copy=False)
-            df.dropna(how="all", axis=1, inplace=True)
+            df = data["frame"].dropna(how="all", axis=1)
             df.columns = pd.MultiIndex.from_tuples(
-                df.columns.values, names=["Voltage", "Chip type"]
+                [
+                    (voltage if voltage == "Total" else from_voltage_keys([voltage])[0], chip_type)
+                    for voltage, chip_type in df.columns.values
+                ],
+                names=["Voltage", "Chip type"],
             )
-            df.sort_index(axis=1, inplace=True, level=[0, 1])
+            df = df.sort_index(axis=1, level=[0, 1])
             
             df.index = pd.MultiIndex.from_tuples(
-                df.index.map(lambda idx: (idx[0], chip_states_dict[idx[1]])),
-                names=["Wafer", "Chip state"],
+                df.index.map(lambda idx: (idx[0], chip_states_dict[idx[1]], *idx[2:])),
+                names=["Wafer", "Chip state", "Bound"][:df.index.nlevels],
             )
-            if key != "yield":
+            is_yield = key.startswith("yield")
+            if not is_yield:
                 df.columns = add_perimeter_area_level(df.columns)
             
-            df.to_excel(writer, sheet_name=data["title"])
-            
-            ws: Worksheet = writer.sheets[data["title"]]
-            start_col = get_column_letter(df.index.nlevels + 1)
-            start_row = df.columns.nlevels + 1
-            values_slice = f"{start_col}{start_row}:{get_column_letter(ws.max_column)}{ws.max_row}"
-            
-            number_format = FORMAT_PERCENTAGE_00 if key == "yield" else "0.00E+00"
-            for row in ws[values_slice]:
-                for cell in row:
-                    cell.number_format = number_format
+            number_format = FORMAT_PERCENTAGE_00 if is_yield else "0.00E+00"
+            writer.write_frame(df, data["title"], number_format)
 
 
-@pass_analyzer_context
-def get_sheets_data(ctx: AnalyzerContext, wafers: Iterable[Wafer]) -> dict[str, dict]:
-    thresholds = get_thresholds(ctx.session, "IV")
-    
-    threshold_voltages = set({v for x in thresholds.values() for v in x.keys()})
-    conditions_query = (
-        select(IvConditions, AbstractChip.type.label("chip_type"), IVMeasurement)
+def get_compare_values_query(
+    wafer_ids: Iterable[int],
+    voltages: Iterable[Decimal],
+) -> Select:
+    """
+    Build a query of IV measurements of all the wafers at the given voltages.
+    Measurements are ordered by time, so that the latest ones come last. Voltages are selected
+    as voltage keys.
+    """
+    return (
+        select(
+            AbstractChip.wafer_id,
+            AbstractChip.type.label("chip_type"),
+            IvConditions.chip_id,
+            IvConditions.chip_state_id,
+            voltage_key_expression(IVMeasurement.voltage_input).label("voltage"),
+            func.coalesce(
+                IVMeasurement.anode_current_corrected, IVMeasurement.anode_current
+            ).label("value"),
+        )
+        .select_from(IvConditions)
         .join(IvConditions.measurements)
         .join(IvConditions.chip)
         .filter(
-            AbstractChip.wafer_id == bindparam("wafer_id"),
+            AbstractChip.wafer_id.in_(list(wafer_ids)),
             AbstractChip.type != "TS",
-            IVMeasurement.voltage_input.in_(threshold_voltages),
+            IVMeasurement.voltage_input.in_(list(voltages)),
         )
-        .order_by(IvConditions.datetime)
+        .order_by(IvConditions.datetime, IvConditions.id, IVMeasurement.id)
+    )
+
+
+def get_conditions_watermarks(
+    session: Session, wafer_ids: Iterable[int]
+) -> dict[int, ConditionsWatermark]:
+    """
+    Get watermarks of IV conditions of every wafer, wafers without conditions are skipped.
+    The checksum is the sum of squared hashes of conditions ids, chip states and chips, so that
+    it does not depend on the order of the rows.
+    """
+    conditions_hash = (
+        IvConditions.id * 1_000_003 + IvConditions.chip_state_id * 10_007 + IvConditions.chip_id
+    ) % CHECKSUM_MODULUS
+    rows = session.execute(
+        select(
+            AbstractChip.wafer_id,
+            func.max(IvConditions.id),
+            func.count(IvConditions.id),
+            func.sum(conditions_hash * conditions_hash % CHECKSUM_MODULUS),
+        )
+        .join(IvConditions.chip)
+        .where(AbstractChip.wafer_id.in_(list(wafer_ids)))
+        .group_by(AbstractChip.wafer_id)
+    )
+    # MySQL returns sums of integers as decimals
+    return {
+        wafer_id: ConditionsWatermark(max_id, count, int(checksum))
+        for wafer_id, max_id, count, checksum in rows
+    }
+
+
+def calculate_wafer_aggregates(
+    session: Session,
+    wafer_ids: Iterable[int],
+    thresholds: ThresholdMatrix,
+) -> pd.DataFrame:
+    """
+    Load IV measurements of all the wafers with a single query and aggregate them.
+    :return: Aggregates as returned by `get_wafer_aggregates`.
+    """
+    values_df, = read_query_chunks(
+        session, get_compare_values_query(wafer_ids, thresholds.voltages)
+    )
+    return get_wafer_aggregates(values_df, thresholds)
+
+
+def get_wafer_aggregates(values_df: pd.DataFrame, thresholds: ThresholdMatrix) -> pd.DataFrame:
+    """
+    Aggregate IV values by wafer, chip state, chip type and voltage.
+    :param values_df: Values as returned by `get_compare_values_query`.
+    :param thresholds: IV thresholds.
+    :return: One row per wafer, chip state, chip type and voltage with the number of chips, the
+        number of passed chips, median, standard deviation and median density of the values.
+        Rows with NaN voltage hold the number of chips of the chip type that have values and the
+        number of chips passed at all voltages.
+    """
+    if values_df.empty:
+        return pd.DataFrame(columns=WAFER_AGGREGATES_COLUMNS)
+    return aggregate_compare_frames(*get_compare_frames(values_df, thresholds))
+
+
+def get_compare_frames(
+    values_df: pd.DataFrame,
+    thresholds: ThresholdMatrix,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Get values of every chip at every voltage and whether they pass the thresholds. Only the
+    latest value of every chip, state and voltage is taken into account and only at voltages
+    with thresholds of the chip type.
+    :param values_df: Values as returned by `get_compare_values_query`.
+    :param thresholds: IV thresholds.
+    :return: Values and pass masks (1, 0 or NaN) with (wafer id, chip type, chip state id,
+        chip id) rows and voltage key columns.
+    """
+    values_df = values_df.assign(value=values_df["value"].astype("float64")).drop_duplicates(
+        subset=["voltage", "chip_id", "chip_state_id"],
+        keep="last",
+    )
+    values_frame: DataFrame = values_df.pivot_table(
+        values="value",
+        columns="voltage",
+        index=["wafer_id", "chip_type", "chip_state_id", "chip_id"],
     )
+    row_thresholds = thresholds.get_thresholds(
+        values_frame.index.get_level_values("chip_type"), values_frame.columns
+    )
+    # only voltages with thresholds of the chip type are compared
+    values_frame = values_frame.where(~np.isnan(row_thresholds))
+    pass_frame = pd.DataFrame(
+        thresholds.get_pass_mask(values_frame.to_numpy(dtype="float64"), row_thresholds),
+        index=values_frame.index,
+        columns=values_frame.columns,
+    )
+    return values_frame, pass_frame
+
+
+def aggregate_compare_frames(
+    values_frame: pd.DataFrame,
+    pass_frame: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Aggregate the frames returned by `get_compare_frames`.
+    :return: Aggregates as returned by `get_wafer_aggregates`.
+    """
+    group_keys = ["wafer_id", "chip_type", "chip_state_id"]
+    grouped_values = values_frame.groupby(group_keys)
+    voltages_df = pd.DataFrame({
+        "chips_number": values_frame.notna().groupby(group_keys).sum().stack(future_stack=True),
+        "passed_number": pass_frame.eq(1).groupby(group_keys).sum().stack(future_stack=True),
+        "median": grouped_values.median().stack(future_stack=True),
+        "std": grouped_values.std().stack(future_stack=True),
+        "density": (
+            values_frame.div(get_row_areas(values_frame), axis=0)
+            .groupby(group_keys)
+            .median()
+            .stack(future_stack=True)
+        ),
+    })
+    voltages_df = voltages_df[voltages_df["chips_number"] > 0]
+    
+    chips_passed = pass_frame.min(axis=1)
+    totals_df = pd.DataFrame({
+        "chips_number": chips_passed.notna().groupby(group_keys).sum(),
+        "passed_number": chips_passed.eq(1).groupby(group_keys).sum(),
+    })
+    totals_df = totals_df.assign(voltage=None).set_index("voltage", append=True)
+    
+    df = pd.concat([voltages_df, totals_df]).reset_index()
+    return df.astype({"voltage": "Int64"})[WAFER_AGGREGATES_COLUMNS]
+
+
+def get_bootstrap_intervals(
+    samples: pd.Series,
+    statistic: Literal["proportion", "median"],
+    resamples: int,
+    confidence: float,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    """
+    Percentile bootstrap confidence intervals of many samples at once. Instead of resampling
+    the values, the statistic of every resample is drawn from its exact bootstrap distribution:
+    the number of ones in a resample of a 0/1 sample is binomial, and the k-th smallest value of
+    a resample is the value of rank ceil(n * U), where U is the k-th order statistic of n uniform
+    variables (Beta(k, n - k + 1)). Thus resamples of all samples are drawn as a single
+    (resamples, samples) matrix, split into blocks of at most `BOOTSTRAP_BLOCK_SIZE` elements.
+    :param samples: Values, values with the same index belong to the same sample. Missing
+        values are skipped.
+    :param statistic: The proportion of ones (values are expected to be 0 or 1) or the median.
+    :param resamples: The number of resamples of every sample.
+    :param confidence: The confidence level of the intervals.
+    :param rng: The random generator.
+    :return: Lower and upper bounds (low and high columns) indexed by sample.
+    """
+    samples = samples.dropna()
+    codes = samples.groupby(level=list(range(samples.index.nlevels)), sort=True).ngroup()
+    order = np.lexsort((samples.to_numpy(dtype="float64"), codes.to_numpy()))
+    samples = samples.iloc[order]
+    values = samples.to_numpy(dtype="float64")
+    starts = np.flatnonzero(~samples.index.duplicated())
+    sizes = np.diff(np.append(starts, len(samples)))
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    bounds = np.full((len(starts), 2), np.nan)
+    for block in batched(range(len(starts)), max(1, BOOTSTRAP_BLOCK_SIZE // resamples)):
+        block = np.array(block)
+        n = sizes[block]
+        shape = (resamples, len(block))
+        if statistic == "proportion":
+            ones = np.add.reduceat(values, starts)[block]
+            estimates = rng.binomial(n, ones / n, size=shape) / n
+        else:
+            # the lower median and the next order statistic of every resample
+            rank = (n + 1) // 2
+            lower = rng.beta(rank, n - rank + 1, size=shape)
+            upper = lower + (1 - lower) * rng.beta(1, np.maximum(n - rank, 1), size=shape)
+            
+            def get_values(u: np.ndarray) -> np.ndarray:
+                positions = np.clip(np.ceil(n * u).astype("int64"), 1, n) - 1
+                return values[starts[block] + positions]
+            
+            estimates = np.where(
+                n % 2 == 1, get_values(lower), (get_values(lower) + get_values(upper)) / 2
+            )
+        bounds[block] = np.quantile(estimates, quantiles, axis=0).T
+    return pd.DataFrame(bounds, index=samples.index[starts], columns=["low", "high"])
+
+
+def get_compare_intervals(
+    values_frame: pd.DataFrame,
+    pass_frame: pd.DataFrame,
+    resamples: int,
+    confidence: float,
+    rng: np.random.Generator | None = None,
+) -> pd.DataFrame:
+    """
+    Bootstrap confidence intervals of yield, median leakage and median density of the chips
+    of every wafer, chip state, chip type and voltage, and of the total yield.
+    :param values_frame: Values as returned by `get_compare_frames`.
+    :param pass_frame: Pass masks as returned by `get_compare_frames`.
+    :param resamples: The number of resamples.
+    :param confidence: The confidence level of the intervals.
+    :param rng: The random generator.
+    :return: Bounds of the intervals in the format of `get_wafer_aggregates`: rows with NaN
+        voltage hold the intervals of the total yield of the chip state.
+    """
+    rng = rng or np.random.default_rng()
+    values = values_frame.stack(future_stack=True).droplevel("chip_id")
+    passed = pass_frame.stack(future_stack=True).droplevel("chip_id")
+    yield_df = get_bootstrap_intervals(passed, "proportion", resamples, confidence, rng)
+    leakage_df = get_bootstrap_intervals(values, "median", resamples, confidence, rng)
+    intervals_df = pd.concat(
+        [yield_df.add_prefix("yield_"), leakage_df.add_prefix("leakage_")], axis=1
+    )
+    # the median of densities is the median of values divided by the area
+    areas = get_row_areas(intervals_df)
+    intervals_df["density_low"] = intervals_df["leakage_low"] / areas
+    intervals_df["density_high"] = intervals_df["leakage_high"] / areas
+    
+    chips_passed = pass_frame.min(axis=1).droplevel(["chip_type", "chip_id"])
+    totals_df = get_bootstrap_intervals(
+        chips_passed, "proportion", resamples, confidence, rng
+    ).add_prefix("yield_")
+    totals_df = totals_df.assign(chip_type=None, voltage=None).set_index(
+        ["chip_type", "voltage"], append=True
+    )
+    df = pd.concat([intervals_df, totals_df.reorder_levels(intervals_df.index.names)])
+    return df.reset_index().astype({"voltage": "Int64"})
+
+
+def get_sheets_data_from_intervals(
+    intervals_df: pd.DataFrame,
+    wafers: Sequence[Wafer],
+    confidence: float,
+) -> dict[str, dict]:
+    """
+    Build the frames of confidence intervals of yield, leakage and density.
+    :param intervals_df: Intervals as returned by `get_compare_intervals`.
+    :param wafers: The wafers to compare, the order of the wafers is kept in the frames.
+    :param confidence: The confidence level of the intervals.
+    :return: Frames with (wafer name, chip state id, bound) rows and (voltage, chip type)
+        columns by sheet.
+    """
+    df = intervals_df.assign(
+        wafer=intervals_df["wafer_id"].map({w.id: i for i, w in enumerate(wafers)})
+    )
+    is_total = df["voltage"].isna()
+    bounds = [f"{(1 - confidence) / 2:.1%}", f"{(1 + confidence) / 2:.1%}"]
+    rows = df[["wafer", "chip_state_id"]].drop_duplicates().sort_values(["wafer", "chip_state_id"])
+    index = pd.MultiIndex.from_tuples(
+        [(*row, bound) for row in rows.itertuples(index=False) for bound in bounds],
+        names=["wafer", "chip_state_id", "bound"],
+    )
+    
+    def pivot(column: str) -> pd.DataFrame:
+        frames = [
+            df[~is_total].pivot_table(
+                values=f"{column}_{bound}",
+                index=["wafer", "chip_state_id"],
+                columns=["voltage", "chip_type"],
+                dropna=False,
+            )
+            for bound in ["low", "high"]
+        ]
+        if column == "yield":
+            frames = [
+                pd.concat([
+                    frame,
+                    df[is_total].set_index(["wafer", "chip_state_id"])[f"yield_{bound}"].rename(
+                        ("Total", "")
+                    ),
+                ], axis=1)
+                for frame, bound in zip(frames, ["low", "high"])
+            ]
+        frame = pd.concat(frames, keys=bounds, names=["bound"])
+        return frame.reorder_levels([1, 2, 0]).reindex(index)
     
-    sheets_data = {
-        "yield": {"frames": [], "title": "Yield"},
-        "std": {"frames": [], "title": "Standard Deviation"},
-        "leakage": {"frames": [], "title": "Leakage"},
-        "density": {"frames": [], "title": "Density"},
-        "frame_keys": [],
+    wafer_names = dict(enumerate(w.name for w in wafers))
+    level = f"{confidence * 100:g}% CI"
+    return {
+        f"{key}_ci": {
+            "frame": pivot(key).rename(index=wafer_names, level="wafer"),
+            "title": f"{SHEET_TITLES[key]} {level}",
+        }
+        for key in ["yield", "leakage", "density"]
     }
+
+
+def get_sheets_data_from_aggregates(
+    aggregates_df: pd.DataFrame,
+    wafers: Sequence[Wafer],
+) -> dict[str, dict]:
+    """
+    Build the comparison frames from the aggregates of the wafers.
+    :param aggregates_df: Aggregates as returned by `get_wafer_aggregates`.
+    :param wafers: The wafers to compare, the order of the wafers is kept in the frames.
+    :return: Frames with (wafer name, chip state id) rows and (voltage, chip type) columns by
+        sheet.
+    """
+    # wafers are ordered by their position in the arguments
+    df = aggregates_df.assign(
+        wafer=aggregates_df["wafer_id"].map({w.id: i for i, w in enumerate(wafers)})
+    )
+    is_total = df["voltage"].isna()
+    totals_df = df[is_total].groupby(["wafer", "chip_state_id"])[
+        ["chips_number", "passed_number"]
+    ].sum()
+    voltages_df = df[~is_total].astype(
+        {"median": "float64", "std": "float64", "density": "float64"}
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        voltages_df["yield"] = voltages_df["passed_number"] / voltages_df["chips_number"]
+        total_series = totals_df["passed_number"] / totals_df["chips_number"]
+    total_series.name = ("Total", "")
     
-    for wafer in wafers:
-        values_frame = pd.read_sql_query(
-            conditions_query.params(wafer_id=wafer.id),
-            ctx.session.connection(),
-            # in some cases it has type of None and triggers warning
-            dtype={"anode_current_corrected": float}
-        )
-        
-        if values_frame.empty:
-            ctx.logger.warning(f"Measurements for {wafer.name} are not found")
-            continue
-        sheets_data["frame_keys"].append(wafer.name)
-        
-        values_frame["value"] = values_frame["anode_current_corrected"].fillna(
-            values_frame["anode_current"]
-        )
-        
-        values_frame.drop_duplicates(
-            subset=["voltage_input", "chip_id", "chip_state_id"],
-            keep="last",
-            inplace=True,
+    def pivot(column: str) -> pd.DataFrame:
+        frame = voltages_df.pivot_table(
+            values=column,
+            index=["wafer", "chip_state_id"],
+            columns=["voltage", "chip_type"],
+            dropna=False,
         )
-        
-        values_frame: DataFrame = values_frame.pivot_table(
-            values="value",
-            columns="voltage_input",
-            index=["chip_type", "chip_state_id", "chip_id"],
-        )
-        values_frame.rename(
-            columns=lambda x: Decimal(x).quantize(next(iter(threshold_voltages))),
-            inplace=True,
+        return frame.reindex(totals_df.index)
+    
+    wafer_names = dict(enumerate(w.name for w in wafers))
+    frames = {
+        "yield": pd.concat([pivot("yield"), total_series], axis=1, copy=False),
+        "std": pivot("std"),
+        "leakage": pivot("median"),
+        "density": pivot("density"),
+    }
+    return {
+        key: {"frame": frame.rename(index=wafer_names, level="wafer"), "title": SHEET_TITLES[key]}
+        for key, frame in frames.items()
+    }
+
+
+def load_wafer_aggregates(
+    session: Session,
+    watermarks: Mapping[int, ConditionsWatermark],
+    thresholds: ThresholdMatrix,
+) -> pd.DataFrame:
+    """
+    Load stored aggregates of the wafers that are up to date: calculated with the thresholds
+    from the current IV conditions of the wafer.
+    :param session: The database session.
+    :param watermarks: Watermarks of IV conditions by wafer id.
+    :param thresholds: The current IV thresholds.
+    :return: Aggregates as returned by `get_wafer_aggregates`.
+    """
+    aggregates_df, = read_query_chunks(
+        session,
+        select(
+            WaferIvAggregate.conditions_watermark,
+            WaferIvAggregate.conditions_count,
+            WaferIvAggregate.conditions_checksum,
+            *[
+                voltage_key_expression(WaferIvAggregate.voltage).label(column)
+                if column == "voltage" else getattr(WaferIvAggregate, column)
+                for column in WAFER_AGGREGATES_COLUMNS
+            ],
+        ).where(
+            WaferIvAggregate.wafer_id.in_(list(watermarks)),
+            WaferIvAggregate.thresholds_version == thresholds.version,
+        ),
+    )
+    stored_watermarks = zip(
+        aggregates_df["conditions_watermark"],
+        aggregates_df["conditions_count"],
+        aggregates_df["conditions_checksum"],
+    )
+    is_outdated = [
+        ConditionsWatermark(*map(int, stored_watermark)) != watermarks[wafer_id]
+        for wafer_id, stored_watermark in zip(aggregates_df["wafer_id"], stored_watermarks)
+    ]
+    outdated_wafer_ids = aggregates_df.loc[is_outdated, "wafer_id"].unique()
+    aggregates_df = aggregates_df[~aggregates_df["wafer_id"].isin(outdated_wafer_ids)]
+    return aggregates_df[WAFER_AGGREGATES_COLUMNS].astype({"voltage": "Int64"})
+
+
+@pass_analyzer_context
+def get_sheets_data(
+    ctx: AnalyzerContext,
+    wafers: Iterable[Wafer],
+    fresh: bool = False,
+    ci_level: float | None = None,
+    resamples: int = BOOTSTRAP_RESAMPLES,
+) -> dict[str, dict]:
+    """
+    Aggregate IV measurements by wafer, chip state and chip type.
+    :param ctx: The context object (provided by the click decorator).
+    :param wafers: The wafers to compare, the order of the wafers is kept in the frames.
+    :param fresh: Aggregate all the wafers from the measurements.
+    :param ci_level: The confidence level of bootstrap intervals, the intervals are not
+        calculated if None. Intervals require values of the chips, thus the wafers are
+        aggregated from the measurements.
+    :param resamples: The number of bootstrap resamples.
+    :return: Frames with (wafer name, chip state id) rows and (voltage, chip type) columns by
+        sheet, empty if there are no measurements.
+    """
+    thresholds = ThresholdMatrix.load(ctx.session, "IV")
+    wafers = list(wafers)
+    wafer_ids = [w.id for w in wafers]
+    intervals_df = None
+    if ci_level is None:
+        aggregates_df = get_wafers_aggregates(wafer_ids, thresholds, fresh)
+    else:
+        values_df, = read_query_chunks(
+            ctx.session, get_compare_values_query(wafer_ids, thresholds.voltages)
         )
-        
-        def remove_cols_wo_thresholds(frame: pd.DataFrame):
-            chip_type = frame.name
-            cols_to_drop = set(frame.columns.values) - set(thresholds.get(chip_type, {}).keys())
-            frame.loc[:, list(cols_to_drop)] = np.nan
-            return frame
-        
-        values_frame = values_frame.groupby(["chip_type"]).apply(remove_cols_wo_thresholds)
-        
-        sheets_data["yield"]["frames"].append(get_yield_frame(thresholds, values_frame))
-        sheets_data["std"]["frames"].append(get_std_frame(values_frame))
-        sheets_data["leakage"]["frames"].append(get_leakage_frame(values_frame))
-        sheets_data["density"]["frames"].append(get_density_frame(values_frame))
+        if values_df.empty:
+            aggregates_df = pd.DataFrame(columns=WAFER_AGGREGATES_COLUMNS)
+        else:
+            values_frame, pass_frame = get_compare_frames(values_df, thresholds)
+            aggregates_df = aggregate_compare_frames(values_frame, pass_frame)
+            intervals_df = get_compare_intervals(values_frame, pass_frame, resamples, ci_level)
     
+    found_wafer_ids = set(aggregates_df["wafer_id"].unique().tolist())
+    for wafer in wafers:
+        if wafer.id not in found_wafer_ids:
+            ctx.logger.warning(f"Measurements for {wafer.name} are not found")
+    if aggregates_df.empty:
+        return {}
+    sheets_data = get_sheets_data_from_aggregates(aggregates_df, wafers)
+    if intervals_df is not None:
+        sheets_data.update(get_sheets_data_from_intervals(intervals_df, wafers, ci_level))
     return sheets_data
 
 
-def get_density_frame(values_frame: pd.DataFrame) -> pd.DataFrame:
-    chip_types = values_frame.index.unique(values_frame.index.names.index("chip_type"))
-    areas = {}
-    for chip_type in chip_types:
-        try:
-            areas[chip_type] = ChipRepository.get_area(chip_type)
-        except AttributeError:
-            areas[chip_type] = np.nan
-    
-    def divide_by_area(frame):
-        chip_type = frame.name
-        return frame / areas[chip_type]
-    
-    density_frame = (
-        values_frame.groupby("chip_type")
-        .apply(divide_by_area)
-        .groupby(["chip_type", "chip_state_id"])
-        .median()
-    )
-    density_frame = density_frame.unstack(level="chip_type")
-    return cast(pd.DataFrame, density_frame)
+@pass_analyzer_context
+def get_wafers_aggregates(
+    ctx: AnalyzerContext,
+    wafer_ids: Sequence[int],
+    thresholds: ThresholdMatrix,
+    fresh: bool = False,
+    batch_size: int | None = None,
+) -> pd.DataFrame:
+    """
+    Get IV aggregates of the wafers. Stored aggregates are used for the wafers that are up to
+    date, the rest of the wafers are aggregated from the measurements.
+    :param ctx: The context object (provided by the click decorator).
+    :param wafer_ids: Ids of the wafers.
+    :param thresholds: The current IV thresholds.
+    :param fresh: Aggregate all the wafers from the measurements.
+    :param batch_size: The number of wafers aggregated from the measurements at once, all the
+        wafers are loaded with a single query if None.
+    :return: Aggregates as returned by `get_wafer_aggregates`.
+    """
+    aggregates_frames = []
+    if not fresh:
+        watermarks = get_conditions_watermarks(ctx.session, wafer_ids)
+        stored_df = load_wafer_aggregates(ctx.session, watermarks, thresholds)
+        aggregates_frames.append(stored_df)
+        stored_wafer_ids = set(stored_df["wafer_id"].unique().tolist())
+        wafer_ids = [wafer_id for wafer_id in watermarks if wafer_id not in stored_wafer_ids]
+        if wafer_ids:
+            ctx.logger.debug(
+                f"Aggregates of {len(wafer_ids)} wafers are missing or outdated. "
+                f"They are calculated from the measurements."
+            )
+    for wafer_ids_batch in batched(wafer_ids, batch_size or len(wafer_ids) or 1):
+        aggregates_frames.append(
+            calculate_wafer_aggregates(ctx.session, wafer_ids_batch, thresholds)
+        )
+    aggregates_frames = [df for df in aggregates_frames if not df.empty]
+    if not aggregates_frames:
+        return pd.DataFrame(columns=WAFER_AGGREGATES_COLUMNS)
+    return pd.concat(aggregates_frames, ignore_index=True)
 
 
-def get_yield_frame(thresholds, values_frame: pd.DataFrame) -> pd.DataFrame:
-    chip_types = values_frame.index.unique(values_frame.index.names.index("chip_type"))
-    row_thresholds = {
-        chip_type: np.array(
-            [thresholds.get(chip_type, {}).get(voltage, np.nan) for voltage in values_frame.columns]
+@click.command(name="states", help="Compare chip states")
+@pass_analyzer_context
+@click.option(
+    "-w", "--wafer", prompt="Wafer name", help="Wafer name.",
+    required=True,
+    callback=wafer_loader,
+)
+@click.option(
+    "--from",
+    "from_state",
+    help="State of the chips before the transition.",
+    required=True,
+    cls=EntityOption,
+    entity_type=ChipState,
+)
+@click.option(
+    "--to",
+    "to_state",
+    help="State of the chips after the transition.",
+    required=True,
+    cls=EntityOption,
+    entity_type=ChipState,
+)
+@click.option(
+    "-t", "--chips-type", help="Type of the chips to analyze.",
+    callback=validate_chip_types,
+)
+@click.option(
+    "-o",
+    "--output",
+    "file_name",
+    default=lambda: f"states-comparison-{strftime('%y%m%d-%H%M%S')}",
+    help="Output file name without extension.",
+    show_default="states-comparison-{datetime}",
+)
+@no_plot_option
+@excel_engine_option
+def compare_states(
+    ctx: AnalyzerContext,
+    wafer: Wafer,
+    from_state: ChipState,
+    to_state: ChipState,
+    chips_type: str | None,
+    file_name: str,
+    no_plot: bool,
+    excel_engine: str,
+):
+    """
+    Compare IV values of the same chips of the wafer before and after a state transition:
+    distribution of per-chip deltas and ratios, share of chips that flipped pass/fail and
+    wafer maps of the deltas.
+    """
+    if from_state.id == to_state.id:
+        raise click.BadParameter("--from and --to states must differ.", param_hint="--to")
+    
+    thresholds = ThresholdMatrix.load(ctx.session, "IV")
+    query = get_compare_values_query([wafer.id], thresholds.voltages).add_columns(
+        AbstractChip.name.label("chip")
+    ).where(IvConditions.chip_state_id.in_([from_state.id, to_state.id]))
+    if chips_type is not None:
+        query = query.where(AbstractChip.type == chips_type)
+    values_df, = read_query_chunks(ctx.session, query)
+    
+    pairs_df = get_state_pairs_frame(values_df, from_state.id, to_state.id, thresholds)
+    if pairs_df.empty:
+        ctx.logger.warning(
+            f"No chips measured in both {from_state.name} and {to_state.name} states."
         )
-        for chip_type in chip_types
-    }
+        return
+    summary_df = get_state_transitions_summary(pairs_df)
     
-    def pass_threshold(frame):
-        chip_type = frame.name
-        th: np.ndarray = row_thresholds[chip_type]
-        return pd.DataFrame(
-            np.where(np.isnan(frame), np.nan, frame >= th),
-            columns=frame.columns,
-            index=frame.index,
-            copy=False,
+    info = pd.Series({
+        "Wafer": wafer.name,
+        "From": from_state.name,
+        "To": to_state.name,
+        "Number of chips": pairs_df["chip_id"].nunique(),
+    })
+    voltages = pairs_df["voltage"].unique()
+    voltage_labels = dict(zip(voltages, from_voltage_keys(voltages)))
+    excel_file_name = f"{file_name}.xlsx"
+    with get_report_writer(excel_file_name, excel_engine) as writer:
+        writer.write_frame(summary_df.rename(index=voltage_labels, level="Voltage"), "Summary")
+        writer.write_frame(
+            pairs_df.drop(columns="chip_id")
+            .assign(voltage=pairs_df["voltage"].map(voltage_labels))
+            .rename(columns=STATE_CHIPS_COLUMNS)
+            .set_index(["Chip type", "Voltage", "Chip"]),
+            "Chips",
         )
+        writer.write_frame(info, "Info")
+    ctx.logger.info(f"States comparison is saved to {excel_file_name}")
     
-    pass_frame = values_frame.groupby("chip_type").apply(pass_threshold)
-    total_series = cast(pd.Series, pass_frame.min(axis=1).groupby("chip_state_id").mean())
-    total_series.name = ("Total", "")
-    yield_frame = cast(pd.DataFrame, pass_frame.groupby(["chip_type", "chip_state_id"]).mean())
-    yield_frame = yield_frame.unstack(level="chip_type")
-    return pd.concat([yield_frame, total_series], axis=1, copy=False)
+    if no_plot:
+        return
+    chips_types = set(pairs_df["chip_type"])
+    if len(chips_types) > 1:
+        ctx.logger.warning(
+            f"Multiple chip types are found ({chips_types}). "
+            "Plotting is not supported and will be skipped."
+        )
+        return
+    chips = ctx.session.scalars(
+        select(AbstractChip).where(AbstractChip.id.in_(pairs_df["chip_id"].unique().tolist()))
+    ).all()
+    matrix_chips = [chip for chip in chips if isinstance(chip, MatrixChip)]
+    if matrix_chips:
+        # fetch matrices to avoid multiple queries later
+        ctx.session.scalars(
+            select(Matrix).where(Matrix.id.in_({c.matrix_id for c in matrix_chips}))
+        ).all()
+    rectangles = dict(zip((chip.id for chip in chips), get_chip_rectangles(chips)))
+    plot_file_name = f"{file_name}.png"
+    plot_state_transitions(
+        pairs_df,
+        rectangles,
+        f"{wafer.name} {chips_types.pop()} {from_state.name} → {to_state.name}",
+        plot_file_name,
+    )
+    ctx.logger.info(f"States comparison is plotted to {plot_file_name}")
 
 
-def get_leakage_frame(values_frame) -> pd.DataFrame:
-    leakage_frame = (
-        values_frame.groupby(["chip_type", "chip_state_id"]).median().unstack(level="chip_type")
+def get_state_pairs_frame(
+    values_df: pd.DataFrame,
+    from_state_id: int,
+    to_state_id: int,
+    thresholds: ThresholdMatrix,
+) -> pd.DataFrame:
+    """
+    Pair the latest value of every chip in one state with its latest value in the other state.
+    :param values_df: Values as returned by `get_compare_values_query` with a chip column.
+    :param from_state_id: Id of the state before the transition.
+    :param to_state_id: Id of the state after the transition.
+    :param thresholds: IV thresholds.
+    :return: One row per chip and voltage measured in both states, only at voltages with
+        thresholds of the chip type. Passed columns are 1, 0 or NaN.
+    """
+    values_df = values_df.assign(value=values_df["value"].astype("float64")).drop_duplicates(
+        subset=["voltage", "chip_id", "chip_state_id"],
+        keep="last",
     )
-    return leakage_frame
+    values_frame = values_df.set_index(
+        ["chip_id", "chip", "chip_type", "voltage", "chip_state_id"]
+    )["value"].unstack("chip_state_id")
+    values_frame = values_frame.reindex(columns=[from_state_id, to_state_id]).dropna()
+    df = values_frame.set_axis(["value_from", "value_to"], axis=1).reset_index()
+    row_thresholds = thresholds.get_paired_thresholds(df["chip_type"], df["voltage"])
+    df = df[~np.isnan(row_thresholds)]
+    row_thresholds = row_thresholds[~np.isnan(row_thresholds)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = df["value_to"] / df["value_from"]
+    df = df.assign(
+        delta=df["value_to"] - df["value_from"],
+        ratio=ratio.replace([np.inf, -np.inf], np.nan),
+        passed_from=thresholds.get_pass_mask(df["value_from"].to_numpy(), row_thresholds),
+        passed_to=thresholds.get_pass_mask(df["value_to"].to_numpy(), row_thresholds),
+    )
+    return df.sort_values(["chip_type", "voltage", "chip"], ignore_index=True)
 
 
-@pass_analyzer_context
-def add_perimeter_area_level(ctx: AnalyzerContext, index: pd.MultiIndex) -> pd.MultiIndex:
-    idx_tuples = []
-    for col in index.values:
-        voltage, chip_type = col
-        try:
-            perimeter = ChipRepository.get_perimeter(chip_type)
-            area = ChipRepository.get_area(chip_type)
-            perimeter_area = perimeter / area
-        except AttributeError:
-            ctx.logger.warning(f"Chip {chip_type} has no perimeter or area")
-            perimeter_area = np.nan
-        idx_tuples.append((voltage, chip_type, Decimal(perimeter_area).quantize(Decimal("0.001"))))
-    return pd.MultiIndex.from_tuples(idx_tuples, names=[*index.names, "Perimeter / area"])
+def get_state_transitions_summary(pairs_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarize the pairs returned by `get_state_pairs_frame` by chip type and voltage.
+    :return: The number of chips, yield in both states, shares of chips that flipped pass/fail
+        and quantiles of deltas and ratios.
+    """
+    grouped = pairs_df.groupby(["chip_type", "voltage"])
+    summary_df = pd.DataFrame({
+        "Chips": grouped.size(),
+        "Yield from": grouped["passed_from"].mean(),
+        "Yield to": grouped["passed_to"].mean(),
+        "Passed → failed": (
+            pairs_df["passed_from"].eq(1) & pairs_df["passed_to"].eq(0)
+        ).groupby([pairs_df["chip_type"], pairs_df["voltage"]]).mean(),
+        "Failed → passed": (
+            pairs_df["passed_from"].eq(0) & pairs_df["passed_to"].eq(1)
+        ).groupby([pairs_df["chip_type"], pairs_df["voltage"]]).mean(),
+    })
+    for column, title in (("delta", "Delta"), ("ratio", "Ratio")):
+        quantiles_df = grouped[column].quantile(list(STATE_QUANTILES)).unstack()
+        quantiles_df.columns = [f"{title} {q:.0%}" for q in quantiles_df.columns]
+        summary_df = summary_df.join(quantiles_df)
+    summary_df.index.names = ["Chip type", "Voltage"]
+    return summary_df
 
 
-def get_std_frame(values_frame) -> pd.DataFrame:
-    std_frame = (
-        values_frame.groupby(["chip_type", "chip_state_id"]).std().unstack(level="chip_type")
+def plot_state_transitions(
+    pairs_df: pd.DataFrame,
+    rectangles: Mapping[int, tuple[float, float, float, float] | None],
+    title: str,
+    file_name: str,
+) -> None:
+    """
+    Plot a histogram of log10 ratios and a wafer map of deltas at every voltage.
+    :param pairs_df: Pairs of a single chip type as returned by `get_state_pairs_frame`.
+    :param rectangles: Chip rectangles by chip id.
+    :param title: Title of the figure.
+    :param file_name: Output image file name.
+    """
+    voltages = pairs_df["voltage"].unique()
+    fig, axes = plt.subplots(
+        len(voltages), 2, figsize=(12, 5 * len(voltages)), squeeze=False
     )
-    return std_frame
+    cmap = plt.get_cmap("coolwarm")
+    for (hist_ax, map_ax), voltage in zip(axes, voltages, strict=True):
+        df = pairs_df[pairs_df["voltage"] == voltage]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_ratio = np.log10(df["ratio"].to_numpy())
+        hist_ax.hist(log_ratio[np.isfinite(log_ratio)], bins=30)
+        hist_ax.set_xlabel("log10(To / From)")
+        hist_ax.set_ylabel("Number of chips")
+        hist_ax.set_title(f"{from_voltage_keys([voltage])[0]} V")
+        
+        # symmetric color scale, so that unchanged chips are white
+        delta = df["delta"].to_numpy() * 1e12
+        limit = np.quantile(np.abs(delta), 0.99) or 1.0
+        norm = Normalize(vmin=-limit, vmax=limit)
+        plot_grid(
+            map_ax,
+            norm(np.clip(delta, -limit, limit)),
+            [rectangles.get(chip_id) for chip_id in df["chip_id"]],
+            cmap,
+        )
+        fig.colorbar(
+            plt.cm.ScalarMappable(cmap=cmap, norm=norm), ax=map_ax, label="To - From [pA]"
+        )
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(file_name, dpi=150)
+    plt.close(fig)
+
+
+def get_row_areas(frame: pd.DataFrame) -> np.ndarray:
+    return ChipGeometry.get_areas(frame.index.get_level_values("chip_type"))
+
+
+@pass_analyzer_context
+def add_perimeter_area_level(ctx: AnalyzerContext, index: pd.MultiIndex) -> pd.MultiIndex:
+    chip_types = index.get_level_values(1)
+    perimeters_areas = ChipGeometry.get_perimeters(chip_types) / ChipGeometry.get_areas(chip_types)
+    for chip_type in chip_types[np.isnan(perimeters_areas)].unique():
+        ctx.logger.warning(f"Chip {chip_type} has no perimeter or area")
+    idx_tuples = [
+        (voltage, chip_type, Decimal(perimeter_area).quantize(Decimal("0.001")))
+        for (voltage, chip_type), perimeter_area in zip(index.values, perimeters_areas)
+    ]
+    return pd.MultiIndex.from_tuples(idx_tuples, names=[*index.names, "Perimeter / area"])
 
 
 @click.group(
     name="compare",
     help="Set of commands to compare entities",
-    commands=[compare_wafers],
+    commands=[compare_wafers, compare_states],
 )
 def compare_group():
     ...
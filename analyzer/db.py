@@ -1,22 +1,56 @@
 import os
 import subprocess
 import time
+from itertools import batched
 from typing import (
     Optional,
+    Sequence,
     cast,
 )
 
 import click
 import keyring
-from sqlalchemy import create_engine
+import pandas as pd
+from sqlalchemy import (
+    Select,
+    create_engine,
+    delete,
+    func,
+    insert,
+    select,
+)
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
 
+from orm import (
+    AbstractChip,
+    IVMeasurement,
+    IvConditions,
+    IvFeatures,
+    Wafer,
+    WaferIvAggregate,
+)
+from utils import (
+    VOLTAGE_PRECISION,
+    ThresholdMatrix,
+    from_voltage_keys,
+)
 from utils.get_db_url import get_db_url
+from .compare import (
+    calculate_wafer_aggregates,
+    get_conditions_watermarks,
+)
 from .context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from .summary.iv_features import (
+    BREAKDOWN_CURRENT,
+    get_iv_features,
+)
+
+FEATURES_BATCH_SIZE = 1000
 
 
 @click.command(name="set", help="Set database credentials.")
@@ -96,10 +130,279 @@ def dump_db(ctx: click.Context, limit: Optional[int]):
     return db_url
 
 
+@click.command(
+    name="refresh-aggregates",
+    help="Recalculate stored IV aggregates of wafers that have new IV conditions or were "
+         "aggregated with other thresholds. The aggregates are used to compare wafers.",
+)
+@click.pass_context
+@click.option(
+    "-w",
+    "--wafers",
+    "wafer_names",
+    multiple=True,
+    help="Wafers to refresh. All wafers with IV conditions by default.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Recalculate aggregates of the wafers even if they are up to date.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Number of wafers aggregated and saved at once.",
+)
+def refresh_aggregates(
+    ctx: click.Context,
+    wafer_names: Sequence[str],
+    force: bool,
+    batch_size: int,
+):
+    ctx_obj = cast(AnalyzerContext, ctx.obj)
+    session = get_session(ctx)
+    wafer_ids = get_wafer_ids(ctx, wafer_names)
+    
+    thresholds = ThresholdMatrix.load(session, "IV")
+    watermarks = get_conditions_watermarks(session, wafer_ids)
+    stored = session.execute(
+        select(
+            WaferIvAggregate.wafer_id,
+            WaferIvAggregate.conditions_watermark,
+            WaferIvAggregate.conditions_count,
+            WaferIvAggregate.conditions_checksum,
+            WaferIvAggregate.thresholds_version,
+        )
+        .distinct()
+        .where(WaferIvAggregate.wafer_id.in_(list(wafer_ids)))
+    ).tuples().all()
+    stored_states: dict[int, set[tuple]] = {}
+    for wafer_id, *state in stored:
+        stored_states.setdefault(wafer_id, set()).add(tuple(state))
+    up_to_date = {
+        wafer_id
+        for wafer_id, states in stored_states.items()
+        if wafer_id in watermarks and states == {(*watermarks[wafer_id], thresholds.version)}
+    }
+    # aggregates of wafers without conditions are removed
+    stale_wafer_ids = [
+        *[wafer_id for wafer_id in watermarks if force or wafer_id not in up_to_date],
+        *[wafer_id for wafer_id in stored_states if wafer_id not in watermarks],
+    ]
+    if not stale_wafer_ids:
+        ctx_obj.logger.info("Aggregates are up to date.")
+        return
+    
+    started_at = time.perf_counter()
+    rows_number = 0
+    with click.progressbar(length=len(stale_wafer_ids), label="Aggregating wafers...") as progress:
+        for wafer_ids_batch in batched(stale_wafer_ids, batch_size):
+            aggregates_df = calculate_wafer_aggregates(session, wafer_ids_batch, thresholds)
+            aggregates_df = aggregates_df.assign(
+                voltage=aggregates_df["voltage"].map(
+                    lambda key: from_voltage_keys([key], VOLTAGE_PRECISION)[0], na_action="ignore"
+                ),
+                conditions_watermark=aggregates_df["wafer_id"].map(
+                    lambda wafer_id: watermarks[wafer_id].max_id
+                ),
+                conditions_count=aggregates_df["wafer_id"].map(
+                    lambda wafer_id: watermarks[wafer_id].count
+                ),
+                conditions_checksum=aggregates_df["wafer_id"].map(
+                    lambda wafer_id: watermarks[wafer_id].checksum
+                ),
+                thresholds_version=thresholds.version,
+            )
+            # NaN is not accepted by the database
+            rows = aggregates_df.astype(object).where(aggregates_df.notna(), None).to_dict(
+                orient="records"
+            )
+            # overlapping refreshes of a wafer wait for each other, otherwise both could store
+            # rows without voltage, which are not protected by the unique constraint
+            session.execute(
+                select(Wafer.id).where(Wafer.id.in_(wafer_ids_batch)).with_for_update()
+            )
+            session.execute(
+                delete(WaferIvAggregate).where(WaferIvAggregate.wafer_id.in_(wafer_ids_batch))
+            )
+            if rows:
+                session.execute(insert(WaferIvAggregate), rows)
+            session.commit()
+            rows_number += len(rows)
+            progress.update(len(wafer_ids_batch))
+    
+    elapsed = time.perf_counter() - started_at
+    ctx_obj.logger.info(
+        f"Aggregates of {len(stale_wafer_ids)} wafers are refreshed ({rows_number} rows) "
+        f"in {elapsed:.1f} s."
+    )
+
+
+@click.command(
+    name="refresh-features",
+    help="Extract features of IV sweeps (breakdown voltage, leakage slope, ideality factor, "
+         "series resistance and zero crossing voltage) and store them in the database. Only "
+         "sweeps without stored features are processed unless --force is given. Sweeps without "
+         "extractable features are stored with empty features.",
+)
+@click.pass_context
+@click.option(
+    "-w",
+    "--wafers",
+    "wafer_names",
+    multiple=True,
+    help="Wafers to process. All wafers by default.",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Extract features of all sweeps of the wafers, replacing the stored ones.",
+)
+@click.option(
+    "--breakdown-current",
+    type=click.FloatRange(min=0, min_open=True),
+    default=BREAKDOWN_CURRENT,
+    show_default=True,
+    help="Absolute current in A that defines breakdown.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=FEATURES_BATCH_SIZE,
+    show_default=True,
+    help="Number of IV sweeps processed and saved at once.",
+)
+def refresh_features(
+    ctx: click.Context,
+    wafer_names: Sequence[str],
+    force: bool,
+    breakdown_current: float,
+    batch_size: int,
+):
+    ctx_obj = cast(AnalyzerContext, ctx.obj)
+    session = get_session(ctx)
+    
+    conditions_query = (
+        select(IvConditions.id)
+        .join(AbstractChip, AbstractChip.id == IvConditions.chip_id)
+        .order_by(IvConditions.id)
+    )
+    if wafer_names:
+        conditions_query = conditions_query.where(
+            AbstractChip.wafer_id.in_(list(get_wafer_ids(ctx, wafer_names)))
+        )
+    if not force:
+        conditions_query = conditions_query.outerjoin(
+            IvFeatures, IvFeatures.conditions_id == IvConditions.id
+        ).where(IvFeatures.conditions_id.is_(None))
+    conditions_ids = session.scalars(conditions_query).all()
+    if not conditions_ids:
+        ctx_obj.logger.info("Features are up to date.")
+        return
+    
+    started_at = time.perf_counter()
+    empty_number = 0
+    with click.progressbar(length=len(conditions_ids), label="Extracting features...") as progress:
+        for conditions_ids_batch in batched(conditions_ids, batch_size):
+            sweeps_df = pd.read_sql_query(
+                get_iv_sweeps_query(conditions_ids_batch), session.connection()
+            )
+            # sweeps without extractable features get a row of NULLs, so they are skipped
+            # next time
+            features_df = get_iv_features(sweeps_df, breakdown_current).reindex(
+                pd.Index(conditions_ids_batch, name="conditions_id")
+            )
+            save_iv_features(session, features_df)
+            session.commit()
+            empty_number += int(features_df.isna().all(axis=1).sum())
+            progress.update(len(conditions_ids_batch))
+    
+    elapsed = time.perf_counter() - started_at
+    ctx_obj.logger.info(
+        f"Features of {len(conditions_ids)} IV sweep(s) are saved to the database in "
+        f"{elapsed:.1f} s, {empty_number} of them without any feature."
+    )
+
+
+def get_iv_sweeps_query(conditions_ids: Sequence[int]) -> Select:
+    """
+    Build a query of IV measurements of the conditions with the columns expected by
+    `get_iv_features`.
+    """
+    return (
+        select(
+            IVMeasurement.conditions_id,
+            IVMeasurement.voltage_input.label("voltage"),
+            func.coalesce(
+                IVMeasurement.anode_current_corrected, IVMeasurement.anode_current
+            ).label("current"),
+            IvConditions.temperature,
+        )
+        .join(IvConditions, IvConditions.id == IVMeasurement.conditions_id)
+        .where(IVMeasurement.conditions_id.in_(conditions_ids))
+    )
+
+
+def save_iv_features(session: Session, features_df: pd.DataFrame) -> None:
+    """
+    Replace stored features of the IV conditions with the new ones.
+    :param session: The database session.
+    :param features_df: Features indexed by conditions id as returned by `get_iv_features`.
+    """
+    df = features_df.reset_index()
+    rows = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    if not rows:
+        return
+    session.execute(
+        delete(IvFeatures).where(
+            IvFeatures.conditions_id.in_([row["conditions_id"] for row in rows])
+        )
+    )
+    session.execute(insert(IvFeatures), rows)
+
+
+def get_wafer_ids(ctx: click.Context, wafer_names: Sequence[str]) -> dict[int, str]:
+    """
+    Get ids of the wafers by names, case-insensitive. Wafers that are not found are skipped
+    with a warning.
+    :return: Names of the wafers by ids, all wafers if no names are given.
+    """
+    ctx_obj = cast(AnalyzerContext, ctx.obj)
+    wafers_query = select(Wafer.id, Wafer.name)
+    if wafer_names:
+        names = {name.upper() for name in wafer_names}
+        wafers_query = wafers_query.where(func.upper(Wafer.name).in_(names))
+    wafer_ids = dict(get_session(ctx).execute(wafers_query).tuples().all())
+    if wafer_names:
+        not_found = names - {name.upper() for name in wafer_ids.values()}
+        if not_found:
+            ctx_obj.logger.warning(f"Wafers {not_found} not found. Continuing without them.")
+    return wafer_ids
+
+
+def get_session(ctx: click.Context) -> Session:
+    """
+    Get the session of the context. Commands of the db group are invoked without a session,
+    so it's created on demand and closed with the context.
+    """
+    ctx_obj = cast(AnalyzerContext, ctx.obj)
+    if ctx_obj.is_session_set():
+        return ctx_obj.session
+    engine = create_engine(ctx.find_root().params.get("db_url") or get_db_url())
+    ctx.call_on_close(lambda: engine.dispose(close=True))
+    session = ctx.with_resource(Session(bind=engine, autoflush=False, future=True))
+    ctx_obj.session = session
+    return session
+
+
 @click.group(
     name="db",
     help="Set of commands to manage related database",
-    commands=[set_db, dump_db],
+    commands=[set_db, dump_db, refresh_aggregates, refresh_features],
 )
 def db_group():
     ...
@@ -0,0 +1,207 @@
+import time
+from itertools import batched
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Select,
+    func,
+    select,
+    update,
+)
+
+from orm import (
+    EqeConditions,
+    EqeMeasurement,
+)
+from .context import (
+    AnalyzerContext,
+    pass_analyzer_context,
+)
+
+HC_OVER_E = 1239.84  # nm·W/A, EQE = responsivity * hc / (e * wavelength)
+
+
+def read_calibration_file(file_path: Path) -> pd.Series:
+    """
+    Read a reference calibration curve. The first two numeric columns are expected to be
+    wavelength in nm and responsivity in A/W, non-numeric (header) rows are skipped.
+    :param file_path: The path to the calibration file (csv, tsv or semicolon separated).
+    :return: Responsivity indexed by wavelength.
+    """
+    df = pd.read_csv(file_path, sep=r"[,;\t]", engine="python", header=None, comment="#")
+    df = df.iloc[:, :2].apply(pd.to_numeric, errors="coerce").dropna()
+    if len(df.columns) < 2 or df.empty:
+        raise ValueError(f"No calibration data found in {file_path.name}.")
+    return pd.Series(df.iloc[:, 1].to_numpy(), index=df.iloc[:, 0].to_numpy()).sort_index()
+
+
+def get_recalibrated_values(
+    measurements_df: pd.DataFrame, previous: pd.Series, calibration: pd.Series
+) -> pd.DataFrame:
+    """
+    Recalculate responsivity and EQE of the measurements for a corrected calibration curve.
+    Measured responsivity is proportional to the responsivity of the reference, thus it is
+    scaled by the ratio of the curves at the wavelength of every measurement.
+    :param measurements_df: Measurements with id, wavelength and responsivity columns.
+    :param previous: The calibration curve the measurements were calculated with.
+    :param calibration: The corrected calibration curve.
+    :return: Measurements with id, responsivity and eqe columns. Measurements without
+        responsivity or out of the range of the curves are skipped.
+    """
+    wavelengths = measurements_df["wavelength"].to_numpy(dtype="float64")
+    
+    def interpolate(curve: pd.Series) -> np.ndarray:
+        return np.interp(
+            wavelengths, curve.index.to_numpy(dtype="float64"), curve.to_numpy(dtype="float64"),
+            left=np.nan, right=np.nan,
+        )
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = interpolate(calibration) / interpolate(previous)
+    responsivity = measurements_df["responsivity"].to_numpy(dtype="float64") * ratio
+    df = pd.DataFrame({
+        "id": measurements_df["id"].to_numpy(),
+        "responsivity": responsivity,
+        "eqe": responsivity * HC_OVER_E / wavelengths * 100,
+    })
+    return df[np.isfinite(df["responsivity"])].reset_index(drop=True)
+
+
+def get_calibrated_measurements_ids_query(calibration_name: str) -> Select:
+    """
+    Build a query of ids of EQE measurements calculated with the given calibration file.
+    """
+    return (
+        select(EqeMeasurement.id)
+        .join(EqeConditions, EqeConditions.id == EqeMeasurement.conditions_id)
+        .where(func.trim(EqeConditions.calibration_file) == calibration_name)
+        .order_by(EqeMeasurement.id)
+    )
+
+
+def read_calibration_option(file_path: Path, param_hint: str) -> pd.Series:
+    try:
+        return read_calibration_file(file_path)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint=param_hint)
+
+
+@click.command(name="recalibrate")
+@pass_analyzer_context
+@click.option(
+    "-c",
+    "--calibration",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Corrected reference calibration file with wavelength (nm) and responsivity (A/W) "
+         "columns.",
+)
+@click.option(
+    "-p",
+    "--previous",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Calibration file the measurements were calculated with.",
+)
+@click.option(
+    "--name",
+    "calibration_name",
+    help="Name of the calibration file recorded in EQE conditions. "
+         "Defaults to the name of --previous file.",
+)
+@click.option(
+    "--new-name",
+    help="Name of the corrected calibration file to record in EQE conditions instead of the "
+         "previous one, so that the measurements are not recalibrated twice. "
+         "Defaults to the name of --calibration file.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=5000,
+    show_default=True,
+    help="Number of measurements read and updated at once.",
+)
+@click.option("--dry-run", is_flag=True, default=False, help="Don't save the changes.")
+def recalibrate_eqe(
+    ctx: AnalyzerContext,
+    calibration: Path,
+    previous: Path,
+    calibration_name: str | None,
+    new_name: str | None,
+    chunk_size: int,
+    dry_run: bool,
+):
+    """
+    Recalculate responsivity and EQE of all measurements made with a reference calibration
+    file after the file was corrected. The name of the corrected file is recorded in the
+    conditions of the measurements in the same transaction.
+    """
+    calibration_name = calibration_name or previous.name
+    new_name = new_name or calibration.name
+    if new_name.strip() == calibration_name.strip():
+        raise click.BadParameter(
+            f"The corrected calibration must be recorded under a name other than "
+            f"{calibration_name!r}, otherwise the measurements can be recalibrated twice.",
+            param_hint="--new-name",
+        )
+    if len(new_name) > EqeConditions.calibration_file.type.length:
+        raise click.BadParameter(f"{new_name!r} is too long.", param_hint="--new-name")
+    new_calibration = read_calibration_option(calibration, "--calibration")
+    previous_calibration = read_calibration_option(previous, "--previous")
+    
+    started_at = time.perf_counter()
+    # ids are read before updating, so that the reading cursor is not interrupted
+    ids = ctx.session.scalars(get_calibrated_measurements_ids_query(calibration_name)).all()
+    if not ids:
+        ctx.logger.warning(f"No measurements with calibration file {calibration_name!r} found.")
+        return
+    
+    total = 0
+    with click.progressbar(length=len(ids), label="Updating measurements...") as progress:
+        for ids_batch in batched(ids, chunk_size):
+            chunk = pd.read_sql_query(
+                select(EqeMeasurement.id, EqeMeasurement.wavelength, EqeMeasurement.responsivity)
+                .where(EqeMeasurement.id.in_(ids_batch)),
+                ctx.session.connection(),
+            )
+            recalibrated_df = get_recalibrated_values(chunk, previous_calibration, new_calibration)
+            if not recalibrated_df.empty:
+                ctx.session.execute(
+                    update(EqeMeasurement), recalibrated_df.to_dict(orient="records")
+                )
+            total += len(recalibrated_df)
+            progress.update(len(ids_batch))
+    ctx.session.execute(
+        update(EqeConditions)
+        .where(func.trim(EqeConditions.calibration_file) == calibration_name)
+        .values(calibration_file=new_name)
+    )
+    if total < len(ids):
+        ctx.logger.warning(
+            f"{len(ids) - total} measurements have no responsivity or are out of the wavelength "
+            "range of the calibration files. They are not changed."
+        )
+    
+    if dry_run:
+        ctx.session.rollback()
+    else:
+        ctx.session.commit()
+    elapsed = time.perf_counter() - started_at
+    ctx.logger.info(
+        f"{total} measurements are recalibrated with {new_name!r} "
+        f"in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)."
+        + (" Changes are not saved (dry run)." if dry_run else "")
+    )
+
+
+@click.group(
+    name="eqe",
+    help="Set of commands to maintain EQE measurements",
+    commands=[recalibrate_eqe],
+)
+def eqe_group():
+    ...
@@ -0,0 +1,333 @@
+import math
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from datetime import (
+    date,
+    datetime,
+)
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Sequence,
+)
+
+import click
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.worksheet import Worksheet
+from xlsxwriter.format import Format
+from xlsxwriter.worksheet import Worksheet as XlsxWorksheet
+
+
+class ThresholdRange(NamedTuple):
+    """
+    Range of a single column to be highlighted against a threshold.
+    Rows and column are 0-based positions of values in the DataFrame (index and header excluded).
+    """
+    first_row: int
+    last_row: int
+    column: int
+    threshold: float
+
+
+class FrameLayout(NamedTuple):
+    header_rows: int
+    index_cols: int
+
+
+def get_frame_layout(df: pd.DataFrame) -> FrameLayout:
+    """
+    Get the number of header rows and index columns that `DataFrame.to_excel` writes before values.
+    """
+    header_rows = df.columns.nlevels
+    if isinstance(df.columns, pd.MultiIndex):
+        header_rows += 1  # extra row for index names
+    return FrameLayout(header_rows, df.index.nlevels)
+
+
+def get_header_spans(
+    columns: Sequence[tuple], level: int, last_level: int
+) -> Iterator[tuple[int, int]]:
+    """
+    Get the first column and the number of columns of every label of a MultiIndex level. Labels
+    of outer levels span while all labels above are the same.
+    """
+    i = 0
+    while i < len(columns):
+        span = 1
+        while (
+            level < last_level
+            and i + span < len(columns)
+            and columns[i + span][:level + 1] == columns[i][:level + 1]
+        ):
+            span += 1
+        yield i, span
+        i += span
+
+
+class ReportWriter(ABC):
+    """
+    Writes DataFrames into xlsx sheets. Formatting is expressed as range-level rules, so that
+    implementations don't need to touch cells one by one.
+    """
+    
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.layouts: dict[str, FrameLayout] = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    @abstractmethod
+    def write_frame(
+        self,
+        df: pd.DataFrame | pd.Series,
+        sheet_name: str,
+        number_format: str | None = None,
+    ) -> None:
+        """
+        Write a DataFrame to a new sheet keeping the layout of `DataFrame.to_excel`.
+        :param df: The DataFrame or Series to write.
+        :param sheet_name: The name of the new sheet.
+        :param number_format: Excel number format applied to all values of the sheet.
+        """
+    
+    @abstractmethod
+    def add_threshold_rules(
+        self,
+        sheet_name: str,
+        ranges: Iterable[ThresholdRange],
+        rules: Mapping[str, str],
+    ) -> None:
+        """
+        Add conditional formatting to the previously written sheet.
+        :param sheet_name: The name of the sheet.
+        :param ranges: Ranges of values with their thresholds.
+        :param rules: A mapping of comparison operators (e.g. "lessThan") to background colors.
+        """
+    
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+
+class OpenpyxlReportWriter(ReportWriter):
+    """
+    Keeps the whole workbook in memory and writes it on close.
+    """
+    
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self.writer = pd.ExcelWriter(file_name, engine="openpyxl")
+    
+    def write_frame(self, df, sheet_name, number_format=None):
+        df.to_excel(self.writer, sheet_name=sheet_name)
+        layout = get_frame_layout(df if isinstance(df, pd.DataFrame) else df.to_frame())
+        self.layouts[sheet_name] = layout
+        if number_format is None:
+            return
+        # openpyxl has no way to format a range, only cells
+        ws: Worksheet = self.writer.sheets[sheet_name]
+        for row in ws.iter_rows(min_row=layout.header_rows + 1, min_col=layout.index_cols + 1):
+            for cell in row:
+                cell.number_format = number_format
+    
+    def add_threshold_rules(self, sheet_name, ranges, rules):
+        ws: Worksheet = self.writer.sheets[sheet_name]
+        layout = self.layouts[sheet_name]
+        fills = {name: PatternFill(bgColor=color, fill_type="solid") for name, color in rules.items()}
+        for value_range in ranges:
+            column_letter = get_column_letter(value_range.column + layout.index_cols + 1)
+            cell_range = (
+                f"{column_letter}{value_range.first_row + layout.header_rows + 1}:"
+                f"{column_letter}{value_range.last_row + layout.header_rows + 1}"
+            )
+            for rule_name, fill in fills.items():
+                rule = CellIsRule(operator=rule_name, formula=[value_range.threshold], fill=fill)
+                ws.conditional_formatting.add(cell_range, rule)
+    
+    def close(self):
+        self.writer.close()
+
+
+class XlsxWriterReportWriter(ReportWriter):
+    """
+    Streams rows to the file with xlsxwriter in constant memory mode. Rows are flushed as soon as
+    the next row is started, thus memory usage doesn't depend on the size of the sheets.
+
+    The layout and styles of `DataFrame.to_excel` are reproduced, except that repeated labels of
+    MultiIndex rows are left blank instead of being merged vertically.
+    """
+    
+    criteria = {
+        "lessThan": "<",
+        "lessThanOrEqual": "<=",
+        "greaterThan": ">",
+        "greaterThanOrEqual": ">=",
+        "equal": "==",
+        "notEqual": "!=",
+    }
+    
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self.book = xlsxwriter.Workbook(file_name, {"constant_memory": True})
+        self.formats: dict[tuple, Format] = {}
+    
+    def get_format(self, header: bool = False, num_format: str | None = None) -> Format | None:
+        key = (header, num_format)
+        if key not in self.formats:
+            properties: dict[str, Any] = {}
+            if header:
+                properties.update(bold=True, border=1, align="center", valign="top")
+            if num_format is not None:
+                properties.update(num_format=num_format)
+            self.formats[key] = self.book.add_format(properties) if properties else None
+        return self.formats[key]
+    
+    def write_value(self, ws: XlsxWorksheet, row: int, col: int, value, header: bool = False):
+        if isinstance(value, (pd.Timestamp, np.datetime64)):
+            value = pd.Timestamp(value).to_pydatetime()
+        if isinstance(value, np.generic):
+            value = value.item()
+        
+        if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+            if header:
+                ws.write_blank(row, col, None, self.get_format(header))
+        elif isinstance(value, bool):
+            ws.write_boolean(row, col, value, self.get_format(header))
+        elif isinstance(value, (int, float)):
+            if math.isinf(value):
+                ws.write_string(row, col, "inf" if value > 0 else "-inf", self.get_format(header))
+            else:
+                ws.write_number(row, col, float(value), self.get_format(header))
+        elif isinstance(value, datetime):
+            ws.write_datetime(row, col, value, self.get_format(header, "YYYY-MM-DD HH:MM:SS"))
+        elif isinstance(value, date):
+            ws.write_datetime(row, col, value, self.get_format(header, "YYYY-MM-DD"))
+        else:
+            # like `DataFrame.to_excel`, other types (e.g. Decimal) are written as strings
+            ws.write_string(row, col, str(value), self.get_format(header))
+    
+    def write_frame(self, df, sheet_name, number_format=None):
+        if isinstance(df, pd.Series):
+            df = df.to_frame()
+        ws = self.book.add_worksheet(sheet_name)
+        layout = get_frame_layout(df)
+        self.layouts[sheet_name] = layout
+        
+        if number_format is not None and len(df.columns):
+            # unformatted cells inherit the format of their column
+            ws.set_column(
+                layout.index_cols,
+                layout.index_cols + len(df.columns) - 1,
+                None,
+                self.get_format(num_format=number_format),
+            )
+        
+        self.write_header(ws, df, layout)
+        
+        index_values = list(df.index) if df.index.nlevels > 1 else [(v,) for v in df.index]
+        previous_index = None
+        with click.progressbar(
+            zip(index_values, df.itertuples(index=False, name=None)),
+            length=len(df),
+            label=f"Writing {sheet_name}...",
+        ) as progress:
+            for i, (index, values) in enumerate(progress):
+                row = layout.header_rows + i
+                for level, label in enumerate(index):
+                    # labels of outer MultiIndex levels are written only when they change
+                    if (
+                        level < len(index) - 1
+                        and previous_index is not None
+                        and previous_index[:level + 1] == index[:level + 1]
+                    ):
+                        label = None
+                    self.write_value(ws, row, level, label, header=True)
+                for col, value in enumerate(values, start=layout.index_cols):
+                    self.write_value(ws, row, col, value)
+                previous_index = index
+    
+    def write_header(self, ws: XlsxWorksheet, df: pd.DataFrame, layout: FrameLayout):
+        if isinstance(df.columns, pd.MultiIndex):
+            self.write_multi_header(ws, df, layout)
+        else:
+            self.write_flat_header(ws, df, layout)
+    
+    def write_flat_header(self, ws: XlsxWorksheet, df: pd.DataFrame, layout: FrameLayout):
+        self.write_index_names(ws, df, 0)
+        for col, label in enumerate(df.columns, start=layout.index_cols):
+            self.write_value(ws, 0, col, label, header=True)
+    
+    def write_multi_header(self, ws: XlsxWorksheet, df: pd.DataFrame, layout: FrameLayout):
+        col_offset = layout.index_cols - 1
+        columns = list(df.columns)
+        for level, name in enumerate(df.columns.names):
+            self.write_value(ws, level, col_offset, name, header=True)
+            for i, span in get_header_spans(columns, level, df.columns.nlevels - 1):
+                col = col_offset + i + 1
+                if span > 1:
+                    ws.merge_range(
+                        level, col, level, col + span - 1, None, self.get_format(header=True)
+                    )
+                self.write_value(ws, level, col, columns[i][level], header=True)
+        self.write_index_names(ws, df, layout.header_rows - 1)
+    
+    def write_index_names(self, ws: XlsxWorksheet, df: pd.DataFrame, row: int):
+        if any(name is not None for name in df.index.names):
+            for col, name in enumerate(df.index.names):
+                self.write_value(ws, row, col, name, header=True)
+    
+    def add_threshold_rules(self, sheet_name, ranges, rules):
+        ws = self.book.get_worksheet_by_name(sheet_name)
+        layout = self.layouts[sheet_name]
+        formats = {name: self.book.add_format({"bg_color": f"#{color}"}) for name, color in rules.items()}
+        for value_range in ranges:
+            col = value_range.column + layout.index_cols
+            for rule_name, cell_format in formats.items():
+                ws.conditional_format(
+                    value_range.first_row + layout.header_rows,
+                    col,
+                    value_range.last_row + layout.header_rows,
+                    col,
+                    {
+                        "type": "cell",
+                        "criteria": self.criteria[rule_name],
+                        "value": value_range.threshold,
+                        "format": cell_format,
+                    },
+                )
+    
+    def close(self):
+        self.book.close()
+
+
+REPORT_WRITERS: dict[str, type[ReportWriter]] = {
+    "openpyxl": OpenpyxlReportWriter,
+    "xlsxwriter": XlsxWriterReportWriter,
+}
+
+excel_engine_option = click.option(
+    "--excel-engine",
+    type=click.Choice(list(REPORT_WRITERS.keys()), case_sensitive=False),
+    default="openpyxl",
+    show_default=True,
+    help="Library to write xlsx files with. xlsxwriter streams rows in constant memory, "
+         "which is faster for big wafers.",
+)
+
+
+def get_report_writer(file_name: str, engine: str = "openpyxl") -> ReportWriter:
+    return REPORT_WRITERS[engine.lower()](file_name)
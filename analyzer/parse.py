@@ -37,6 +37,7 @@ from orm import (
     TsMeasurement,
     Wafer,
     WaferRepository,
+    reference_cache,
 )
 from utils import (
     eqe_defaults,
@@ -138,7 +139,7 @@ def parse_eqe(ctx: AnalyzerContext, file_paths: tuple[Path]):
     Parse EQE measurements from FILE_PATHS files. The measurements are saved to the database and
     processed files are renamed to FILENAME.parsed.
     """
-    instrument_map: dict[str, Instrument] = {i.name: i for i in ctx.session.query(Instrument).all()}
+    instrument_map: dict[str, Instrument] = reference_cache.get_by_name(ctx.session, Instrument)
     
     for file_path in file_paths:
         with parsing_file(file_path):
@@ -320,14 +321,14 @@ def ask_eqe_session(ctx: AnalyzerContext, timestamp: datetime) -> EqeSession:
 
 @remember_choice("Use {} for all parsed measurements")
 def ask_carrier(session: Session) -> Carrier:
-    carriers = session.query(Carrier).order_by(Carrier.id).all()
+    carriers = reference_cache.get_all(session, Carrier)
     carrier = select_one(carriers, "Select carrier")
     return carrier
 
 
 @remember_choice("Apply {} to all parsed measurements")
 def ask_chip_state(session: Session) -> ChipState:
-    chip_states = session.query(ChipState).order_by(ChipState.id).all()
+    chip_states = reference_cache.get_all(session, ChipState)
     chip_state = select_one(chip_states, "Select chip state")
     return chip_state
 
@@ -1,14 +1,23 @@
-import re
 import decimal
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from decimal import Decimal
+from functools import partial
+from io import BytesIO
 from time import (
     localtime,
     strftime,
 )
 from typing import (
+    BinaryIO,
     Iterable,
+    Iterator,
+    Literal,
     Mapping,
     Sequence,
+    TypedDict,
     cast,
 )
 
@@ -18,6 +27,7 @@ import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 from matplotlib.axes import Axes
+from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib.colors import (
     Colormap,
     ListedColormap,
@@ -26,41 +36,94 @@ from matplotlib.colors import (
 from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
 from matplotlib.ticker import MaxNLocator
-from openpyxl.cell import Cell
-from openpyxl.formatting.rule import CellIsRule
-from openpyxl.styles import Fill
-from openpyxl.worksheet.worksheet import Worksheet
+from PIL import Image
+from sqlalchemy import Select
+from sqlalchemy.orm import Session
 
 from analyzer.context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from analyzer.excel import ThresholdRange
 from orm import (
-    CVMeasurement,
+    ChipGeometry,
     ChipState,
-    IVMeasurement,
     SimpleChip,
     Wafer,
 )
-from orm.cv_measurement import is_cv_measurements
-from orm.iv_measurement import is_iv_measurements
+from utils import (
+    MICROVOLTS_PER_VOLT,
+    ThresholdMatrix,
+    VOLTAGE_PRECISION,
+    from_voltage_keys,
+)
 
 date_formats = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
 date_formats_help = f"Supported formats are: {', '.join((strftime(f) for f in date_formats))}."
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+jobs_option = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes to plot with. Every voltage is plotted separately in its own "
+         "process and the images are stitched together.",
+)
+chunk_size_option = click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    help="Stream measurements from the database in chunks of the given number of rows. "
+         "Memory usage then depends on the number of chips and voltages only.",
+)
+plot_format_option = click.option(
+    "--plot-format",
+    type=click.Choice(["png", "pdf"], case_sensitive=False),
+    default="png",
+    show_default=True,
+    help="Format of the plot file. PDF file has a separate page for every voltage.",
+)
+
+
+def read_query_chunks(
+    session: Session,
+    query: Select,
+    chunk_size: int | None = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Execute the query and yield its rows as DataFrames.
+    :param session: The database session.
+    :param query: The query to execute.
+    :param chunk_size: The maximal number of rows in a DataFrame. If specified, the rows are
+    fetched with a server-side cursor, otherwise all rows are yielded as a single DataFrame.
+    :return:
+    """
+    if chunk_size is None:
+        yield pd.read_sql_query(query, session.connection())
+        return
+    result = session.execute(query.execution_options(yield_per=chunk_size))
+    columns = list(result.keys())
+    is_empty = True
+    for partition in result.partitions():
+        is_empty = False
+        yield pd.DataFrame.from_records(partition, columns=columns)
+    if is_empty:
+        yield pd.DataFrame(columns=columns)
 
 
 @pass_analyzer_context
 def get_slice_by_voltages(
     ctx: AnalyzerContext,
     df: pd.DataFrame,
-    voltages: Iterable[Decimal]
+    voltages: Iterable[int]
 ) -> pd.DataFrame:
     """
     Extract a slice of the DataFrame based on the specified voltages.
     
     :param ctx: The context object (provided by the click decorator).
-    :param df: The DataFrame containing the data to be sliced.
-    :param voltages: The voltages to be included in the slice.
+    :param df: The DataFrame containing the data to be sliced with voltage keys as columns.
+    :param voltages: The voltage keys to be included in the slice.
     :return:
     """
     columns = sorted(voltages)
@@ -70,79 +133,79 @@ def get_slice_by_voltages(
     if empty_cols.any():
         ctx.logger.warning(
             "The following voltages are not present in the data: %s.",
-            [float(cast(Decimal, col)) for col, val in empty_cols.items() if val]
+            [float(col / MICROVOLTS_PER_VOLT) for col, val in empty_cols.items() if val]
         )
     slice_df.dropna(axis=1, how="all", inplace=True)
     return slice_df
 
 
-def get_voltage_column_cell(header_row: tuple[Cell, ...], v: Decimal) -> Cell:
-    for cell in header_row:
-        try:
-            if Decimal(cast(str, cell.value)) == v:
-                return cell
-        except (ValueError, TypeError, decimal.DecimalException):
-            pass
-    raise StopIteration
+def to_volt_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replace voltage key columns with voltages in V as floats, e.g. for data files.
+    """
+    return df.set_axis(df.columns.to_numpy(dtype="int64") / MICROVOLTS_PER_VOLT, axis=1)
 
 
-def apply_conditional_formatting(
-    sheet: Worksheet,
-    rules: Mapping[str, Fill],
+def to_decimal_voltage_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replace voltage key columns with voltages in V as decimals, so that Excel reports show them
+    as in the database and they can be matched with thresholds.
+    """
+    return df.set_axis(from_voltage_keys(df.columns, VOLTAGE_PRECISION), axis=1)
+
+
+def get_threshold_ranges(
+    df: pd.DataFrame,
     thresholds: Mapping[str, Mapping[Decimal, float]],
-):
+) -> list[ThresholdRange]:
     """
-    Apply conditional formatting to an Excel sheet based on specified rules and thresholds.
-    :param sheet: The Excel worksheet to which the conditional formatting will be applied.
-    :param rules: A dictionary mapping rule names to their corresponding fill styles.
+    Get ranges of values to be highlighted in a sheet based on thresholds of chip types.
+    The range of a chip type spans from its first to its last chip in the index.
+    :param df: The DataFrame with chip names as index and voltages as columns.
     :param thresholds: A dictionary mapping chip types to their voltage thresholds.
-    :return:
+    :return: A list of ranges in the DataFrame coordinates.
     """
-    chip_row_index = [(i + 1, cell.value) for i, cell in enumerate(sheet["A"]) if cell.value]
-    header_row: tuple[Cell, ...] = sheet["1"]
+    # the whole letter prefix of a chip name is compared with the chip type, so that types
+    # with two letters don't end up using acceptance limits of a type with the same first letter
+    chip_types = df.index.to_series().str.extract(r"^([A-Za-z]+)", expand=False).to_numpy()
+    voltage_columns: dict[Decimal, int] = {}
+    for position, column in enumerate(df.columns):
+        try:
+            voltage_columns.setdefault(Decimal(column), position)
+        except (ValueError, TypeError, decimal.DecimalException):
+            pass
     
+    ranges = []
     for chip_type, chip_type_thresholds in thresholds.items():
-        def is_current_type(chip_name: str) -> bool:
-            prefix = re.match(r'^[A-Za-z]+', chip_name)
-            return chip_type == prefix.group(0)
-          # Old version below that checks only the first letter of chip name
-          # This is a problem when chip type has 2 letters because it may
-          # end up using acceptance limits of another chip type with same first letter
-          #  return chip_name.startswith(chip_type)
-        
+        rows = np.flatnonzero(chip_types == chip_type)
+        if len(rows) == 0:
+            continue
         for voltage, threshold in chip_type_thresholds.items():
-            try:
-                column_cell = get_voltage_column_cell(header_row, voltage)
-                first_row_index = next(i for i, v in chip_row_index if is_current_type(v))
-                last_row_index = next(i for i, v in reversed(chip_row_index) if is_current_type(v))
-            except (ValueError, StopIteration):
+            column = voltage_columns.get(voltage)
+            if column is None:
                 continue
-            
-            column_letter = column_cell.column_letter
-            cell_range = f"{column_letter}{first_row_index}:{column_letter}{last_row_index}"
-            for rule_name, rule in rules.items():
-                cells_rule = CellIsRule(operator=rule_name, formula=[threshold], fill=rule)
-                sheet.conditional_formatting.add(cell_range, cells_rule)
+            ranges.append(ThresholdRange(int(rows[0]), int(rows[-1]), column, threshold))
+    return ranges
 
 
 def get_info(
     wafer: Wafer,
     chip_states: Iterable[ChipState],
-    measurements: list[IVMeasurement] | list[CVMeasurement],
+    datetimes: Sequence[datetime],
 ) -> pd.Series:
     """
     Generate a summary of information for a given wafer, chip states, and measurements.
 
     :param wafer:
     :param chip_states:
-    :param measurements:
+    :param datetimes: Dates of the summarized measurements.
     :return:
     """
     format_date = strftime("%A, %d %b %Y", localtime())
     chip_states_str = "; ".join([state.name for state in chip_states])
     
-    first_measurement_date = min(map(lambda m: m.datetime, measurements))
-    last_measurement_date = max(map(lambda m: m.datetime, measurements))
+    first_measurement_date = min(datetimes)
+    last_measurement_date = max(datetimes)
     
     return pd.Series(
         {
@@ -151,11 +214,48 @@ def get_info(
             "Chip state": chip_states_str,
             "First measurement date": first_measurement_date,
             "Last measurement date": last_measurement_date,
-            "Number of measurements": len(measurements),
+            "Number of measurements": len(datetimes),
         }
     )
 
 
+def fit_lines(
+    groups: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    groups_number: int = 0,
+) -> dict[str, np.ndarray]:
+    """
+    Fit a line y = slope * x + intercept to the points of every group at once.
+    :param groups: Group number of every point, 0..n-1.
+    :param x: Arguments of the points.
+    :param y: Values of the points.
+    :param groups_number: The minimal number of groups, groups without points get NaN.
+    :return: Slope, intercept, coefficient of determination and number of points per group.
+        Groups with less than two distinct arguments get NaN.
+    """
+    def group_sum(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(groups, weights=weights, minlength=groups_number)
+    
+    n = np.bincount(groups, minlength=groups_number).astype("float64")
+    sum_x, sum_y = group_sum(x), group_sum(y)
+    sum_xx, sum_xy, sum_yy = group_sum(x * x), group_sum(x * y), group_sum(y * y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sxx = sum_xx - sum_x ** 2 / n
+        sxy = sum_xy - sum_x * sum_y / n
+        syy = sum_yy - sum_y ** 2 / n
+        # rounding errors of equal arguments are relative to their magnitude
+        slope = np.where(sxx > 1e-12 * sum_xx, sxy / sxx, np.nan)
+        intercept = (sum_y - slope * sum_x) / n
+        r_squared = np.where(syy > 0, sxy ** 2 / (sxx * syy), 1.0)
+    return {
+        "slope": slope,
+        "intercept": intercept,
+        "r_squared": np.where(np.isnan(slope), np.nan, r_squared),
+        "points": n,
+    }
+
+
 def plot_grid(
     ax: Axes,
     colors: np.ndarray,
@@ -198,38 +298,93 @@ def get_chip_rectangles(ctx: AnalyzerContext, chips: Sequence[SimpleChip]):
     :param chips: A sequence of chip objects.
     :return:
     """
-    for chip in chips:
-        try:
-            yield chip.x_coordinate, chip.y_coordinate, chip.width, chip.height
-        except (AttributeError, ValueError) as e:
-            ctx.logger.warning(f"Failed to get chip rectangle for {chip}. {e}")
+    geometry = ChipGeometry.get_chips_frame(chips)[["x", "y", "width", "height"]]
+    for chip, rectangle in zip(chips, geometry.itertuples(index=False, name=None), strict=True):
+        if np.isnan(rectangle).any():
+            ctx.logger.warning(f"Failed to get chip rectangle for {chip}.")
             yield None
+        else:
+            yield rectangle
+
+
+class VoltagePanel(TypedDict):
+    voltage: float  # V
+    data: np.ndarray
+    rectangles: list[tuple[float, float, float, float] | None]
+    passed: np.ndarray | None
 
 
 @pass_analyzer_context
-def plot_measurements_by_voltage(
+def get_voltage_panels(
     ctx: AnalyzerContext,
-    values: Sequence[IVMeasurement] | Sequence[CVMeasurement],
-    voltages: Sequence[Decimal],
+    values: pd.DataFrame,
+    chips: Mapping[str, SimpleChip],
+    voltages: Sequence[int],
     quantile: tuple[float, float],
-    thresholds: dict[Decimal, float],
-) -> (Figure, Sequence[Sequence[Axes]]):
+    thresholds: ThresholdMatrix,
+    chips_type: str,
+) -> list[VoltagePanel | None]:
     """
-    Plot data for IV or CV measurements across different voltages.
+    Extract plain per-voltage data from the chips x voltages frame, so that every voltage can be
+    plotted independently (and in a separate process) from the ORM objects.
     :param ctx: The context object (provided by the click decorator).
-    :param values: A sequence of IV or CV measurement objects.
-    :param voltages: A sequence of voltages to plot.
+    :param values: DataFrame with chip names as index and voltage keys as columns.
+    :param chips: A mapping of chip names to chip objects.
+    :param voltages: A sequence of voltage keys to plot.
     :param quantile: A tuple representing the lower and upper quantiles for data clipping.
-    :param thresholds: A dictionary mapping voltages to threshold values for failure map mode.
-                       Used only if quantile is [0, 0].
-    :return: A tuple containing the figure and 2d axes array.
+    :param thresholds: Thresholds of all chip types for failure map mode.
+    :param chips_type: The type of the chips.
+    :return: A list of panels in order of sorted voltages, None for voltages without data.
     """
     failure_map = quantile == (0, 0)
-    cols_num = 1 if failure_map else 2
+    panels: list[VoltagePanel | None] = []
+    for voltage in sorted(voltages):
+        if voltage not in values.columns:
+            panels.append(None)
+            continue
+        column = cast(pd.Series, values[voltage]).dropna()
+        if column.empty:
+            panels.append(None)
+            continue
+        
+        data = column.to_numpy(dtype=np.float64)
+        volts = float(voltage / MICROVOLTS_PER_VOLT)
+        passed = None
+        if failure_map:
+            threshold = thresholds.get_thresholds([chips_type], [voltage])[0, 0]
+            if np.isnan(threshold):
+                ctx.logger.warning(f"Thresholds for {volts:g}V are not found. Skipping.")
+                panels.append(None)
+                continue
+            passed = thresholds.get_pass_mask(data, threshold)
+        
+        panels.append({
+            "voltage": volts,
+            "data": data,
+            "rectangles": list(get_chip_rectangles([chips[name] for name in column.index])),
+            "passed": passed,
+        })
+    return panels
+
+
+def plot_measurements_by_voltage(
+    panels: Sequence[VoltagePanel | None],
+    quantile: tuple[float, float],
+    hist_xlabel: str,
+) -> (Figure, Sequence[Sequence[Axes]]):
+    """
+    Plot data for IV or CV measurements across different voltages into a single figure.
+    :param panels: Per-voltage data returned by `get_voltage_panels`.
+    :param quantile: A tuple representing the lower and upper quantiles for data clipping.
+                     Failure map is plotted if quantile is [0, 0].
+    :param hist_xlabel: Label of the histogram x-axis.
+    :return: A tuple containing the figure and 2d axes array.
+    """
+    cols_num = get_panel_columns_number(quantile)
     fig, axes = plt.subplots(
-        nrows=len(voltages),
+        nrows=len(panels),
         ncols=cols_num,
-        figsize=(5 * cols_num, 5 * len(voltages)),
+        figsize=(5 * cols_num, 5 * len(panels)),
         gridspec_kw={
             "left": 0.1,
             "right": 0.95,
@@ -239,49 +394,199 @@ def plot_measurements_by_voltage(
             "hspace": 0.35,
         },
     )
-    axes = axes.reshape(-1, cols_num)
+    axes = np.atleast_1d(axes).reshape(-1, cols_num)
     
     with click.progressbar(
-        zip(axes, sorted(voltages), strict=True), label="Plotting...", length=len(voltages)
+        zip(axes, panels, strict=True), label="Plotting...", length=len(panels)
     ) as progress:
-        for v_axes, voltage in progress:
-            target_measurements = [m for m in values if m.voltage_input == voltage]
-            if len(target_measurements) == 0:
+        for v_axes, panel in progress:
+            if panel is None:
                 continue
-            
-            if is_iv_measurements(target_measurements):
-                chips = [measurement.conditions.chip for measurement in target_measurements]
-                data = np.array([value.get_anode_current_value() for value in target_measurements])
-                
-                hist_xlabel = 'Anode current [pA]'
-            elif is_cv_measurements(target_measurements):
-                data = np.array([value.capacitance for value in target_measurements])
-                chips = [measurement.chip for measurement in target_measurements]
-                
-                hist_xlabel = 'Capacitance [pF]'
-            else:
-                raise RuntimeError("Unknown object type was provided")
-            
-            rectangles = get_chip_rectangles(chips)
-            
-            if failure_map:
-                v_thresholds = thresholds.get(voltage)
-                if v_thresholds is None:
-                    ctx.logger.warning(f"Thresholds for {voltage}V are not found. Skipping.")
-                    continue
-                
-                plot_failure_map(v_axes[0], data, rectangles, v_thresholds)
-            else:
-                hist_ax, map_ax = v_axes
-                plot_heatmap_and_histogram((hist_ax, map_ax), data, rectangles, quantile)
-                hist_ax.set_xlabel(hist_xlabel)
-            
-            for ax in v_axes:
-                ax.set_title(f"{voltage}V")
+            plot_voltage_panel(v_axes, panel, quantile, hist_xlabel)
     
     return fig, axes
 
 
+def get_panel_columns_number(quantile: tuple[float, float]) -> int:
+    return 1 if quantile == (0, 0) else 2
+
+
+def plot_voltage_panel(
+    v_axes: Sequence[Axes],
+    panel: VoltagePanel,
+    quantile: tuple[float, float],
+    hist_xlabel: str,
+) -> None:
+    """
+    Plot a single voltage row: either a failure map or a histogram with a heatmap.
+    :param v_axes: Axes of the row.
+    :param panel: Data of the voltage to plot.
+    :param quantile: A tuple representing the lower and upper quantiles for data clipping.
+    :param hist_xlabel: Label of the histogram x-axis.
+    """
+    if panel["passed"] is not None:
+        plot_failure_map(v_axes[0], panel["passed"], panel["rectangles"])
+    else:
+        hist_ax, map_ax = v_axes
+        plot_heatmap_and_histogram(
+            (hist_ax, map_ax), panel["data"], panel["rectangles"], quantile
+        )
+        hist_ax.set_xlabel(hist_xlabel)
+    
+    for ax in v_axes:
+        ax.set_title(f"{panel['voltage']:g}V")
+
+
+def create_panel_figure(quantile: tuple[float, float]) -> tuple[Figure, np.ndarray]:
+    cols_num = get_panel_columns_number(quantile)
+    fig, axes = plt.subplots(
+        nrows=1,
+        ncols=cols_num,
+        figsize=(5 * cols_num, 5.5),
+        gridspec_kw={"left": 0.1, "right": 0.95, "bottom": 0.1, "top": 0.85, "wspace": 0.3},
+    )
+    return fig, np.atleast_1d(axes)
+
+
+def render_voltage_panel(
+    panel: VoltagePanel,
+    quantile: tuple[float, float],
+    hist_xlabel: str,
+    dpi: int,
+) -> bytes:
+    """
+    Render a single voltage row as a separate PNG image. It is executed in worker processes,
+    so it accepts only picklable arguments.
+    :return: PNG image content.
+    """
+    fig, axes = create_panel_figure(quantile)
+    plot_voltage_panel(axes, panel, quantile, hist_xlabel)
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_title(title: str, width: float, dpi: int) -> bytes:
+    fig = plt.figure(figsize=(width, 0.6))
+    fig.suptitle(title, fontsize=14, y=0.5, va="center")
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+@pass_analyzer_context
+def save_measurements_plot(
+    ctx: AnalyzerContext,
+    file_name: str,
+    title: str,
+    panels: Sequence[VoltagePanel | None],
+    quantile: tuple[float, float],
+    hist_xlabel: str,
+    jobs: int = 1,
+    plot_format: Literal["png", "pdf"] = "png",
+    dpi: int = 300,
+) -> str:
+    """
+    Plot per-voltage panels and save them to a file.
+    
+    With a single job, PNG is rendered as one figure, as it always was. With several jobs, every
+    voltage is rendered as a separate figure in a worker process and the images are stitched
+    together, so that wall time and peak memory do not grow with the number of voltages.
+    PDF gets one page per voltage, pages are rendered one at a time.
+    :param ctx: The context object (provided by the click decorator).
+    :param file_name: File name without extension.
+    :param title: Title of the plot.
+    :param panels: Per-voltage data returned by `get_voltage_panels`.
+    :param quantile: A tuple representing the lower and upper quantiles for data clipping.
+    :param hist_xlabel: Label of the histogram x-axis.
+    :param jobs: Number of worker processes.
+    :param plot_format: Format of the output file.
+    :param dpi: Resolution of the output image.
+    :return: Name of the saved file.
+    """
+    plot_file_name = f"{file_name}.{plot_format}"
+    if plot_format == "pdf":
+        with PdfPages(plot_file_name) as pdf, click.progressbar(
+            [p for p in panels if p is not None], label="Plotting..."
+        ) as progress:
+            for panel in progress:
+                fig, axes = create_panel_figure(quantile)
+                plot_voltage_panel(axes, panel, quantile, hist_xlabel)
+                fig.suptitle(title, fontsize=14)
+                pdf.savefig(fig)
+                plt.close(fig)
+    elif jobs == 1:
+        fig, _ = plot_measurements_by_voltage(panels, quantile, hist_xlabel)
+        fig.suptitle(title, fontsize=14)
+        fig.savefig(plot_file_name, dpi=dpi)
+        plt.close(fig)
+    else:
+        ctx.logger.info(f"Plotting with {jobs} worker processes...")
+        render = partial(render_voltage_panel, quantile=quantile, hist_xlabel=hist_xlabel, dpi=dpi)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            images = list(executor.map(render, [p for p in panels if p is not None]))
+        if not images:
+            ctx.logger.warning("There is no data to plot.")
+            return plot_file_name
+        stitch_images(plot_file_name, title, images, dpi)
+    return plot_file_name
+
+
+def stitch_images(file_name: str, title: str, images: Sequence[bytes], dpi: int) -> None:
+    """
+    Stack PNG images vertically under the title and save the result as PNG. The result is
+    written row by row: only one image is decoded at a time and the stitched image is never
+    held in memory.
+    """
+    width = max(get_png_size(image)[0] for image in images)
+    images = [render_title(title, width / dpi, dpi), *images]
+    height = sum(get_png_size(image)[1] for image in images)
+    pixels_per_meter = round(dpi / 0.0254)
+    compressor = zlib.compressobj()
+    with open(file_name, "wb") as file:
+        file.write(PNG_SIGNATURE)
+        # 8-bit RGB, no interlacing
+        write_png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        write_png_chunk(file, b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1))
+        for image in images:
+            data = compressor.compress(get_png_scanlines(image, width))
+            if data:
+                write_png_chunk(file, b"IDAT", data)
+        write_png_chunk(file, b"IDAT", compressor.flush())
+        write_png_chunk(file, b"IEND", b"")
+
+
+def get_png_size(image: bytes) -> tuple[int, int]:
+    """
+    Get width and height of a PNG image without decoding it.
+    """
+    with Image.open(BytesIO(image)) as opened:
+        return opened.size
+
+
+def get_png_scanlines(image: bytes, width: int) -> bytes:
+    """
+    Decode a PNG image into unfiltered RGB scanlines of the given width, cropped or padded with
+    white on the right.
+    """
+    with Image.open(BytesIO(image)) as opened:
+        pixels = np.asarray(opened.convert("RGB"))[:, :width]
+    rows = np.full((pixels.shape[0], width * 3 + 1), 255, dtype=np.uint8)
+    # filter type 0 (none) at the start of every scanline
+    rows[:, 0] = 0
+    rows[:, 1:pixels.shape[1] * 3 + 1] = pixels.reshape(pixels.shape[0], -1)
+    return rows.tobytes()
+
+
+def write_png_chunk(file: BinaryIO, chunk_type: bytes, data: bytes) -> None:
+    file.write(struct.pack(">I", len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
 def plot_heatmap_and_histogram(
     v_axes: (Axes, Axes),
     data: np.ndarray,
@@ -319,19 +624,17 @@ def plot_heatmap_and_histogram(
 
 def plot_failure_map(
     ax: Axes,
-    data: np.ndarray,
+    passed: np.ndarray,
     rectangles: Iterable[tuple[float, float, float, float]],
-    threshold: float,
 ) -> None:
     """
-    Plot a failure map based on the provided threshold.
+    Plot a failure map of the chips.
     :param ax: Axes object to plot the failure map.
-    :param data: 2d numpy array containing the data to be plotted.
+    :param passed: Pass mask of the chips as returned by `ThresholdMatrix.get_pass_mask`.
     :param rectangles: A sequence of tuples containing the x, y, width, and height of the chips.
-    :param threshold: The threshold value for the failure map.
     :return:
     """
-    colors = (data > threshold).astype(np.float32)
+    colors = passed.astype(np.float32)
     cmap = ListedColormap(["#ff3030", "#30ff30"], "red_green")
     
     # Plot the failure map with red/green based on thresholds
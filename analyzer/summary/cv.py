@@ -5,49 +5,77 @@ from datetime import (
 from decimal import Decimal
 from typing import (
     Iterable,
+    Literal,
+    Sequence,
     TypedDict,
 )
 
 import click
 import pandas as pd
-from openpyxl.styles import PatternFill
 from pandas import DataFrame
-from sqlalchemy.orm import (
-    Query,
-    joinedload,
+from sqlalchemy import (
+    Select,
+    func,
+    select,
 )
 
 from orm import (
     CVMeasurement,
     AbstractChip,
+    ChipGeometry,
     ChipState,
     Wafer,
 )
 from utils import (
     EntityOption,
+    ThresholdMatrix,
     get_indexed_filename,
     get_thresholds,
+    to_voltage_keys,
     validate_chip_types,
+    voltage_key_expression,
     wafer_loader,
 )
 from .common import (
-    apply_conditional_formatting,
+    chunk_size_option,
     date_formats,
     date_formats_help,
     get_info,
     get_slice_by_voltages,
-    plot_measurements_by_voltage,
+    get_threshold_ranges,
+    get_voltage_panels,
+    jobs_option,
+    plot_format_option,
+    read_query_chunks,
+    save_measurements_plot,
+    to_decimal_voltage_columns,
+    to_volt_columns,
+)
+from .cv_profile import (
+    CVProfile,
+    get_cv_profile,
+    get_cv_profile_frame,
+)
+from .export import (
+    get_summary_extensions,
+    no_plot_option,
+    output_formats_option,
+    save_summary_frame,
 )
 from ..context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from ..excel import (
+    excel_engine_option,
+    get_report_writer,
+)
 
 
 class SheetsCVData(TypedDict):
     capacitance: DataFrame
     chip_names: list[str]
-    voltages: list[Decimal]
+    voltages: list[int]
 
 
 @click.command(name="cv")
@@ -90,6 +118,19 @@ class SheetsCVData(TypedDict):
     type=click.DateTime(formats=date_formats),
     help=f"Include measurements after (inclusive) provided date and time. {date_formats_help}",
 )
+@jobs_option
+@plot_format_option
+@excel_engine_option
+@output_formats_option
+@no_plot_option
+@chunk_size_option
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Extract depletion width, doping profile and full depletion voltage from the whole "
+         "CV curves of all chips. Results are added to xlsx and saved to a separate Parquet file.",
+)
 def summary_cv(
     ctx: AnalyzerContext,
     chips_type: str | None,
@@ -98,75 +139,193 @@ def summary_cv(
     quantile: tuple[float, float],
     before: datetime | date | None,
     after: datetime | date | None,
+    jobs: int,
+    plot_format: Literal["png", "pdf"],
+    excel_engine: str,
+    output_formats: Sequence[str],
+    no_plot: bool,
+    chunk_size: int | None,
+    profile: bool,
 ):
     """
     Make summary (png and xlsx) for CV measurements' data.
     """
-    query: Query = (
-        ctx.session.query(CVMeasurement)
-        .filter(CVMeasurement.chip.has(AbstractChip.wafer == wafer))
-        .options(joinedload(CVMeasurement.chip))
-    )
-    
-    if chips_type is not None:
-        query = query.filter(CVMeasurement.chip.has(AbstractChip.type == chips_type))
-    else:
+    if chips_type is None:
         ctx.logger.info(
             "Chips type (-t or --chips-type) is not specified. Analyzing all chip types."
         )
     
-    query = query.filter(CVMeasurement.chip_state_id.in_((c.id for c in chip_states)))
-    
     if before is not None or after is not None:
         after = after if after is not None else date.min
         before = before if before is not None else date.max
-        query = query.filter(CVMeasurement.datetime.between(after, before))
     
-    measurements: list[CVMeasurement] = query.all()
+    query = get_cv_measurements_query(wafer, chip_states, chips_type, after, before)
+    # measurements are deduplicated by the database, thus the chunks together are not bigger
+    # than the summary
+    measurements_df = pd.concat(
+        read_query_chunks(ctx.session, query, chunk_size), ignore_index=True
+    )
     
-    if not measurements:
+    if measurements_df.empty:
         ctx.logger.warning("No measurements found.")
         return
     
     chips_types = (
         {chips_type}
         if chips_type is not None
-        else {measurement.chip.type for measurement in measurements}
+        else set(measurements_df["chip_type"])
     )
     
-    sheets_data = get_sheets_cv_data(measurements)
-    voltages = sorted(Decimal(v) for v in ["-5", "0", "-35", "-10"])
+    measurements_df = measurements_df.astype({"capacitance": "float64"})
+    measurements_df["datetime"] = pd.to_datetime(measurements_df["datetime"])
+    sheets_data = get_sheets_cv_data(measurements_df)
+    voltages = sorted(to_voltage_keys(["-5", "0", "-35", "-10"]).tolist())
     thresholds = get_thresholds(ctx.session, "CV")
     
-    file_name = get_indexed_filename(f"Summary-CV-{wafer.name}", ("png", "xlsx"))
+    file_name = get_indexed_filename(
+        f"Summary-CV-{wafer.name}",
+        get_summary_extensions(output_formats, None if no_plot else plot_format),
+    )
+    
+    if not no_plot:
+        plot_cv_summary(
+            file_name,
+            wafer.name,
+            sheets_data["capacitance"],
+            measurements_df["chip_id"].unique().tolist(),
+            chips_types,
+            voltages,
+            quantile,
+            thresholds,
+            jobs,
+            plot_format,
+        )
+    
+    cv_profile = None
+    if profile:
+        cv_profile = get_summary_cv_profile(measurements_df, sheets_data["capacitance"])
     
+    info = get_info(wafer=wafer, chip_states=chip_states, datetimes=measurements_df["datetime"])
+    if "xlsx" in output_formats:
+        exel_file_name = f"{file_name}.xlsx"
+        save_cv_summary_to_excel(
+            sheets_data, info, exel_file_name, voltages, thresholds, excel_engine, cv_profile
+        )
+        ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    
+    save_cv_summary_data(
+        file_name, sheets_data, cv_profile, [f for f in output_formats if f != "xlsx"], info
+    )
+
+
+@pass_analyzer_context
+def plot_cv_summary(
+    ctx: AnalyzerContext,
+    file_name: str,
+    title: str,
+    capacitance_df: pd.DataFrame,
+    chip_ids: Sequence[int],
+    chips_types: set[str],
+    voltages: Sequence[int],
+    quantile: tuple[float, float],
+    thresholds: dict[str, dict[Decimal, float]],
+    jobs: int,
+    plot_format: Literal["png", "pdf"],
+) -> None:
+    """
+    Plot capacitance of the chips of a single type by voltage.
+    """
     if len(chips_types) > 1:
         ctx.logger.warning(
             f"Multiple chip types are found ({chips_types}). "
             "Plotting is not supported and will be skipped.")
-    else:
-        chips_type = next(iter(chips_types))
-        fig, axes = plot_measurements_by_voltage(measurements, voltages, quantile, thresholds.get(chips_type, {}))
-        fig.suptitle(wafer.name, fontsize=14)
-        
-        png_file_name = f"{file_name}.png"
-        
-        fig.savefig(png_file_name, dpi=300)
-        ctx.logger.info(f"Summary data is plotted to {png_file_name}")
-    
-    exel_file_name = f"{file_name}.xlsx"
-    info = get_info(wafer=wafer, chip_states=chip_states, measurements=measurements)
-    save_cv_summary_to_excel(sheets_data, info, exel_file_name, voltages, thresholds)
+        return
+    chips = ctx.session.query(AbstractChip).filter(AbstractChip.id.in_(chip_ids)).all()
+    panels = get_voltage_panels(
+        capacitance_df,
+        {chip.name: chip for chip in chips},
+        voltages,
+        quantile,
+        ThresholdMatrix(thresholds, "CV"),
+        next(iter(chips_types)),
+    )
+    plot_file_name = save_measurements_plot(
+        file_name, title, panels, quantile, "Capacitance [pF]", jobs, plot_format
+    )
+    ctx.logger.info(f"Summary data is plotted to {plot_file_name}")
+
+
+@pass_analyzer_context
+def get_summary_cv_profile(
+    ctx: AnalyzerContext,
+    measurements_df: pd.DataFrame,
+    capacitance_df: pd.DataFrame,
+) -> CVProfile:
+    """
+    Get the profile of CV curves of all chips using areas of their types.
+    :param ctx: The context object (provided by the click decorator).
+    :param measurements_df: Measurements with chip and chip_type columns.
+    :param capacitance_df: Capacitance with chips as rows and voltage keys as columns.
+    :return: The profile with voltages in V as columns.
+    """
+    chip_types = measurements_df.drop_duplicates("chip").set_index("chip")["chip_type"]
+    areas = get_chip_areas(chip_types)
+    if areas.isna().any():
+        ctx.logger.warning(
+            f"Area of chip types {sorted(set(chip_types[areas.isna()]))} is unknown. "
+            "Their depletion width and doping will be empty."
+        )
+    return get_cv_profile(to_volt_columns(capacitance_df), areas)
+
+
+@pass_analyzer_context
+def save_cv_summary_data(
+    ctx: AnalyzerContext,
+    file_name: str,
+    sheets_data: SheetsCVData,
+    cv_profile: CVProfile | None,
+    data_formats: Sequence[str],
+    info: pd.Series,
+) -> None:
+    """
+    Save the long summary frame to data files of the given formats and the CV profile to a
+    Parquet file.
+    """
+    if data_formats:
+        data_file_names = save_summary_frame(
+            file_name, get_cv_summary_frame(sheets_data), data_formats, {"type": "CV", **info}
+        )
+        for data_file_name in data_file_names:
+            ctx.logger.info(f"Summary data is saved to {data_file_name}")
     
-    ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    if cv_profile is not None:
+        profile_file_names = save_summary_frame(
+            f"{file_name}-profile",
+            get_cv_profile_frame(to_volt_columns(sheets_data["capacitance"]), cv_profile),
+            ["parquet"],
+            {"type": "CV profile", **info},
+        )
+        for profile_file_name in profile_file_names:
+            ctx.logger.info(f"CV profile is saved to {profile_file_name}")
+
+
+def get_chip_areas(chip_types: pd.Series) -> pd.Series:
+    """
+    Get areas of the chips in mm², NaN for chip types without known size.
+    :param chip_types: Types of the chips indexed by chip names.
+    :return:
+    """
+    return pd.Series(ChipGeometry.get_areas(chip_types), index=chip_types.index)
 
 
 def save_cv_summary_to_excel(
     sheets_data: SheetsCVData,
     info: pd.Series,
     file_name: str,
-    voltages: Iterable[Decimal],
+    voltages: Iterable[int],
     thresholds: dict[str, dict[Decimal, float]],
+    engine: str = "openpyxl",
+    cv_profile: CVProfile | None = None,
 ):
     """
         Save the CV summary data to an Excel file.
@@ -174,46 +333,122 @@ def save_cv_summary_to_excel(
     :param sheets_data: The data to be saved.
     :param info: Additional information to be saved in the Excel file.
     :param file_name: The name of the Excel file to save the data to.
-    :param voltages: The voltages to be included in the summary.
+    :param voltages: The voltage keys to be included in the summary.
     :param thresholds: The thresholds for conditional formatting.
+    :param engine: The library to write the Excel file with.
+    :param cv_profile: The profile of CV curves to be saved in additional sheets.
     :return: None
     """
-    summary_df = get_slice_by_voltages(sheets_data["capacitance"], voltages)
+    summary_df = to_decimal_voltage_columns(
+        get_slice_by_voltages(sheets_data["capacitance"], voltages)
+    )
     rules = {
-        "greaterThanOrEqual": PatternFill(bgColor="ee9090", fill_type="solid"),
-        "lessThan": PatternFill(bgColor="90ee90", fill_type="solid"),
+        "greaterThanOrEqual": "ee9090",
+        "lessThan": "90ee90",
     }
     
-    with pd.ExcelWriter(file_name) as writer:
-        summary_df.to_excel(writer, sheet_name="Summary")
-        apply_conditional_formatting(
-            writer.book["Summary"],
+    with get_report_writer(file_name, engine) as writer:
+        writer.write_frame(summary_df, "Summary")
+        writer.add_threshold_rules(
+            "Summary",
+            get_threshold_ranges(summary_df, thresholds),
             rules,
-            thresholds,
         )
         
-        sheets_data["capacitance"].rename(columns=float).to_excel(writer, sheet_name="All data")
-        info.to_excel(writer, sheet_name="Info")
+        writer.write_frame(to_volt_columns(sheets_data["capacitance"]), "All data")
+        if cv_profile is not None:
+            writer.write_frame(cv_profile.full_depletion, "Full depletion")
+            writer.write_frame(cv_profile.depletion_width, "Depletion width, um")
+            writer.write_frame(cv_profile.doping, "Doping, cm^-3", "0.00E+00")
+        writer.write_frame(info, "Info")
 
 
-def get_sheets_cv_data(
-    measurements: list[CVMeasurement],
-) -> SheetsCVData:
+def get_cv_summary_frame(sheets_data: SheetsCVData) -> pd.DataFrame:
+    """
+    Convert CV sheets data into a long frame with one row per chip and voltage.
     """
-     Extract CV measurements data from given sequence of measurements into separate dataframes.
-    :param measurements: sequence of measurements
+    df = (
+        to_volt_columns(sheets_data["capacitance"])
+        .rename_axis(index="chip", columns="voltage")
+        .stack(future_stack=True)
+        .astype("float64")
+        .dropna()
+        .rename("capacitance")
+        .reset_index()
+    )
+    return df.sort_values(["chip", "voltage"], ignore_index=True)
+
+
+def get_cv_measurements_query(
+    wafer: Wafer,
+    chip_states: Iterable[ChipState],
+    chips_type: str | None = None,
+    after: datetime | date | None = None,
+    before: datetime | date | None = None,
+) -> Select:
+    """
+    Build a query of CV measurements projected to the columns needed for the summary.
+    Only the latest measurement of every chip and voltage is selected, voltages are selected as
+    voltage keys.
+    :param wafer: The wafer of the chips.
+    :param chip_states: The states of the chips.
+    :param chips_type: The type of the chips, all types if None.
+    :param after: Include measurements after (inclusive) the date.
+    :param before: Include measurements before (exclusive) the date.
     :return:
     """
-    chip_names: list[str] = sorted({measurement.chip.name for measurement in measurements})
-    voltages: list[Decimal] = sorted({measurement.voltage_input for measurement in measurements})
-    capacitance_df = pd.DataFrame(index=pd.Index(chip_names), columns=pd.Index(voltages))
-    with click.progressbar(measurements, label="Processing measurements...") as progress:
-        for measurement in progress:
-            measurement: CVMeasurement
-            cell_location = (measurement.chip.name, measurement.voltage_input)
-            capacitance_df.loc[cell_location] = measurement.capacitance
+    row_number = func.row_number().over(
+        partition_by=(CVMeasurement.chip_id, CVMeasurement.voltage_input),
+        order_by=(CVMeasurement.datetime.desc(), CVMeasurement.id.desc()),
+    )
+    ranked_query = (
+        select(
+            CVMeasurement.chip_id,
+            AbstractChip.name.label("chip"),
+            AbstractChip.type.label("chip_type"),
+            voltage_key_expression(CVMeasurement.voltage_input).label("voltage"),
+            CVMeasurement.capacitance,
+            CVMeasurement.datetime,
+            row_number.label("row_number"),
+        )
+        .join(CVMeasurement.chip)
+        .filter(
+            AbstractChip.wafer_id == wafer.id,
+            CVMeasurement.chip_state_id.in_([c.id for c in chip_states]),
+        )
+    )
+    if chips_type is not None:
+        ranked_query = ranked_query.filter(AbstractChip.type == chips_type)
+    if after is not None and before is not None:
+        ranked_query = ranked_query.filter(CVMeasurement.datetime.between(after, before))
+    
+    ranked = ranked_query.subquery()
+    return (
+        select(
+            ranked.c.chip_id,
+            ranked.c.chip,
+            ranked.c.chip_type,
+            ranked.c.voltage,
+            ranked.c.capacitance,
+            ranked.c.datetime,
+        )
+        .where(ranked.c.row_number == 1)
+    )
+
+
+def get_sheets_cv_data(measurements_df: pd.DataFrame) -> SheetsCVData:
+    """
+    Pivot CV measurements into a dataframe with chips as rows and voltage keys as columns.
+    :param measurements_df: The measurements with one row per chip and voltage key.
+    :return:
+    """
+    capacitance_df = (
+        measurements_df.pivot(index="chip", columns="voltage", values="capacitance")
+        .astype("float64")
+        .rename_axis(index=None, columns=None)
+    )
     return {
         "capacitance": capacitance_df,
-        "chip_names": chip_names,
-        "voltages": voltages,
+        "chip_names": capacitance_df.index.tolist(),
+        "voltages": capacitance_df.columns.tolist(),
     }
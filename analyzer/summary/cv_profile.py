@@ -0,0 +1,143 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+VACUUM_PERMITTIVITY = 8.8541878128e-12  # F/m
+SILICON_PERMITTIVITY = 11.7 * VACUUM_PERMITTIVITY  # F/m
+ELEMENTARY_CHARGE = 1.602176634e-19  # C
+FULL_DEPLETION_SLOPE_RATIO = 0.1
+
+
+class CVProfile(NamedTuple):
+    """
+    Results of CV profiling. Frames have chips as rows and voltages as columns.
+    """
+    depletion_width: pd.DataFrame  # um
+    doping: pd.DataFrame  # cm^-3
+    full_depletion: pd.DataFrame  # one row per chip
+
+
+def get_ragged_gradient(y: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    Calculate the gradient of every row of `y` over `x` skipping missing (NaN) values.
+    The gradient of a point is the slope between its previous and next valid neighbours,
+    or between the point and its only neighbour at the edges.
+    :param y: 2d array of values, rows are separate curves with gaps.
+    :param x: 1d array of arguments shared by all rows.
+    :return: 2d array of the same shape, NaN where the gradient can't be calculated.
+    """
+    rows_number, columns_number = y.shape
+    valid = ~np.isnan(y)
+    columns = np.arange(columns_number)
+    
+    # index of the closest valid point before and after every point
+    previous = np.maximum.accumulate(np.where(valid, columns, -1), axis=1)
+    previous = np.hstack([np.full((rows_number, 1), -1), previous[:, :-1]])
+    following = np.minimum.accumulate(
+        np.where(valid, columns, columns_number)[:, ::-1], axis=1
+    )[:, ::-1]
+    following = np.hstack([following[:, 1:], np.full((rows_number, 1), columns_number)])
+    
+    left = np.where(previous >= 0, previous, columns)
+    right = np.where(following < columns_number, following, columns)
+    rows = np.arange(rows_number)[:, None]
+    dx = x[right] - x[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gradient = (y[rows, right] - y[rows, left]) / dx
+    gradient[~valid | (dx == 0)] = np.nan
+    return gradient
+
+
+def get_cv_profile(
+    capacitance: pd.DataFrame,
+    areas: pd.Series,
+    full_depletion_ratio: float = FULL_DEPLETION_SLOPE_RATIO,
+) -> CVProfile:
+    """
+    Extract depletion width and doping concentration vs depth from CV curves of all chips at once.
+    Depletion width is W = εA/C, doping is N = 2 / (qεA² |d(1/C²)/dV|). Full depletion voltage
+    is the first voltage after the steepest part of 1/C² curve where its slope drops below
+    `full_depletion_ratio` of the maximum.
+    :param capacitance: Capacitance in F with chip names as index and voltages as columns.
+    :param areas: Areas of the chips in mm² indexed by chip names.
+    :param full_depletion_ratio: Slope ratio that defines full depletion.
+    :return:
+    """
+    voltages = capacitance.columns.to_numpy(dtype="float64")
+    # reverse bias grows with absolute value of voltage
+    order = np.argsort(np.abs(voltages), kind="stable")
+    bias = np.abs(voltages[order])
+    values = capacitance.to_numpy(dtype="float64")[:, order]
+    values = np.where(values > 0, values, np.nan)
+    area = areas.reindex(capacitance.index).to_numpy(dtype="float64")[:, None] * 1e-6  # m²
+    
+    width = SILICON_PERMITTIVITY * area / values  # m
+    slope = np.abs(get_ragged_gradient(1 / values ** 2, bias))
+    with np.errstate(divide="ignore"):
+        doping = 2 / (ELEMENTARY_CHARGE * SILICON_PERMITTIVITY * area ** 2 * slope)  # m^-3
+    doping[~np.isfinite(doping)] = np.nan
+    
+    rows = np.arange(len(values))
+    columns = np.arange(len(bias))
+    filled_slope = np.where(np.isnan(slope), -np.inf, slope)
+    steepest = filled_slope.argmax(axis=1)
+    max_slope = filled_slope[rows, steepest]
+    is_flat = (
+        (slope < full_depletion_ratio * max_slope[:, None])
+        & (columns[None, :] > steepest[:, None])
+    )
+    is_depleted = is_flat.any(axis=1)
+    first_flat = is_flat.argmax(axis=1)
+    
+    sorted_columns = capacitance.columns[order]
+    
+    def to_frame(array: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(array, index=capacitance.index, columns=sorted_columns).reindex(
+            columns=capacitance.columns
+        )
+    
+    full_depletion = pd.DataFrame(
+        {
+            "Full depletion voltage": np.where(
+                is_depleted, voltages[order][first_flat], np.nan
+            ),
+            "Depletion width [um]": np.where(
+                is_depleted, width[rows, first_flat] * 1e6, np.nan
+            ),
+            "Capacitance [F]": np.where(is_depleted, values[rows, first_flat], np.nan),
+        },
+        index=capacitance.index,
+    )
+    return CVProfile(
+        depletion_width=to_frame(width * 1e6),
+        doping=to_frame(doping * 1e-6),
+        full_depletion=full_depletion,
+    )
+
+
+def get_cv_profile_frame(capacitance: pd.DataFrame, profile: CVProfile) -> pd.DataFrame:
+    """
+    Convert CV profile into a long frame with one row per chip and voltage.
+    """
+    
+    def stack(df: pd.DataFrame) -> pd.Series:
+        return (
+            df.rename(columns=float)
+            .rename_axis(index="chip", columns="voltage")
+            .stack(future_stack=True)
+            .astype("float64")
+        )
+    
+    df = pd.concat(
+        {
+            "capacitance": stack(capacitance),
+            "depletion_width_um": stack(profile.depletion_width),
+            "doping_cm3": stack(profile.doping),
+        },
+        axis=1,
+    ).dropna(subset=["capacitance"]).reset_index()
+    df["full_depletion_voltage"] = df["chip"].map(
+        profile.full_depletion["Full depletion voltage"]
+    )
+    return df.sort_values(["chip", "voltage"], ignore_index=True)
@@ -1,20 +1,32 @@
-from itertools import chain
-from typing import Optional
+import re
+import warnings
+from itertools import batched
+from typing import (
+    Iterable,
+    Optional,
+    Sequence,
+)
 
 import click
+import numpy as np
 import pandas as pd
 from click.exceptions import Exit
 from matplotlib import pyplot as plt
+from matplotlib.artist import Artist
 from matplotlib.axes import Axes
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
-from sqlalchemy import text
-from sqlalchemy.orm import (
-    Query,
-    joinedload,
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+from sqlalchemy import (
+    Select,
+    select,
 )
 
 from orm import (
+    AbstractChip,
     EqeConditions,
+    EqeMeasurement,
     EqeSession,
     Wafer,
 )
@@ -24,10 +36,41 @@ from utils import (
     wafer_loader,
 )
 
+from .common import (
+    chunk_size_option,
+    read_query_chunks,
+)
+from .eqe_spectrum import (
+    get_eqe_metrics,
+    resample_curves,
+    smooth_curves,
+    wavelength_bands_callback,
+    wavelength_grid_callback,
+)
+from .export import (
+    get_summary_extensions,
+    no_plot_option,
+    output_formats_option,
+    save_summary_frame,
+)
 from ..context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from ..excel import (
+    excel_engine_option,
+    get_report_writer,
+)
+
+CONDITIONS_BATCH_SIZE = 1000
+MAX_PLOTTED_LINES = 50
+EQE_PROPERTIES = {
+    "eqe": ("EQE", "%"),
+    "light_current": ("Light current", "A"),
+    "dark_current": ("Dark current", "A"),
+    "responsivity": ("Responsivity", "A/W"),
+    "std": ("Standard deviation", "A"),
+}
 
 
 @click.command(name="eqe")
@@ -51,11 +94,51 @@ from ..context import (
     default=False,
     help="Exclude reference measurements from the plots",
 )
+@click.option(
+    "--max-lines",
+    type=click.IntRange(min=1),
+    default=MAX_PLOTTED_LINES,
+    show_default=True,
+    help="Maximal number of chips plotted as separate lines. Curves of more chips are "
+         "plotted as the median and percentile bands.",
+)
+@click.option(
+    "--grid",
+    callback=wavelength_grid_callback,
+    help="Resample all curves onto a common wavelength grid START:STOP:STEP in nm "
+         "(e.g. 300:1100:5). Grid points outside of the measured range of a curve are empty.",
+)
+@click.option(
+    "--smooth",
+    type=click.IntRange(min=1),
+    help="Smooth the resampled curves with a moving average over the given number of grid "
+         "points. Requires --grid.",
+)
+@click.option(
+    "--band",
+    "bands",
+    multiple=True,
+    callback=wavelength_bands_callback,
+    help="Wavelength band START:STOP in nm to average EQE in (e.g. 400:700). Adds EQE metrics "
+         "sheet with peak wavelength and peak EQE. Can be used multiple times.",
+)
+@excel_engine_option
+@output_formats_option
+@no_plot_option
+@chunk_size_option
 def summary_eqe(
     ctx: AnalyzerContext,
     wafer: Wafer | None,
     eqe_session: Optional[EqeSession],
     no_ref: bool,
+    max_lines: int,
+    grid: np.ndarray | None,
+    smooth: int | None,
+    bands: list[tuple[int, int]],
+    excel_engine: str,
+    output_formats: Sequence[str],
+    no_plot: bool,
+    chunk_size: int | None,
 ):
     """
     "Make summary (.png and .xlsx) for EQE measurements' data."
@@ -66,135 +149,400 @@ def summary_eqe(
         )
     if not eqe_session and not wafer:
         raise click.UsageError("Neither --wafer nor --session are specified")
+    if smooth is not None and grid is None:
+        raise click.UsageError("--smooth requires --grid")
     title = f"{wafer.name} wafer" if wafer else f"{eqe_session.date} session"
     
-    conditions = query_eqe_conditions(eqe_session, wafer.name)
-    if not conditions:
+    conditions_df, measurements_df = query_eqe_measurements(eqe_session, wafer, chunk_size)
+    if conditions_df.empty:
         ctx.logger.warning("No measurements found.")
         raise Exit(0)
     ctx.logger.info("EQE data is loaded.")
     
     file_name = f"Summary-EQE-{title.replace(' ', '-')}"
-    file_name = get_indexed_filename(file_name, ("png", "xlsx"))
-    png_file_name, exel_file_name = f"{file_name}.png", f"{file_name}.xlsx"
+    file_name = get_indexed_filename(
+        file_name, get_summary_extensions(output_formats, None if no_plot else "png")
+    )
     
-    fig = get_eqe_plot_figure(eqe_session, no_ref)
-    fig.suptitle(f"EQE summary for {title}")
-    fig.savefig(png_file_name, dpi=300)
-    ctx.logger.info(f"EQE data is plotted to {png_file_name}")
+    sheets_data, metrics_df = prepare_sheets_eqe_data(
+        conditions_df, measurements_df, grid, smooth, bands
+    )
     
-    sheets_data = get_sheets_eqe_data(conditions)
-    with pd.ExcelWriter(exel_file_name) as writer:
-        for sheet_data in sheets_data:
-            sheet_data["df"].to_excel(writer, sheet_name=sheet_data["name"])
+    if not no_plot:
+        png_file_name = f"{file_name}.png"
+        fig = get_eqe_plot_figure(sheets_data, no_ref, max_lines)
+        fig.suptitle(f"EQE summary for {title}")
+        fig.savefig(png_file_name, dpi=300)
+        ctx.logger.info(f"EQE data is plotted to {png_file_name}")
     
-    ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    if "xlsx" in output_formats:
+        exel_file_name = f"{file_name}.xlsx"
+        save_eqe_summary_to_excel(sheets_data, metrics_df, exel_file_name, excel_engine)
+        ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    
+    save_eqe_summary_data(
+        file_name, sheets_data, metrics_df, [f for f in output_formats if f != "xlsx"], title
+    )
+
+
+def prepare_sheets_eqe_data(
+    conditions_df: pd.DataFrame,
+    measurements_df: pd.DataFrame,
+    grid: np.ndarray | None,
+    smooth: int | None,
+    bands: Sequence[tuple[int, int]],
+) -> tuple[list[dict], pd.DataFrame | None]:
+    """
+    Get sheets data, resampled onto the grid and smoothed if requested, and EQE metrics in the
+    bands.
 
+    :param conditions_df: Conditions as returned by `query_eqe_measurements`.
+    :param measurements_df: Measurements as returned by `query_eqe_measurements`.
+    :param grid: Wavelength grid to resample the curves onto, the measured wavelengths if None.
+    :param smooth: Moving average window in grid points, no smoothing if None.
+    :param bands: Wavelength bands to average EQE in, no metrics if empty.
+    :return: Sheets data and EQE metrics (None if there are no bands).
+    """
+    sheets_data = get_sheets_eqe_data(conditions_df, measurements_df)
+    if grid is not None:
+        sheets_data = resample_sheets_eqe_data(sheets_data, grid, smooth)
+    if not bands:
+        return sheets_data, None
+    eqe_df = next(sheet["df"] for sheet in sheets_data if sheet.get("prop") == "eqe")
+    keys = ["Wafer", "Chip"]
+    return sheets_data, eqe_df[keys].join(get_eqe_metrics(eqe_df.drop(columns=keys), bands))
+
+
+def save_eqe_summary_to_excel(
+    sheets_data: list[dict],
+    metrics_df: pd.DataFrame | None,
+    file_name: str,
+    engine: str = "openpyxl",
+) -> None:
+    with get_report_writer(file_name, engine) as writer:
+        for sheet_data in sheets_data:
+            writer.write_frame(sheet_data["df"], sheet_data["name"])
+        if metrics_df is not None:
+            writer.write_frame(metrics_df, "EQE metrics")
+
+
+@pass_analyzer_context
+def save_eqe_summary_data(
+    ctx: AnalyzerContext,
+    file_name: str,
+    sheets_data: list[dict],
+    metrics_df: pd.DataFrame | None,
+    data_formats: Sequence[str],
+    title: str,
+) -> None:
+    """
+    Save the long summary frame and EQE metrics to data files of the given formats.
+    """
+    if not data_formats:
+        return
+    data_file_names = save_summary_frame(
+        file_name,
+        get_eqe_summary_frame(sheets_data),
+        data_formats,
+        {"type": "EQE", "Title": title},
+    )
+    for data_file_name in data_file_names:
+        ctx.logger.info(f"Summary data is saved to {data_file_name}")
+    if metrics_df is not None:
+        metrics_file_names = save_summary_frame(
+            f"{file_name}-metrics",
+            get_eqe_metrics_frame(metrics_df),
+            data_formats,
+            {"type": "EQE metrics", "Title": title},
+        )
+        for metrics_file_name in metrics_file_names:
+            ctx.logger.info(f"EQE metrics are saved to {metrics_file_name}")
+
+
+def get_eqe_plot_figure(
+    sheets_data: list[dict], no_ref: bool = False, max_lines: int = MAX_PLOTTED_LINES
+) -> Figure:
+    """
+    Plot the latest curve of every chip, one axis per property.
 
-def get_eqe_plot_figure(sheets_data, no_ref=False) -> Figure:
+    :param sheets_data: Sheets data created by `get_sheets_eqe_data`.
+    :param no_ref: Exclude reference chips from the plot.
+    :param max_lines: The maximal number of chips plotted as separate lines.
+    :return:
+    """
     plottable_sheets = [sheet for sheet in sheets_data if sheet.get("prop") is not None]
-    fig, axes = plt.subplots(len(plottable_sheets), 1, figsize=(10, 15))
+    fig, axes = plt.subplots(len(plottable_sheets), 1, figsize=(10, 15), squeeze=False)
     
+    legend_handles = []
     for sheet_data, ax in zip(plottable_sheets, axes.ravel()):
         ax: Axes
-        last_rows = sheet_data["df"].groupby(by=["Wafer", "Chip"]).last()
-        for (wafer_name, chip_name), series in last_rows.iterrows():
-            if wafer_name.upper() == "REF" and no_ref:
-                continue
-            xs = [key for key in series.dropna().keys() if isinstance(key, int)]
-            ys = [series[x] for x in xs]
-            ax.plot(xs, ys, label=f"{wafer_name} {chip_name}")
-            ax.set_xlabel("Wavelength, nm")
-            ax.set_ylabel(f"{sheet_data['name']}, {sheet_data['unit']}")
-            ax.legend(bbox_to_anchor=(1.05, 1), loc="upper left")
-        fig.tight_layout()
+        df = sheet_data["df"].drop_duplicates(subset=["Wafer", "Chip"], keep="last")
+        if no_ref:
+            df = df[df["Wafer"].str.upper() != "REF"]
+        handles = plot_eqe_curves(ax, df, max_lines)
+        legend_handles = legend_handles or handles
+        ax.set_xlabel("Wavelength, nm")
+        ax.set_ylabel(f"{sheet_data['name']}, {sheet_data['unit']}")
+    
+    if legend_handles:
+        axes[0, 0].legend(handles=legend_handles, bbox_to_anchor=(1.05, 1), loc="upper left")
+    fig.tight_layout()
     return fig
 
 
+def plot_eqe_curves(ax: Axes, df: pd.DataFrame, max_lines: int) -> list[Artist]:
+    """
+    Plot curves of all chips as a single line collection. If there are more than `max_lines`
+    chips, their curves are replaced by the median and percentile bands, while reference chips
+    are still drawn one by one.
+
+    :param ax: The axis to plot on.
+    :param df: One curve per row with Wafer and Chip columns followed by wavelengths.
+    :param max_lines: The maximal number of chips plotted as separate lines.
+    :return: Legend handles.
+    """
+    keys = ["Wafer", "Chip"]
+    values_df = df.drop(columns=keys)
+    wavelengths = values_df.columns.to_numpy(dtype="float64")
+    # gaps inside of the measured range are interpolated, so that the lines are continuous
+    values = resample_curves(values_df, wavelengths).to_numpy()
+    labels = (df["Wafer"] + " " + df["Chip"]).to_numpy()
+    handles: list[Artist] = []
+    
+    if len(df) > max_lines:
+        is_ref = (df["Wafer"].str.upper() == "REF").to_numpy()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # wavelengths without data
+            percentiles = np.nanpercentile(values[~is_ref], [5, 25, 50, 75, 95], axis=0)
+        ax.fill_between(wavelengths, percentiles[0], percentiles[4], color="C0", alpha=0.2)
+        ax.fill_between(wavelengths, percentiles[1], percentiles[3], color="C0", alpha=0.4)
+        ax.plot(wavelengths, percentiles[2], color="C0")
+        handles += [
+            Patch(color="C0", alpha=0.2, label=f"5-95% of {(~is_ref).sum()} chips"),
+            Patch(color="C0", alpha=0.4, label="25-75%"),
+            Line2D([], [], color="C0", label="Median"),
+        ]
+        values, labels = values[is_ref], labels[is_ref]
+    
+    colors = [f"C{i % 9 + 1}" for i in range(len(values))]
+    ax.add_collection(LineCollection(
+        [np.column_stack([wavelengths, curve]) for curve in values], colors=colors
+    ))
+    ax.autoscale_view()
+    handles += [Line2D([], [], color=color, label=label) for color, label in zip(colors, labels)]
+    return handles
+
+
 @pass_analyzer_context
-def query_eqe_conditions(ctx: AnalyzerContext, eqe_session, wafer_name) -> list[EqeConditions]:
+def query_eqe_measurements(
+    ctx: AnalyzerContext,
+    eqe_session: EqeSession | None,
+    wafer: Wafer | None,
+    chunk_size: int | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
-    Query EQE conditions based on the provided EQE session or wafer name.
+    Query EQE conditions and their measurements based on the provided EQE session or wafer.
+    Conditions are fetched first, then measurements are fetched by the ids of the conditions,
+    thus the conditions columns are not repeated for every wavelength.
 
     :param ctx: The context object (provided by the click decorator).
     :param eqe_session: The EQE session to filter the conditions.
-    :param wafer_name: The name of the wafer to filter the conditions.
+    :param wafer: The wafer to filter the conditions. All sessions with the chips of the wafer
+        are included.
+    :param chunk_size: The number of measurements fetched at once, all if None.
+    :return: Conditions with one row per condition and measurements with one row per wavelength.
+    """
+    conditions_df = pd.read_sql_query(
+        get_eqe_conditions_query(eqe_session, wafer), ctx.session.connection()
+    )
+    conditions_ids = conditions_df["conditions_id"].tolist()
+    measurements_chunks = [
+        chunk
+        for conditions_ids_batch in batched(conditions_ids, CONDITIONS_BATCH_SIZE)
+        for chunk in read_query_chunks(
+            ctx.session, get_eqe_values_query(conditions_ids_batch), chunk_size
+        )
+    ]
+    measurements_df = (
+        pd.concat(measurements_chunks, ignore_index=True)
+        if measurements_chunks
+        else pd.DataFrame(columns=["conditions_id", "wavelength", *EQE_PROPERTIES])
+    )
+    return conditions_df, measurements_df
+
+
+def get_eqe_conditions_query(eqe_session: EqeSession | None, wafer: Wafer | None) -> Select:
+    """
+    Build a query of EQE conditions with names of their chips and wafers.
+
+    :param eqe_session: The EQE session of the conditions.
+    :param wafer: The wafer to find EQE sessions by.
     :return:
     """
-    query: Query = (
-        ctx.session.query(EqeConditions)
-        .options(joinedload(EqeConditions.chip))
-        .options(joinedload(EqeConditions.measurements))
+    query = (
+        select(
+            EqeConditions.id.label("conditions_id"),
+            EqeConditions.datetime,
+            Wafer.name.label("wafer"),
+            AbstractChip.name.label("chip"),
+            EqeConditions.bias,
+            EqeConditions.averaging,
+            EqeConditions.dark_current.label("conditions_dark_current"),
+            EqeConditions.temperature,
+        )
+        .join(AbstractChip, AbstractChip.id == EqeConditions.chip_id)
+        .join(Wafer, Wafer.id == AbstractChip.wafer_id)
     )
     if eqe_session:
-        query = query.filter(EqeConditions.session == eqe_session)
-    if wafer_name:
-        eqe_session_ids = ctx.session.execute(
-            text("""
-        SELECT DISTINCT eqe_conditions.session_id FROM eqe_conditions
-        WHERE eqe_conditions.chip_id IN (
-            SELECT chip.id FROM chip WHERE chip.wafer_id = (
-                SELECT wafer.id FROM wafer WHERE wafer.name = :wafer_name
-            )
+        query = query.filter(EqeConditions.session_id == eqe_session.id)
+    if wafer:
+        wafer_sessions = (
+            select(EqeConditions.session_id)
+            .join(AbstractChip, AbstractChip.id == EqeConditions.chip_id)
+            .where(AbstractChip.wafer_id == wafer.id)
+            .distinct()
+            .subquery()
         )
-        """), {"wafer_name": wafer_name},
-        ).all()
-        
-        if not eqe_session_ids:
-            ctx.logger.warning("No EQE sessions were found for given wafer name")
-            raise Exit(0)
-        query = query.filter(EqeConditions.session_id.in_(chain.from_iterable(eqe_session_ids)))
-    conditions = query.all()
-    return conditions
+        query = query.join(wafer_sessions, wafer_sessions.c.session_id == EqeConditions.session_id)
+    return query
 
 
-def get_sheets_eqe_data(conditions: list[EqeConditions]) -> list[dict]:
+def get_eqe_values_query(conditions_ids: Iterable[int]) -> Select:
     """
-    Process EQE conditions and organize them into a structured format suitable for Excel sheets.
+    Build a query of EQE measurements of the given conditions.
+    """
+    return select(
+        EqeMeasurement.conditions_id,
+        EqeMeasurement.wavelength,
+        *(getattr(EqeMeasurement, prop) for prop in EQE_PROPERTIES),
+    ).where(EqeMeasurement.conditions_id.in_(conditions_ids))
+
 
-    :param conditions: A list of EQEConditions objects to be processed.
+def get_sheets_eqe_data(
+    conditions_df: pd.DataFrame, measurements_df: pd.DataFrame
+) -> list[dict]:
+    """
+    Organize EQE measurements into a structured format suitable for Excel sheets.
+    All property sheets are produced by a single pivot and share the index of Info sheet.
+
+    :param conditions_df: EQE conditions as returned by `query_eqe_measurements`.
+    :param measurements_df: EQE measurements as returned by `query_eqe_measurements`.
     :return: A list of dictionaries, each containing a DataFrame and metadata for an Excel sheet.
     """
-    all_sheets = []
-    
-    series_list = []
-    for condition in conditions:
-        series_list.append(pd.Series({
-            "Datetime": condition.datetime,
-            "Wafer": condition.chip.wafer.name,
-            "Chip": condition.chip.name,
-            "Bias": condition.bias,
-            "Averaging": condition.averaging,
-            "Dark current": condition.dark_current,
-            "Temperature": condition.temperature,
-        }))
-    df_info = pd.concat(series_list, axis=1, ignore_index=True).T
-    df_info.set_index("Datetime", inplace=True)
-    df_info = df_info.sort_index()
-    all_sheets.append({"df": df_info, "name": "Info"})
+    conditions_df = (
+        conditions_df.sort_values(["datetime", "conditions_id"], kind="stable")
+        .set_index("conditions_id")
+    )
+    keys_df = conditions_df[["datetime", "wafer", "chip"]].rename(
+        columns={"datetime": "Datetime", "wafer": "Wafer", "chip": "Chip"}
+    )
+    df_info = keys_df.join(
+        conditions_df[["bias", "averaging", "conditions_dark_current", "temperature"]].rename(
+            columns={
+                "bias": "Bias",
+                "averaging": "Averaging",
+                "conditions_dark_current": "Dark current",
+                "temperature": "Temperature",
+            }
+        )
+    ).set_index("Datetime")
+    all_sheets = [{"df": df_info, "name": "Info"}]
     
-    for prop, name, unit in (
-        ("eqe", "EQE", "%"),
-        ("light_current", "Light current", "A"),
-        ("dark_current", "Dark current", "A"),
-        ("responsivity", "Responsivity", "A/W"),
-        ("std", "Standard deviation", "A"),
-    ):
-        series_list = []
-        for condition in conditions:
-            measurements = sorted(condition.measurements, key=lambda m: m.wavelength)
-            series = pd.Series({
-                "Datetime": condition.datetime,
-                "Wafer": condition.chip.wafer.name,
-                "Chip": condition.chip.name,
-                **{m.wavelength: getattr(m, prop) for m in measurements},
-            })
-            series_list.append(series)
-        df = pd.concat(series_list, axis=1, ignore_index=True).T
-        if df.dropna(axis=1, how="all").empty:
-            continue
-        df.set_index("Datetime", inplace=True)
-        df = df.sort_index()
+    dtypes = {"wavelength": "int64", **{prop: "float64" for prop in EQE_PROPERTIES}}
+    values_df = (
+        measurements_df.astype(dtypes)
+        .pivot(index="conditions_id", columns="wavelength", values=list(EQE_PROPERTIES))
+        .reindex(conditions_df.index)
+    )
+    for prop, (name, unit) in EQE_PROPERTIES.items():
+        prop_df = values_df[prop] if prop in values_df else pd.DataFrame(index=values_df.index)
+        # plain int labels, so that the sheets look the same as before
+        prop_df = prop_df.rename(columns=int).rename_axis(columns=None)
+        df = keys_df.join(prop_df).set_index("Datetime")
         all_sheets.append({"name": name, "df": df, "prop": prop, "unit": unit})
     
     return all_sheets
+
+
+def resample_sheets_eqe_data(
+    sheets_data: list[dict], grid: np.ndarray, smooth: int | None = None
+) -> list[dict]:
+    """
+    Resample the curves of all property sheets onto a common wavelength grid.
+
+    :param sheets_data: Sheets data created by `get_sheets_eqe_data`.
+    :param grid: Wavelengths to resample at.
+    :param smooth: Width of moving average window in grid points, no smoothing if None.
+    :return: Sheets data with the grid as wavelength columns.
+    """
+    keys = ["Wafer", "Chip"]
+    resampled_sheets = []
+    for sheet_data in sheets_data:
+        if "prop" not in sheet_data:
+            resampled_sheets.append(sheet_data)
+            continue
+        df = sheet_data["df"].reset_index()
+        values_df = resample_curves(df.drop(columns=["Datetime", *keys]), grid)
+        if smooth is not None:
+            values_df = smooth_curves(values_df, smooth)
+        values_df.columns = [int(wavelength) for wavelength in grid]
+        df = pd.concat([df[["Datetime", *keys]], values_df], axis=1).set_index("Datetime")
+        resampled_sheets.append({**sheet_data, "df": df})
+    return resampled_sheets
+
+
+def get_eqe_metrics_frame(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert EQE metrics sheet into a frame with machine-readable column names.
+    """
+    df = metrics_df.rename_axis(index="datetime").reset_index()
+    df.columns = [
+        re.sub(r"[^0-9a-z]+", "_", column.lower()).strip("_") for column in df.columns
+    ]
+    return df
+
+
+def get_eqe_summary_frame(sheets_data: list[dict]) -> pd.DataFrame:
+    """
+    Convert EQE sheets data into a long frame with one row per measurement condition and
+    wavelength.
+
+    :param sheets_data: Sheets data created by `get_sheets_eqe_data`.
+    :return:
+    """
+    keys = ["datetime", "wafer", "chip"]
+    info_columns = {
+        "Wafer": "wafer",
+        "Chip": "chip",
+        "Bias": "bias",
+        "Averaging": "averaging",
+        "Dark current": "conditions_dark_current",
+        "Temperature": "temperature",
+    }
+    info_dtypes = {
+        "bias": "float64",
+        "averaging": "int64",
+        "conditions_dark_current": "float64",
+        "temperature": "float64",
+    }
+    info_df = None
+    df = None
+    for sheet_data in sheets_data:
+        sheet_df = sheet_data["df"].rename_axis(index="datetime").reset_index()
+        if "prop" not in sheet_data:
+            info_df = sheet_df.rename(columns=info_columns).astype(info_dtypes)
+            continue
+        sheet_df = sheet_df.rename(columns={"Wafer": "wafer", "Chip": "chip"}).melt(
+            id_vars=keys, var_name="wavelength", value_name=sheet_data["prop"]
+        )
+        sheet_df[sheet_data["prop"]] = pd.to_numeric(sheet_df[sheet_data["prop"]])
+        df = sheet_df if df is None else df.merge(sheet_df, on=[*keys, "wavelength"], how="outer")
+    if df is None:
+        return pd.DataFrame(columns=[*keys, "wavelength"])
+    
+    value_columns = [c for c in df.columns if c not in keys and c != "wavelength"]
+    df = df.dropna(subset=value_columns, how="all")
+    df["wavelength"] = df["wavelength"].astype("int64")
+    if info_df is not None:
+        df = df.merge(info_df, on=keys, how="left")
+    return df.sort_values(["datetime", "wafer", "chip", "wavelength"], ignore_index=True)
@@ -0,0 +1,131 @@
+from typing import Iterable
+
+import click
+import numpy as np
+import pandas as pd
+
+
+def parse_wavelength_range(value: str, parts: int) -> tuple[int, ...]:
+    """
+    Parse a wavelength range like 300:1100 or 300:1100:5 in nm.
+    :param value: The range to parse.
+    :param parts: The expected number of colon separated integers.
+    :return:
+    """
+    try:
+        numbers = tuple(int(number) for number in value.split(":"))
+    except ValueError:
+        numbers = ()
+    if len(numbers) != parts or numbers[0] >= numbers[1] or any(n <= 0 for n in numbers):
+        raise ValueError(
+            f"{value!r} is not a valid range. "
+            f"Expected {':'.join(['START', 'STOP', 'STEP'][:parts])} in nm."
+        )
+    return numbers
+
+
+def wavelength_grid_callback(ctx, param, value: str | None) -> np.ndarray | None:
+    if value is None:
+        return None
+    try:
+        start, stop, step = parse_wavelength_range(value, 3)
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param=param)
+    return np.arange(start, stop + 1, step)
+
+
+def wavelength_bands_callback(ctx, param, value: Iterable[str]) -> list[tuple[int, int]]:
+    try:
+        return [parse_wavelength_range(band, 2) for band in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param=param)
+
+
+def resample_curves(values: pd.DataFrame, grid: np.ndarray) -> pd.DataFrame:
+    """
+    Linearly interpolate all curves onto a common grid at once.
+    Curves may have different ranges and gaps (NaN), grid points outside of the measured range
+    of a curve are NaN.
+    :param values: Curves as rows with wavelengths as columns.
+    :param grid: Wavelengths to interpolate at.
+    :return: Curves as rows with the grid as columns.
+    """
+    source = values.columns.to_numpy(dtype="float64")
+    order = np.argsort(source, kind="stable")
+    source = source[order]
+    y = values.to_numpy(dtype="float64")[:, order]
+    rows_number, columns_number = y.shape
+    valid = ~np.isnan(y)
+    columns = np.arange(columns_number)
+    
+    # index of the last valid point up to and the first valid point from every column,
+    # padded with "no point" for grid points outside of all source wavelengths
+    last_valid = np.maximum.accumulate(np.where(valid, columns, -1), axis=1)
+    last_valid = np.hstack([np.full((rows_number, 1), -1), last_valid])
+    next_valid = np.minimum.accumulate(
+        np.where(valid, columns, columns_number)[:, ::-1], axis=1
+    )[:, ::-1]
+    next_valid = np.hstack([next_valid, np.full((rows_number, 1), columns_number)])
+    
+    left = last_valid[:, np.searchsorted(source, grid, side="right")]
+    right = next_valid[:, np.searchsorted(source, grid, side="left")]
+    inside = (left >= 0) & (right < columns_number)
+    left = np.where(inside, left, 0)
+    right = np.where(inside, right, 0)
+    
+    rows = np.arange(rows_number)[:, None]
+    x0, x1 = source[left], source[right]
+    y0, y1 = y[rows, left], y[rows, right]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(x1 > x0, (grid - x0) / (x1 - x0), 0.0)
+    result = y0 + (y1 - y0) * weight
+    result[~inside] = np.nan
+    return pd.DataFrame(result, index=values.index, columns=list(grid))
+
+
+def smooth_curves(values: pd.DataFrame, window: int) -> pd.DataFrame:
+    """
+    Smooth all curves with a centered moving average, missing values are skipped.
+    :param values: Curves as rows with equally spaced wavelengths as columns.
+    :param window: The width of the window in points, even widths are increased by one.
+    :return:
+    """
+    half = window // 2
+    width = 2 * half + 1
+    y = values.to_numpy(dtype="float64")
+    valid = ~np.isnan(y)
+    
+    def moving_sum(array: np.ndarray) -> np.ndarray:
+        padded = np.pad(array, ((0, 0), (half + 1, half)))
+        cumulative = np.cumsum(padded, axis=1)
+        return cumulative[:, width:] - cumulative[:, :-width]
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = moving_sum(np.where(valid, y, 0.0)) / moving_sum(valid.astype("float64"))
+    result[~valid] = np.nan
+    return pd.DataFrame(result, index=values.index, columns=values.columns)
+
+
+def get_eqe_metrics(eqe: pd.DataFrame, bands: Iterable[tuple[int, int]]) -> pd.DataFrame:
+    """
+    Calculate peak and band-averaged EQE of all curves at once.
+    :param eqe: EQE curves in % as rows with wavelengths as columns.
+    :param bands: Wavelength bands (inclusive) to average EQE in.
+    :return: One row per curve.
+    """
+    wavelengths = eqe.columns.to_numpy(dtype="float64")
+    y = eqe.to_numpy(dtype="float64")
+    valid = ~np.isnan(y)
+    has_values = valid.any(axis=1)
+    peak = np.where(valid, y, -np.inf).argmax(axis=1)
+    metrics = {
+        "Peak wavelength, nm": np.where(has_values, wavelengths[peak], np.nan),
+        "Peak EQE, %": np.where(has_values, y[np.arange(len(y)), peak], np.nan),
+    }
+    for start, stop in bands:
+        in_band = valid & ((wavelengths >= start) & (wavelengths <= stop))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics[f"Mean EQE {start}-{stop} nm, %"] = (
+                np.where(in_band, y, 0.0).sum(axis=1) / in_band.sum(axis=1)
+            )
+    return pd.DataFrame(metrics, index=eqe.index)
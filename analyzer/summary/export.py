@@ -0,0 +1,102 @@
+import json
+from typing import (
+    Iterable,
+    Mapping,
+)
+
+import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA_VERSION = 1
+METADATA_KEY = b"analyzer"
+
+FORMAT_EXTENSIONS = {
+    "xlsx": "xlsx",
+    "parquet": "parquet",
+    "csv": "csv",
+    "json": "ndjson",
+}
+
+output_formats_option = click.option(
+    "-f",
+    "--format",
+    "output_formats",
+    type=click.Choice(list(FORMAT_EXTENSIONS.keys()), case_sensitive=False),
+    default=["xlsx"],
+    show_default=True,
+    multiple=True,
+    help="Format of the summary data. Can be used multiple times. Parquet, CSV and JSON "
+         "(newline delimited) files contain one row per measured point with a stable schema.",
+)
+no_plot_option = click.option(
+    "--no-plot",
+    is_flag=True,
+    default=False,
+    help="Don't plot the summary data.",
+)
+
+
+def get_summary_extensions(output_formats: Iterable[str], plot_format: str | None) -> list[str]:
+    """
+    Get extensions of all files that will be created by a summary command.
+    :param output_formats: Formats of the summary data.
+    :param plot_format: Format of the plot or None if plotting is skipped.
+    """
+    extensions = [FORMAT_EXTENSIONS[output_format] for output_format in output_formats]
+    if plot_format is not None:
+        extensions.append(plot_format)
+    return extensions
+
+
+def save_summary_frame(
+    file_name: str,
+    df: pd.DataFrame,
+    output_formats: Iterable[str],
+    metadata: Mapping[str, object] | None = None,
+) -> list[str]:
+    """
+    Save long format summary data into machine-readable files.
+    :param file_name: The name of the files without extension.
+    :param df: The summary data with one row per measured point.
+    :param output_formats: Formats of the files.
+    :param metadata: Information about the summary, stored in the Parquet file schema.
+    :return: The names of the saved files.
+    """
+    file_names = []
+    for output_format in dict.fromkeys(output_formats):
+        path = f"{file_name}.{FORMAT_EXTENSIONS[output_format]}"
+        if output_format == "parquet":
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            info = {"schema_version": SCHEMA_VERSION, **(metadata or {})}
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                METADATA_KEY: json.dumps(info, default=str).encode(),
+            })
+            pq.write_table(table, path)
+        elif output_format == "csv":
+            df.to_csv(path, index=False)
+        elif output_format == "json":
+            df.to_json(path, orient="records", lines=True, date_format="iso")
+        file_names.append(path)
+    return file_names
+
+
+def read_summary_frame(file_name: str) -> tuple[pd.DataFrame, dict]:
+    """
+    Read long format summary data and its metadata from a Parquet file saved by
+    `save_summary_frame`.
+    :param file_name: The name of the Parquet file.
+    :return: The summary data and the metadata.
+    """
+    table = pq.read_table(file_name)
+    schema_metadata = table.schema.metadata or {}
+    if METADATA_KEY not in schema_metadata:
+        raise ValueError(f"{file_name} is not a summary file.")
+    metadata = json.loads(schema_metadata[METADATA_KEY])
+    if metadata.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError(
+            f"Schema version of {file_name} ({metadata.get('schema_version')}) is not supported."
+        )
+    return table.to_pandas(), metadata
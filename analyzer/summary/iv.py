@@ -5,15 +5,19 @@ from datetime import (
 from decimal import Decimal
 from typing import (
     Iterable,
+    Literal,
     Sequence,
     TypedDict,
     cast,
 )
 
 import click
-import numpy as np
 import pandas as pd
-from openpyxl.styles import PatternFill
+from sqlalchemy import (
+    Select,
+    func,
+    select,
+)
 from sqlalchemy.orm import (
     Query,
     contains_eager,
@@ -32,23 +36,62 @@ from orm import (
 )
 from utils import (
     EntityOption,
+    ThresholdMatrix,
     get_indexed_filename,
     get_thresholds,
+    to_voltage_keys,
     validate_chip_types,
     wafer_loader,
 )
 from .common import (
-    apply_conditional_formatting,
+    chunk_size_option,
     date_formats,
     date_formats_help,
     get_info,
     get_slice_by_voltages,
-    plot_measurements_by_voltage,
+    get_threshold_ranges,
+    get_voltage_panels,
+    jobs_option,
+    plot_format_option,
+    read_query_chunks,
+    save_measurements_plot,
+    to_decimal_voltage_columns,
+    to_volt_columns,
+)
+from .export import (
+    get_summary_extensions,
+    no_plot_option,
+    output_formats_option,
+    read_summary_frame,
+    save_summary_frame,
+)
+from .iv_features import (
+    BREAKDOWN_CURRENT,
+    IV_FEATURES_COLUMNS,
+    get_iv_features,
 )
 from ..context import (
     AnalyzerContext,
     pass_analyzer_context,
 )
+from ..excel import (
+    excel_engine_option,
+    get_report_writer,
+)
+
+
+IV_SUMMARY_COLUMNS = [
+    "chip",
+    "voltage",
+    "anode_current",
+    "anode_current_raw",
+    "cathode_current",
+    "guard_current",
+    "temperature",
+    "conditions_id",
+    "datetime",
+    "voltage_amplitude",
+]
 
 
 class SheetsIVData[T](TypedDict):
@@ -98,6 +141,34 @@ class SheetsIVData[T](TypedDict):
     type=click.DateTime(formats=date_formats),
     help=f"Include measurements after (inclusive) provided date and time. {date_formats_help}",
 )
+@jobs_option
+@plot_format_option
+@excel_engine_option
+@output_formats_option
+@no_plot_option
+@chunk_size_option
+@click.option(
+    "--update",
+    "previous_summary",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Parquet file of a previous summary. Only measurements added after it are fetched "
+         "and overlaid on its data.",
+)
+@click.option(
+    "--features",
+    is_flag=True,
+    default=False,
+    help="Extract breakdown voltage, leakage slope, ideality factor, series resistance and "
+         "zero crossing voltage of every fetched IV sweep and add them to the summary. "
+         "Use `db refresh-features` to store them in the database.",
+)
+@click.option(
+    "--breakdown-current",
+    type=click.FloatRange(min=0, min_open=True),
+    default=BREAKDOWN_CURRENT,
+    show_default=True,
+    help="Absolute current in A that defines breakdown for --features.",
+)
 def summary_iv(
     ctx: AnalyzerContext,
     chips_type: str | None,
@@ -106,27 +177,30 @@ def summary_iv(
     quantile: tuple[float, float],
     before: datetime | date | None,
     after: datetime | date | None,
+    jobs: int,
+    plot_format: Literal["png", "pdf"],
+    excel_engine: str,
+    output_formats: Sequence[str],
+    no_plot: bool,
+    chunk_size: int | None,
+    previous_summary: str | None,
+    features: bool,
+    breakdown_current: float,
 ):
     """
     Make summary (png and xlsx) for IV measurements' data.
     """
-    query: Query = (
-        ctx.session.query(IvConditions)
-        .join(IvConditions.measurements)
-        .filter(
-            IvConditions.chip.has(AbstractChip.wafer == wafer),
-            IvConditions.chip_state_id.in_((c.id for c in chip_states)),
-        )
-        .options(
-            contains_eager(IvConditions.measurements),
-            joinedload(IvConditions.chip),
-            undefer(IvConditions.datetime),
-        )
-    )
+    filters = {
+        "chips_type": chips_type,
+        "chip_states": sorted(state.name for state in chip_states),
+        "before": before.isoformat() if before is not None else None,
+        "after": after.isoformat() if after is not None else None,
+    }
+    previous_df, watermark = None, None
+    if previous_summary is not None:
+        previous_df, watermark = read_previous_iv_summary(previous_summary, wafer, filters)
     
-    if chips_type:
-        query = query.filter(IvConditions.chip.has(AbstractChip.type == chips_type))
-    else:
+    if chips_type is None:
         ctx.logger.info(
             "Chips type (-t or --chips-type) is not specified. Analyzing all chip types."
         )
@@ -134,58 +208,380 @@ def summary_iv(
     if before is not None or after is not None:
         after = after if after is not None else date.min
         before = before if before is not None else date.max
-        query = query.filter(IvConditions.datetime.between(after, before))
-    
-    conditions: list[IvConditions] = query.all()
     
-    if not conditions:
-        ctx.logger.warning("No measurements found.")
+    new_df, conditions_ids = fetch_iv_summary_frame(
+        wafer, chip_states, chips_type, after, before, watermark, chunk_size
+    )
+    if new_df is None:
+        if previous_df is None:
+            ctx.logger.warning("No measurements found.")
+        else:
+            ctx.logger.warning("No new measurements found.")
         return
     
-    chips = {c.chip for c in conditions}
-    measurements = get_iv_measurements(conditions)
-    sheets_data = get_sheets_iv_data(measurements, chips)
+    summary_df = merge_iv_summary_frame(previous_df, new_df, conditions_ids)
+    # conditions ids are increasing, thus all the following ones will be newer than the summary
+    watermark_before, watermark = watermark, max(conditions_ids)
+    chips = get_summary_chips(wafer, summary_df["chip"].unique().tolist())
+    sheets_data = get_sheets_iv_data(summary_df)
+    
+    features_df = None
+    if features:
+        query = get_iv_rows_query(wafer, chip_states, chips_type, after, before, watermark_before)
+        features_df = extract_iv_features(query, chunk_size, breakdown_current)
     
     summary_voltages = list(sheets_data["anode"].columns.intersection(
-        [Decimal(v) for v in {"-1", "0.01", "5", "6", "10", "20", "100"}]
+        to_voltage_keys(["-1", "0.01", "5", "6", "10", "20", "100"])
     ))
     thresholds = get_thresholds(ctx.session, "IV")
     
     chips_types = {chips_type} if chips_type else {chip.type for chip in chips}
+    title = f"{wafer.name} {','.join(chips_types)}"
+    file_name = get_indexed_filename(
+        f"Summary-IV-{title.replace(' ', '-')}",
+        get_summary_extensions(output_formats, None if no_plot else plot_format),
+    )
     
+    if not no_plot:
+        plot_iv_summary(
+            file_name,
+            title,
+            sheets_data["anode"],
+            chips,
+            chips_types,
+            summary_voltages,
+            quantile,
+            thresholds,
+            jobs,
+            plot_format,
+        )
+    
+    info = get_info(wafer=wafer, chip_states=chip_states, datetimes=summary_df["datetime"])
+    if "xlsx" in output_formats:
+        exel_file_name = f"{file_name}.xlsx"
+        save_iv_summary_to_excel(
+            sheets_data,
+            info,
+            exel_file_name,
+            summary_voltages,
+            thresholds,
+            excel_engine,
+            features_df,
+        )
+        ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    
+    save_iv_summary_data(
+        file_name,
+        summary_df,
+        features_df,
+        [f for f in output_formats if f != "xlsx"],
+        {"type": "IV", **info, **filters, "watermark": watermark},
+        breakdown_current,
+    )
+
+
+@pass_analyzer_context
+def fetch_iv_summary_frame(
+    ctx: AnalyzerContext,
+    wafer: Wafer,
+    chip_states: Iterable[ChipState],
+    chips_type: str | None,
+    after: datetime | date | None,
+    before: datetime | date | None,
+    watermark: int | None,
+    chunk_size: int | None,
+) -> tuple[pd.DataFrame | None, set[int]]:
+    """
+    Fetch IV measurements into a long summary frame, in chunks if `chunk_size` is given.
+    Parameters are the same as in `get_iv_conditions_query`.
+    :return: The summary frame (None if nothing is found) and ids of the fetched conditions.
+    """
+    if chunk_size is not None:
+        query = get_iv_rows_query(wafer, chip_states, chips_type, after, before, watermark)
+        return stream_iv_summary_frame(query, chunk_size)
+    query = get_iv_conditions_query(wafer, chip_states, chips_type, after, before, watermark)
+    conditions: list[IvConditions] = query.with_session(ctx.session).all()
+    if not conditions:
+        return None, set()
+    return get_iv_summary_frame(get_iv_measurements(conditions)), {c.id for c in conditions}
+
+
+@pass_analyzer_context
+def merge_iv_summary_frame(
+    ctx: AnalyzerContext,
+    previous_df: pd.DataFrame | None,
+    new_df: pd.DataFrame,
+    conditions_ids: set[int],
+) -> pd.DataFrame:
+    """
+    Overlay new measurements on the previous summary data if there is one.
+    """
+    if previous_df is None:
+        return new_df
+    ctx.logger.info(
+        f"{len(conditions_ids)} new measurement(s) of "
+        f"{new_df['chip'].nunique()} chip(s) are found."
+    )
+    return update_iv_summary_frame(previous_df, new_df)
+
+
+@pass_analyzer_context
+def get_summary_chips(
+    ctx: AnalyzerContext,
+    wafer: Wafer,
+    chip_names: Sequence[str],
+) -> set[AbstractChip]:
+    """
+    Get chips of the wafer by names along with matrices of matrix chips.
+    """
+    chips = set(
+        ctx.session.query(AbstractChip)
+        .filter(AbstractChip.wafer == wafer, AbstractChip.name.in_(chip_names))
+        .all()
+    )
     matrix_chips = [chip for chip in chips if isinstance(chip, MatrixChip)]
     if matrix_chips:
         # fetch matrices to avoid multiple queries later
         ctx.session.query(Matrix) \
             .filter(Matrix.id.in_([c.matrix_id for c in matrix_chips])) \
             .all()
-    
-    title = f"{wafer.name} {','.join(chips_types)}"
-    file_name = get_indexed_filename(f"Summary-IV-{title.replace(' ', '-')}", ("png", "xlsx"))
-    
+    return chips
+
+
+@pass_analyzer_context
+def plot_iv_summary(
+    ctx: AnalyzerContext,
+    file_name: str,
+    title: str,
+    anode_df: pd.DataFrame,
+    chips: Iterable[AbstractChip],
+    chips_types: set[str],
+    voltages: Sequence[int],
+    quantile: tuple[float, float],
+    thresholds: dict[str, dict[Decimal, float]],
+    jobs: int,
+    plot_format: Literal["png", "pdf"],
+) -> None:
+    """
+    Plot anode currents of the chips of a single type by voltage.
+    """
     if len(chips_types) > 1:
         ctx.logger.warning(
             f"Multiple chip types are found ({chips_types}). "
             "Plotting is not supported and will be skipped.")
-    else:
-        chips_type = next(iter(chips_types))
-        fig, axes = plot_measurements_by_voltage(
-            measurements,
-            summary_voltages,
-            quantile,
-            thresholds.get(chips_type, {}),
+        return
+    panels = get_voltage_panels(
+        anode_df,
+        {chip.name: chip for chip in chips},
+        voltages,
+        quantile,
+        ThresholdMatrix(thresholds, "IV"),
+        next(iter(chips_types)),
+    )
+    plot_file_name = save_measurements_plot(
+        file_name, title, panels, quantile, "Anode current [pA]", jobs, plot_format
+    )
+    ctx.logger.info(f"Summary data is plotted to {plot_file_name}")
+
+
+@pass_analyzer_context
+def save_iv_summary_data(
+    ctx: AnalyzerContext,
+    file_name: str,
+    summary_df: pd.DataFrame,
+    features_df: pd.DataFrame | None,
+    data_formats: Sequence[str],
+    metadata: dict,
+    breakdown_current: float,
+) -> None:
+    """
+    Save the long summary frame and the features to data files of the given formats.
+    """
+    data_file_names = save_summary_frame(file_name, summary_df, data_formats, metadata)
+    if features_df is not None:
+        data_file_names += save_summary_frame(
+            f"{file_name}-features",
+            features_df,
+            data_formats,
+            {
+                **{key: value for key, value in metadata.items() if key != "watermark"},
+                "type": "IV features",
+                "breakdown_current": breakdown_current,
+            },
         )
-        fig.suptitle(title, fontsize=14)
-        
-        png_file_name = f"{file_name}.png"
-        fig.savefig(png_file_name, dpi=300)
-        ctx.logger.info(f"Summary data is plotted to {png_file_name}")
-    
-    exel_file_name = f"{file_name}.xlsx"
-    info = get_info(wafer=wafer, chip_states=chip_states, measurements=measurements)
-    save_iv_summary_to_excel(sheets_data, info, exel_file_name, summary_voltages, thresholds)
+    for data_file_name in data_file_names:
+        ctx.logger.info(f"Summary data is saved to {data_file_name}")
+
+
+def get_iv_conditions_query(
+    wafer: Wafer,
+    chip_states: Iterable[ChipState],
+    chips_type: str | None = None,
+    after: datetime | date | None = None,
+    before: datetime | date | None = None,
+    watermark: int | None = None,
+) -> Query:
+    """
+    Build a query of IV conditions with eagerly loaded measurements and chips.
+    :param wafer: The wafer of the chips.
+    :param chip_states: The states of the chips.
+    :param chips_type: The type of the chips, all types if None.
+    :param after: Include measurements after (inclusive) the date.
+    :param before: Include measurements before (exclusive) the date.
+    :param watermark: Include only conditions with greater id.
+    :return:
+    """
+    query = (
+        Query(IvConditions)
+        .join(IvConditions.measurements)
+        .filter(
+            IvConditions.chip.has(AbstractChip.wafer == wafer),
+            IvConditions.chip_state_id.in_([c.id for c in chip_states]),
+        )
+        .options(
+            contains_eager(IvConditions.measurements),
+            joinedload(IvConditions.chip),
+            undefer(IvConditions.datetime),
+        )
+    )
+    if chips_type:
+        query = query.filter(IvConditions.chip.has(AbstractChip.type == chips_type))
+    if after is not None and before is not None:
+        query = query.filter(IvConditions.datetime.between(after, before))
+    if watermark is not None:
+        query = query.filter(IvConditions.id > watermark)
+    return query
+
+
+def get_iv_rows_query(
+    wafer: Wafer,
+    chip_states: Iterable[ChipState],
+    chips_type: str | None = None,
+    after: datetime | date | None = None,
+    before: datetime | date | None = None,
+    watermark: int | None = None,
+) -> Select:
+    """
+    Build a query of IV measurements projected to the columns of the long summary frame.
+    Voltage amplitudes of the conditions are calculated by the database.
+    Parameters are the same as in `get_iv_conditions_query`.
+    """
+    amplitude_window = {"partition_by": IVMeasurement.conditions_id}
+    query = (
+        select(
+            AbstractChip.name.label("chip"),
+            IVMeasurement.voltage_input.label("voltage"),
+            func.coalesce(
+                IVMeasurement.anode_current_corrected, IVMeasurement.anode_current
+            ).label("anode_current"),
+            IVMeasurement.anode_current.label("anode_current_raw"),
+            IVMeasurement.cathode_current,
+            IVMeasurement.guard_current,
+            IvConditions.temperature,
+            IvConditions.id.label("conditions_id"),
+            IvConditions.datetime,
+            (
+                func.max(IVMeasurement.voltage_input).over(**amplitude_window)
+                - func.min(IVMeasurement.voltage_input).over(**amplitude_window)
+            ).label("voltage_amplitude"),
+            IVMeasurement.anode_current_corrected.is_(None).label("is_uncorrected"),
+        )
+        .select_from(IvConditions)
+        .join(IvConditions.measurements)
+        .join(IvConditions.chip)
+        .filter(
+            AbstractChip.wafer_id == wafer.id,
+            IvConditions.chip_state_id.in_([c.id for c in chip_states]),
+        )
+        .order_by(IvConditions.id, IVMeasurement.id)
+    )
+    if chips_type:
+        query = query.filter(AbstractChip.type == chips_type)
+    if after is not None and before is not None:
+        query = query.filter(IvConditions.datetime.between(after, before))
+    if watermark is not None:
+        query = query.filter(IvConditions.id > watermark)
+    return query
+
+
+@pass_analyzer_context
+def stream_iv_summary_frame(
+    ctx: AnalyzerContext,
+    query: Select,
+    chunk_size: int,
+) -> tuple[pd.DataFrame | None, set[int]]:
+    """
+    Fetch IV measurements in chunks and fold them into a long summary frame. Only the measurements
+    that win according to `get_iv_measurements` rules are kept between chunks.
+    :param ctx: The context object (provided by the click decorator).
+    :param query: The query created by `get_iv_rows_query`.
+    :param chunk_size: The number of rows in a chunk.
+    :return: The summary frame (None if nothing is found) and ids of the fetched conditions.
+    """
+    summary_df = None
+    conditions_ids: set[int] = set()
+    has_uncorrected_current = False
+    with click.progressbar(
+        read_query_chunks(ctx.session, query, chunk_size), label="Processing measurements..."
+    ) as progress:
+        for chunk in progress:
+            if chunk.empty:
+                continue
+            has_uncorrected_current |= bool(chunk["is_uncorrected"].any())
+            conditions_ids.update(chunk["conditions_id"].unique().tolist())
+            chunk = chunk[IV_SUMMARY_COLUMNS].astype(
+                {column: "float64" for column in [*IV_SUMMARY_COLUMNS[1:7], "voltage_amplitude"]}
+            )
+            chunk["datetime"] = pd.to_datetime(chunk["datetime"])
+            if summary_df is not None:
+                chunk = pd.concat([summary_df, chunk], ignore_index=True)
+            summary_df = deduplicate_iv_summary_frame(chunk)
+    if has_uncorrected_current:
+        ctx.logger.warning(
+            "Some current measurements are not corrected by temperature."
+        )
+    return summary_df, conditions_ids
+
+
+@pass_analyzer_context
+def extract_iv_features(
+    ctx: AnalyzerContext,
+    query: Select,
+    chunk_size: int | None,
+    breakdown_current: float,
+) -> pd.DataFrame:
+    """
+    Extract features of all IV sweeps selected by the query. Features are not saved to the
+    database, it's done by `analyzer db refresh-features`.
+    :param ctx: The context object (provided by the click decorator).
+    :param query: The query created by `get_iv_rows_query`.
+    :param chunk_size: The number of rows in a chunk, all rows are fetched at once if None.
+    :param breakdown_current: Absolute current in A that defines breakdown.
+    :return: One row per IV conditions with chip, datetime, temperature and the features.
+    """
+    columns = ["chip", "conditions_id", "datetime", "voltage", "anode_current", "temperature"]
+    sweeps_df = pd.concat(
+        [chunk[columns] for chunk in read_query_chunks(ctx.session, query, chunk_size)],
+        ignore_index=True,
+    )
+    features_df = get_iv_features(
+        sweeps_df.rename(columns={"anode_current": "current"}), breakdown_current
+    )
+    ctx.logger.info(f"Features of {len(features_df)} IV sweep(s) are extracted.")
     
-    ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    conditions_df = sweeps_df.groupby("conditions_id").agg(
+        chip=("chip", "first"),
+        datetime=("datetime", "first"),
+        temperature=("temperature", "first"),
+    )
+    df = conditions_df.join(features_df, how="inner").reset_index()
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    return df.sort_values(["chip", "datetime"], ignore_index=True)
+
+
+def get_voltage_amplitude(condition: IvConditions) -> Decimal:
+    voltages = [m.voltage_input for m in condition.measurements]
+    return max(voltages) - min(voltages)
 
 
 def get_iv_measurements(conditions: list[IvConditions]) -> list[IVMeasurement]:
@@ -199,9 +595,7 @@ def get_iv_measurements(conditions: list[IvConditions]) -> list[IVMeasurement]:
             thus more precise measurements with voltage input from -0.01 to 0.01 will overwrite less
             precise from -1 to 20
         """
-        voltages = [m.voltage_input for m in condition.measurements]
-        voltage_amplitude = max(voltages) - min(voltages)
-        return condition.datetime, -voltage_amplitude
+        return condition.datetime, -get_voltage_amplitude(condition)
     
     non_empty_conditions = [c for c in conditions if c.measurements]
     sorted_conditions = list(sorted(non_empty_conditions, key=get_sort_keys, reverse=False))
@@ -218,19 +612,21 @@ def save_iv_summary_to_excel(
     sheets_data: SheetsIVData[pd.DataFrame],
     info: pd.Series,
     file_name: str,
-    voltages: Iterable[Decimal],
+    voltages: Iterable[int],
     thresholds: dict[str, dict[Decimal, float]],
+    engine: str = "openpyxl",
+    features_df: pd.DataFrame | None = None,
 ):
     """
     Save IV summary data to an Excel file.
     """
-    summary_df = get_slice_by_voltages(sheets_data["anode"], voltages)
+    summary_df = to_decimal_voltage_columns(get_slice_by_voltages(sheets_data["anode"], voltages))
     summary_df.insert(
         0, "Temperature",
         cast(pd.Series, sheets_data["temperatures"]["Temperature"].apply(lambda x: f"{x:.2f}")))
     rules = {
-        "lessThan": PatternFill(bgColor="ee9090", fill_type="solid"),  # red, failed
-        "greaterThanOrEqual": PatternFill(bgColor="90ee90", fill_type="solid"),  # green, ok
+        "lessThan": "ee9090",  # red, failed
+        "greaterThanOrEqual": "90ee90",  # green, ok
     }
     sheet_names: SheetsIVData[str | None] = {
         'anode': "I1 anode",
@@ -240,12 +636,12 @@ def save_iv_summary_to_excel(
         'temperatures': None,
     }
     
-    with pd.ExcelWriter(file_name) as writer:
-        summary_df.to_excel(writer, sheet_name="Summary")
-        apply_conditional_formatting(
-            writer.book["Summary"],
+    with get_report_writer(file_name, engine) as writer:
+        writer.write_frame(summary_df, "Summary")
+        writer.add_threshold_rules(
+            "Summary",
+            get_threshold_ranges(summary_df, thresholds),
             rules,
-            thresholds,
         )
         for df_name, df in cast(Iterable[tuple[str, pd.DataFrame]], sheets_data.items()):
             if (sheet_name := sheet_names[df_name]) is None:
@@ -253,54 +649,134 @@ def save_iv_summary_to_excel(
             df = df.dropna(axis=1, how="all")
             if df.empty:
                 continue
-            df = df.rename(columns=float)
-            df.to_excel(writer, sheet_name=sheet_name)
+            writer.write_frame(to_volt_columns(df), sheet_name)
         
-        info.to_excel(writer, sheet_name="Info")
+        if features_df is not None:
+            writer.write_frame(
+                features_df.drop(columns="conditions_id")
+                .rename(columns={
+                    "chip": "Chip",
+                    "datetime": "Datetime",
+                    "temperature": "Temperature",
+                    **IV_FEATURES_COLUMNS,
+                })
+                .set_index("Chip"),
+                "IV features",
+            )
+        writer.write_frame(info, "Info")
 
 
 @pass_analyzer_context
-def get_sheets_iv_data(
+def get_iv_summary_frame(
     ctx: AnalyzerContext,
     measurements: Iterable[IVMeasurement],
-    chips: Iterable[AbstractChip],
-) -> SheetsIVData[pd.DataFrame]:
-    """
-    Extract IV measurements data from given sequence of measurements into separate dataframes.
-    """
-    chip_names = sorted({c.name for c in chips})
-    chip_index = pd.Index(chip_names)
-    temps_df = pd.DataFrame(
-        0, dtype="float32", index=chip_index,
-        columns=pd.Index(['Temperature', 'num_of_measurements']))
-    empty_df = pd.DataFrame(dtype="float32", index=chip_index)
-    anode_df = empty_df.copy()
-    raw_anode_df = empty_df.copy()
-    cathode_df = empty_df.copy()
-    guard_ring_df = empty_df.copy()
+) -> pd.DataFrame:
+    """
+    Convert IV measurements into a long frame with one row per measurement.
+    Conditions of the measurements are kept along, so that the frame can be updated later with
+    the same rules as in `get_iv_measurements`.
+    """
+    amplitudes: dict[int, float] = {}
+    rows = []
     has_uncorrected_current = False
     with click.progressbar(measurements, label="Processing measurements...") as progress:
         for measurement in progress:
-            cell_location = (measurement.conditions.chip.name, measurement.voltage_input)
+            condition = measurement.conditions
+            if condition.id not in amplitudes:
+                amplitudes[condition.id] = float(get_voltage_amplitude(condition))
             if measurement.anode_current_corrected is None:
                 has_uncorrected_current = True
-            anode_df.loc[cell_location] = measurement.get_anode_current_value()
-            raw_anode_df.loc[cell_location] = measurement.anode_current
-            cathode_df.loc[cell_location] = measurement.cathode_current
-            guard_ring_df.loc[cell_location] = measurement.guard_current
-            
-            temps_df.loc[cell_location[0], ['Temperature', 'num_of_measurements']] += \
-                np.array([measurement.conditions.temperature, 1.0], dtype=np.float32)
+            rows.append((
+                condition.chip.name,
+                float(measurement.voltage_input),
+                measurement.get_anode_current_value(),
+                measurement.anode_current,
+                measurement.cathode_current,
+                measurement.guard_current,
+                condition.temperature,
+                condition.id,
+                condition.datetime,
+                amplitudes[condition.id],
+            ))
     if has_uncorrected_current:
         ctx.logger.warning(
             "Some current measurements are not corrected by temperature."
         )
-    temps_df['Temperature'] /= temps_df['num_of_measurements']
-    temps_df.drop(columns='num_of_measurements', inplace=True)
+    df = pd.DataFrame.from_records(rows, columns=IV_SUMMARY_COLUMNS)
+    df = df.astype({column: "float64" for column in IV_SUMMARY_COLUMNS[2:7]})
+    return df.sort_values(["chip", "voltage"], ignore_index=True)
+
+
+def update_iv_summary_frame(previous_df: pd.DataFrame, new_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Overlay new measurements on the previous summary data. Like in `get_iv_measurements`,
+    the latest measurements win and measurements with smaller voltage amplitude win among
+    measurements made at the same time.
+    """
+    df = pd.concat([previous_df[IV_SUMMARY_COLUMNS], new_df[IV_SUMMARY_COLUMNS]], ignore_index=True)
+    return deduplicate_iv_summary_frame(df)
+
+
+def deduplicate_iv_summary_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keep a single measurement for every chip and voltage using the rules of `get_iv_measurements`.
+    Rows which come later in the frame win if their conditions have the same date and amplitude.
+    """
+    df = df.sort_values(
+        ["datetime", "voltage_amplitude"], ascending=[True, False], kind="stable"
+    ).drop_duplicates(["chip", "voltage"], keep="last")
+    return df.sort_values(["chip", "voltage"], ignore_index=True)
+
+
+def read_previous_iv_summary(
+    file_name: str,
+    wafer: Wafer,
+    filters: dict[str, str | list[str] | None],
+) -> tuple[pd.DataFrame, int]:
+    """
+    Read the data of a previous IV summary and check that it was made with the same filters.
+    :return: The summary data and the id of the last conditions included in the summary.
+    """
+    try:
+        df, metadata = read_summary_frame(file_name)
+    except (ValueError, OSError) as e:
+        raise click.BadParameter(str(e), param_hint="--update")
+    if metadata.get("type") != "IV":
+        raise click.BadParameter(f"{file_name} is not an IV summary.", param_hint="--update")
+    if metadata.get("Wafer") != wafer.name:
+        raise click.BadParameter(
+            f"{file_name} is a summary of wafer {metadata.get('Wafer')}.", param_hint="--update"
+        )
+    for key, value in filters.items():
+        if metadata.get(key) != value:
+            raise click.BadParameter(
+                f"{file_name} was made with different {key.replace('_', ' ')} "
+                f"({metadata.get(key)}).",
+                param_hint="--update",
+            )
+    return df, metadata["watermark"]
+
+
+def get_sheets_iv_data(df: pd.DataFrame) -> SheetsIVData[pd.DataFrame]:
+    """
+    Pivot long IV summary data into separate dataframes with chips as rows and voltage keys as
+    columns.
+    """
+    keys_df = df.assign(voltage=to_voltage_keys(df["voltage"]))
+    
+    def pivot(column: str) -> pd.DataFrame:
+        return (
+            keys_df.pivot(index="chip", columns="voltage", values=column)
+            .rename_axis(index=None, columns=None)
+        )
+    
+    temperatures = df.groupby("chip")[["temperature"]].mean()
     return {
-        "anode": anode_df,
-        "anode_raw": raw_anode_df,
-        "cathode": cathode_df,
-        "guard_ring": guard_ring_df,
-        "temperatures": temps_df,
+        "anode": pivot("anode_current"),
+        "anode_raw": pivot("anode_current_raw"),
+        "cathode": pivot("cathode_current"),
+        "guard_ring": pivot("guard_current"),
+        "temperatures": temperatures.rename(columns={"temperature": "Temperature"}).rename_axis(
+            index=None
+        ),
     }
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from .common import fit_lines
+
+BOLTZMANN_OVER_CHARGE = 8.617333262e-5  # V/K
+ZERO_CELSIUS = 273.15  # K
+DEFAULT_TEMPERATURE = 25.0  # C
+BREAKDOWN_CURRENT = 1e-6  # A
+IDEALITY_VOLTAGE_RANGE = (0.1, 0.4)  # V, forward bias
+SERIES_RESISTANCE_MIN_VOLTAGE = 0.4  # V, forward bias
+IV_FEATURES_COLUMNS = {
+    "breakdown_voltage": "Breakdown voltage, V",
+    "leakage_slope": "Leakage slope, A/V",
+    "ideality_factor": "Ideality factor",
+    "series_resistance": "Series resistance, Ohm",
+    "zero_crossing_voltage": "Zero crossing voltage, V",
+}
+
+
+def get_iv_features(
+    sweeps_df: pd.DataFrame,
+    breakdown_current: float = BREAKDOWN_CURRENT,
+) -> pd.DataFrame:
+    """
+    Extract features of all IV sweeps at once. Sweeps are ragged: every sweep has its own
+    voltages. Positive voltages are reverse bias, negative voltages are forward bias.
+    Breakdown voltage is the reverse voltage where the current reaches `breakdown_current`
+    (log-interpolated between points). Leakage slope is the slope of reverse current over voltage
+    below breakdown. Ideality factor is taken from the slope of ln(I) in `IDEALITY_VOLTAGE_RANGE`
+    of forward bias and series resistance from dV/d(ln I) = I * Rs + n * kT / q (Cheung's method)
+    above `SERIES_RESISTANCE_MIN_VOLTAGE`. Zero crossing voltage is the interpolated voltage
+    where the current changes its sign, the closest to zero if there are several.
+    :param sweeps_df: Measurements with conditions_id, voltage, current and temperature (C)
+        columns.
+    :param breakdown_current: Absolute current in A that defines breakdown.
+    :return: Features indexed by conditions id, NaN where a feature can't be extracted.
+    """
+    df = sweeps_df[["conditions_id", "voltage", "current", "temperature"]].astype(
+        {"voltage": "float64", "current": "float64", "temperature": "float64"}
+    )
+    df = df[np.isfinite(df["voltage"]) & np.isfinite(df["current"])]
+    df = df.sort_values(["conditions_id", "voltage"], kind="stable")
+    groups, conditions_ids = pd.factorize(df["conditions_id"])
+    groups_number = len(conditions_ids)
+    voltage = df["voltage"].to_numpy()
+    current = df["current"].to_numpy()
+    # consecutive points of the same sweep
+    same_sweep = groups[1:] == groups[:-1]
+    
+    temperature = pd.Series(df["temperature"].to_numpy()).groupby(groups).mean()
+    temperature = temperature.reindex(range(groups_number)).fillna(DEFAULT_TEMPERATURE)
+    thermal_voltage = BOLTZMANN_OVER_CHARGE * (temperature.to_numpy() + ZERO_CELSIUS)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_current = np.log(np.abs(current))
+        breakdown_voltage = get_breakdown_voltages(
+            groups, groups_number, voltage, log_current, same_sweep, np.log(breakdown_current)
+        )
+        
+        # reverse leakage below breakdown
+        is_leakage = (voltage > 0) & ~(voltage >= breakdown_voltage[groups])
+        leakage = fit_lines(
+            groups[is_leakage], voltage[is_leakage], np.abs(current[is_leakage]), groups_number
+        )
+        
+        # exponential part of the forward branch
+        forward_voltage = -voltage
+        low, high = IDEALITY_VOLTAGE_RANGE
+        is_diffusion = (
+            (forward_voltage >= low) & (forward_voltage <= high) & np.isfinite(log_current)
+        )
+        diffusion = fit_lines(
+            groups[is_diffusion],
+            forward_voltage[is_diffusion],
+            log_current[is_diffusion],
+            groups_number,
+        )
+        ideality_factor = 1 / (diffusion["slope"] * thermal_voltage)
+        ideality_factor[~(ideality_factor > 0)] = np.nan
+        
+        # Cheung's method over pairs of consecutive points of high forward bias
+        is_high = (forward_voltage >= SERIES_RESISTANCE_MIN_VOLTAGE) & np.isfinite(log_current)
+        is_pair = same_sweep & is_high[1:] & is_high[:-1]
+        pair_groups = groups[1:][is_pair]
+        d_voltage = np.diff(forward_voltage)[is_pair]
+        d_log_current = np.diff(log_current)[is_pair]
+        pair_current = np.sqrt(np.abs(current[1:] * current[:-1]))[is_pair]
+        series = fit_lines(pair_groups, pair_current, d_voltage / d_log_current, groups_number)
+        
+        zero_crossing_voltage = get_zero_crossing_voltages(
+            groups, groups_number, voltage, current, same_sweep
+        )
+    
+    return pd.DataFrame(
+        {
+            "breakdown_voltage": breakdown_voltage,
+            "leakage_slope": leakage["slope"],
+            "ideality_factor": ideality_factor,
+            "series_resistance": series["slope"],
+            "zero_crossing_voltage": zero_crossing_voltage,
+        },
+        index=pd.Index(conditions_ids, name="conditions_id"),
+    )
+
+
+def get_first_of_groups(
+    groups: np.ndarray,
+    positions: np.ndarray,
+    groups_number: int,
+) -> np.ndarray:
+    """
+    Get the first position of every group.
+    :param groups: Group numbers of the positions, sorted.
+    :param positions: Positions of the points.
+    :param groups_number: The number of groups.
+    :return: The first position of every group, -1 for groups without points.
+    """
+    result = np.full(groups_number, -1)
+    found_groups, first = np.unique(groups, return_index=True)
+    result[found_groups] = positions[first]
+    return result
+
+
+def get_breakdown_voltages(
+    groups: np.ndarray,
+    groups_number: int,
+    voltage: np.ndarray,
+    log_current: np.ndarray,
+    same_sweep: np.ndarray,
+    log_breakdown_current: float,
+) -> np.ndarray:
+    """
+    Find the first reverse voltage of every sweep where the current reaches the breakdown current.
+    Points are expected to be sorted by sweep and voltage.
+    """
+    positions = np.flatnonzero((voltage > 0) & (log_current >= log_breakdown_current))
+    first = get_first_of_groups(groups[positions], positions, groups_number)
+    found = first >= 0
+    after = first[found]
+    before = after - 1
+    # log-interpolate from the previous reverse point of the same sweep
+    can_interpolate = (
+        (after > 0)
+        & same_sweep[np.maximum(before, 0)]
+        & (voltage[before] > 0)
+        & np.isfinite(log_current[before])
+    )
+    fraction = np.where(
+        can_interpolate,
+        (log_breakdown_current - log_current[before])
+        / (log_current[after] - log_current[before]),
+        1.0,
+    )
+    result = np.full(groups_number, np.nan)
+    result[found] = np.where(
+        can_interpolate,
+        voltage[before] + fraction * (voltage[after] - voltage[before]),
+        voltage[after],
+    )
+    return result
+
+
+def get_zero_crossing_voltages(
+    groups: np.ndarray,
+    groups_number: int,
+    voltage: np.ndarray,
+    current: np.ndarray,
+    same_sweep: np.ndarray,
+) -> np.ndarray:
+    """
+    Find the voltage of every sweep where the current changes its sign, the closest to zero.
+    Points are expected to be sorted by sweep and voltage.
+    """
+    is_crossing = same_sweep & (current[1:] * current[:-1] < 0)
+    is_zero = current == 0
+    v0, v1 = voltage[:-1][is_crossing], voltage[1:][is_crossing]
+    i0, i1 = current[:-1][is_crossing], current[1:][is_crossing]
+    crossing_groups = np.concatenate([groups[1:][is_crossing], groups[is_zero]])
+    crossing_voltage = np.concatenate([v0 - i0 * (v1 - v0) / (i1 - i0), voltage[is_zero]])
+    
+    order = np.lexsort((np.abs(crossing_voltage), crossing_groups))
+    first = get_first_of_groups(crossing_groups[order], order, groups_number)
+    return np.where(first >= 0, crossing_voltage[first], np.nan)
@@ -0,0 +1,254 @@
+from typing import Sequence
+
+import click
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Select,
+    select,
+)
+
+from orm import (
+    AbstractChip,
+    TsConditions,
+    TsMeasurement,
+    Wafer,
+)
+from utils import (
+    get_indexed_filename,
+    wafer_loader,
+)
+from .common import (
+    chunk_size_option,
+    fit_lines,
+    get_info,
+    read_query_chunks,
+)
+from .export import (
+    get_summary_extensions,
+    output_formats_option,
+    save_summary_frame,
+)
+from ..context import (
+    AnalyzerContext,
+    pass_analyzer_context,
+)
+from ..excel import (
+    excel_engine_option,
+    get_report_writer,
+)
+
+STRUCTURES_COLUMNS = {
+    "chip": "Chip",
+    "structure_type": "Structure type",
+    "ts_number": "Number",
+    "ts_step": "Step",
+    "datetime": "Datetime",
+    "resistance": "Resistance, Ohm",
+    "offset_voltage": "Offset voltage, V",
+    "r_squared": "R²",
+}
+TLM_COLUMNS = {
+    "chip": "Chip",
+    "ts_number": "Number",
+    "steps": "Steps",
+    "slope": "Slope, Ohm/um",
+    "contact_resistance": "Contact resistance, Ohm",
+    "transfer_length": "Transfer length, um",
+    "sheet_resistance": "Sheet resistance, Ohm/sq",
+    "r_squared": "R²",
+}
+
+
+def tlm_spacing_callback(ctx, param, value: str | None) -> list[float] | None:
+    if value is None:
+        return None
+    try:
+        spacing = [float(v) for v in value.split(",")]
+    except ValueError:
+        spacing = []
+    if not spacing or any(s <= 0 for s in spacing):
+        raise click.BadParameter(
+            f"{value!r} is not a comma separated list of positive numbers.", ctx=ctx, param=param
+        )
+    return spacing
+
+
+@click.command(name="ts")
+@pass_analyzer_context
+@click.option(
+    "-w", "--wafer", prompt="Wafer name", help="Wafer name.",
+    required=True,
+    callback=wafer_loader,
+)
+@click.option(
+    "--tlm-spacing",
+    callback=tlm_spacing_callback,
+    help="Comma separated distances between TLM contacts in um for steps 1, 2, 3... "
+         "(e.g. 10,20,40,80). If not specified, step numbers are used as distances, thus "
+         "slope and transfer length are per step and sheet resistance is not calculated.",
+)
+@click.option(
+    "--tlm-width",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Width of TLM contacts in um. Required to calculate sheet resistance.",
+)
+@excel_engine_option
+@output_formats_option
+@chunk_size_option
+def summary_ts(
+    ctx: AnalyzerContext,
+    wafer: Wafer,
+    tlm_spacing: list[float] | None,
+    tlm_width: float | None,
+    excel_engine: str,
+    output_formats: Sequence[str],
+    chunk_size: int | None,
+):
+    """
+    Make summary (xlsx) for test structures' measurements: resistance of every structure and
+    sheet resistance, contact resistance and transfer length of every TLM group.
+    """
+    measurements_df = pd.concat(
+        read_query_chunks(ctx.session, get_ts_measurements_query(wafer), chunk_size),
+        ignore_index=True,
+    )
+    if measurements_df.empty:
+        ctx.logger.warning("No measurements found.")
+        return
+    measurements_df["datetime"] = pd.to_datetime(measurements_df["datetime"])
+    
+    structures_df = get_structures_frame(measurements_df)
+    tlm_df = get_tlm_frame(structures_df, tlm_spacing, tlm_width)
+    if tlm_spacing is None and not tlm_df.empty:
+        ctx.logger.info(
+            "TLM spacing (--tlm-spacing) is not specified. Step numbers are used as distances."
+        )
+    
+    info = get_info(wafer=wafer, chip_states=[], datetimes=structures_df["datetime"]).drop(
+        "Chip state"
+    )
+    file_name = get_indexed_filename(
+        f"Summary-TS-{wafer.name}", get_summary_extensions(output_formats, None)
+    )
+    if "xlsx" in output_formats:
+        exel_file_name = f"{file_name}.xlsx"
+        with get_report_writer(exel_file_name, excel_engine) as writer:
+            writer.write_frame(
+                structures_df.rename(columns=STRUCTURES_COLUMNS).set_index("Chip"), "Structures"
+            )
+            writer.write_frame(tlm_df.rename(columns=TLM_COLUMNS).set_index("Chip"), "TLM")
+            writer.write_frame(info, "Info")
+        ctx.logger.info(f"Summary data is saved to {exel_file_name}")
+    
+    data_formats = [f for f in output_formats if f != "xlsx"]
+    if data_formats:
+        metadata = {
+            "type": "TS",
+            **info,
+            "tlm_spacing": tlm_spacing,
+            "tlm_width": tlm_width,
+        }
+        data_file_names = [
+            *save_summary_frame(file_name, structures_df, data_formats, metadata),
+            *save_summary_frame(f"{file_name}-tlm", tlm_df, data_formats, metadata),
+        ]
+        for data_file_name in data_file_names:
+            ctx.logger.info(f"Summary data is saved to {data_file_name}")
+
+
+def get_ts_measurements_query(wafer: Wafer) -> Select:
+    """
+    Build a query of all test structures' measurements of the wafer.
+    """
+    return (
+        select(
+            TsConditions.id.label("conditions_id"),
+            AbstractChip.name.label("chip"),
+            TsConditions.structure_type,
+            TsConditions.ts_number,
+            TsConditions.ts_step,
+            TsConditions.datetime,
+            TsMeasurement.current,
+            TsMeasurement.voltage_1,
+            TsMeasurement.voltage_2,
+        )
+        .join(AbstractChip, AbstractChip.id == TsConditions.chip_id)
+        .join(TsMeasurement, TsMeasurement.conditions_id == TsConditions.id)
+        .where(AbstractChip.wafer_id == wafer.id)
+    )
+
+
+def get_structures_frame(measurements_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Get resistance of every structure as the slope of V2 - V1 over current.
+    :param measurements_df: Measurements as returned by `get_ts_measurements_query`.
+    :return: One row per structure.
+    """
+    groups, conditions_ids = pd.factorize(measurements_df["conditions_id"])
+    fit = fit_lines(
+        groups,
+        measurements_df["current"].to_numpy(dtype="float64"),
+        (measurements_df["voltage_2"] - measurements_df["voltage_1"]).to_numpy(dtype="float64"),
+    )
+    conditions_df = (
+        measurements_df.drop_duplicates("conditions_id")
+        .set_index("conditions_id")
+        .loc[conditions_ids, ["chip", "structure_type", "ts_number", "ts_step", "datetime"]]
+    )
+    df = conditions_df.assign(
+        resistance=fit["slope"],
+        offset_voltage=fit["intercept"],
+        r_squared=fit["r_squared"],
+    )
+    return df.sort_values(["chip", "structure_type", "ts_number", "ts_step"], ignore_index=True)
+
+
+def get_tlm_frame(
+    structures_df: pd.DataFrame,
+    spacing: Sequence[float] | None = None,
+    width: float | None = None,
+) -> pd.DataFrame:
+    """
+    Fit total resistance over contact distance of every TLM group: R = Rsh / W * d + 2 * Rc.
+    Transfer length is Rc / (Rsh / W).
+    :param structures_df: Structures as returned by `get_structures_frame`.
+    :param spacing: Distances between contacts in um by step, starting from step 1. Step numbers
+        are used as distances if None.
+    :param width: Width of the contacts in um.
+    :return: One row per chip and TLM number.
+    """
+    tlm_df = structures_df[
+        (structures_df["structure_type"] == "TLM") & structures_df["resistance"].notna()
+    ]
+    if spacing is None:
+        distances = tlm_df["ts_step"].astype("float64")
+    else:
+        distances = tlm_df["ts_step"].map(
+            lambda step: spacing[step - 1] if 0 < step <= len(spacing) else np.nan
+        )
+    tlm_df = tlm_df[distances.notna()]
+    distances = distances[distances.notna()]
+    groups = tlm_df.groupby(["chip", "ts_number"], sort=True).ngroup().to_numpy(dtype="int64")
+    fit = fit_lines(
+        groups, distances.to_numpy(dtype="float64"), tlm_df["resistance"].to_numpy(dtype="float64")
+    )
+    keys_df = (
+        tlm_df[["chip", "ts_number"]]
+        .drop_duplicates()
+        .sort_values(["chip", "ts_number"], ignore_index=True)
+    )
+    contact_resistance = fit["intercept"] / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        transfer_length = contact_resistance / fit["slope"]
+    df = keys_df.assign(
+        steps=fit["points"].astype("int64"),
+        slope=fit["slope"],
+        contact_resistance=contact_resistance,
+        transfer_length=transfer_length,
+        sheet_resistance=(
+            fit["slope"] * width if spacing is not None and width is not None else np.nan
+        ),
+        r_squared=fit["r_squared"],
+    )
+    return df
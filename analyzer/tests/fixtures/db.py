@@ -10,6 +10,7 @@ from orm import (
     IvConditions,
     Misc,
     Wafer,
+    reference_cache,
 )
 
 
@@ -43,6 +44,7 @@ def db(wafer, chips, iv_thresholds, session):
     session.query(Misc).delete()
     
     session.execute(insert(Misc).values(name="iv_thresholds", data=iv_thresholds))
+    reference_cache.invalidate(Misc)
     voltage_measure = {
         "-1": [1, 2, 3, 4, 1, 2, 3, 4],
         "-0.01": list(range(8)),
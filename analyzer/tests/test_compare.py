@@ -1,12 +1,28 @@
 import re
+from decimal import Decimal
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pytest
 from click.testing import CliRunner
 
 from analyzer import analyzer
-from analyzer.compare import compare_wafers
+from analyzer.compare import (
+    aggregate_compare_frames,
+    compare_states,
+    compare_wafers,
+    get_bootstrap_intervals,
+    get_compare_frames,
+    get_compare_intervals,
+    get_sheets_data_from_aggregates,
+    get_sheets_data_from_intervals,
+    get_state_pairs_frame,
+    get_state_transitions_summary,
+    get_wafer_aggregates,
+)
+from orm import Wafer
+from utils import ThresholdMatrix
 
 wafer_name = "ABCD"
 chip_names = [
@@ -54,6 +70,16 @@ class TestCompareWafers:
     def test_exit_code(self, execution):
         assert execution.exit_code == 0
     
+    def test_fresh_exit_code(self, runner, ctx_obj):
+        result = runner.invoke(compare_wafers, ["-w", wafer_name, "--fresh"], obj=ctx_obj)
+        assert result.exit_code == 0
+    
+    def test_ci_exit_code(self, runner, ctx_obj):
+        result = runner.invoke(
+            compare_wafers, ["-w", wafer_name, "--ci", "--resamples", "100"], obj=ctx_obj
+        )
+        assert result.exit_code == 0
+    
     def test_empty_result(self, runner, ctx_obj, log_handler):
         result = runner.invoke(compare_wafers, ["-w", "NONE"], obj=ctx_obj)
         assert result.exit_code == 0
@@ -68,3 +94,219 @@ class TestCompareWafers:
         stub = pd.read_excel("./stub.xlsx")
         actual = pd.read_excel(created_file)
         assert stub.equals(actual)
+
+
+def test_aggregate_compare_frames():
+    thresholds = ThresholdMatrix(
+        {"X": {Decimal("-1.00"): 1.0}, "G": {Decimal("-1.00"): 2.0, Decimal("6.00"): 3.0}}, "IV"
+    )
+    values_frame = pd.DataFrame(
+        [[1.5, 4.0], [1.5, 2.0], [2.5, np.nan], [0.5, np.nan]],
+        index=pd.MultiIndex.from_tuples(
+            [(1, "G", 1, 1), (1, "G", 1, 2), (2, "X", 1, 3), (2, "X", 1, 4)],
+            names=["wafer_id", "chip_type", "chip_state_id", "chip_id"],
+        ),
+        columns=pd.Index([-1_000_000, 6_000_000], name="voltage"),
+    )
+    row_thresholds = thresholds.get_thresholds(
+        values_frame.index.get_level_values("chip_type"), values_frame.columns
+    )
+    pass_frame = pd.DataFrame(
+        thresholds.get_pass_mask(values_frame.to_numpy(), row_thresholds),
+        index=values_frame.index,
+        columns=values_frame.columns,
+    )
+    
+    aggregates_df = aggregate_compare_frames(values_frame, pass_frame)
+    voltages_df = aggregates_df[aggregates_df["voltage"].notna()].set_index(
+        ["wafer_id", "voltage"]
+    )
+    assert voltages_df.loc[(1, 6_000_000), "chips_number"] == 2
+    assert voltages_df.loc[(1, 6_000_000), "passed_number"] == 1
+    assert voltages_df.loc[(2, -1_000_000), "median"] == 1.5
+    # X chips have no threshold and no values at 6 V
+    assert (2, 6_000_000) not in voltages_df.index
+    
+    sheets_data = get_sheets_data_from_aggregates(
+        aggregates_df, [Wafer(id=1, name="A"), Wafer(id=2, name="B")]
+    )
+    df = sheets_data["yield"]["frame"]
+    assert df.loc[("A", 1), (-1_000_000, "G")] == 0
+    assert df.loc[("A", 1), (6_000_000, "G")] == 0.5
+    assert df.loc[("B", 1), (-1_000_000, "X")] == 0.5
+    assert df["Total", ""].tolist() == [0, 0.5]
+
+
+def test_sheets_data_from_aggregates():
+    thresholds = ThresholdMatrix(
+        {"X": {Decimal("-1.00"): 1.0}, "G": {Decimal("-1.00"): 2.0, Decimal("6.00"): 3.0}}, "IV"
+    )
+    values_df = pd.DataFrame(
+        [
+            (1, "G", 1, 1, -1_000_000, 1.5),
+            (1, "G", 1, 1, 6_000_000, 4.0),
+            (1, "G", 1, 2, -1_000_000, 1.5),
+            (1, "G", 1, 2, 6_000_000, 2.0),
+            (2, "X", 1, 3, -1_000_000, 0.0),
+            (2, "X", 1, 3, -1_000_000, 2.5),
+            (2, "X", 1, 4, -1_000_000, 0.5),
+            (2, "X", 1, 4, 6_000_000, 0.5),
+        ],
+        columns=["wafer_id", "chip_type", "chip_state_id", "chip_id", "voltage", "value"],
+    )
+    aggregates_df = get_wafer_aggregates(values_df, thresholds)
+    # X chips have no threshold at 6 V
+    assert len(aggregates_df) == 5
+    totals_df = aggregates_df[aggregates_df["voltage"].isna()]
+    assert totals_df["chips_number"].tolist() == [2, 2]
+    assert totals_df["passed_number"].tolist() == [0, 1]
+    
+    wafers = [Wafer(id=2, name="B"), Wafer(id=1, name="A")]
+    sheets_data = get_sheets_data_from_aggregates(aggregates_df, wafers)
+    yield_df = sheets_data["yield"]["frame"]
+    assert yield_df.index.tolist() == [("B", 1), ("A", 1)]
+    assert yield_df.loc[("A", 1), (6_000_000, "G")] == 0.5
+    assert yield_df.loc[("B", 1), (-1_000_000, "X")] == 0.5
+    assert yield_df["Total", ""].tolist() == [0.5, 0]
+    assert sheets_data["leakage"]["frame"].loc[("B", 1), (-1_000_000, "X")] == 1.5
+
+
+@pytest.mark.parametrize("wafer, chips", [(wafer_name, chip_names)], indirect=True)
+class TestCompareStates:
+    # set db to autouse it in all tests
+    @pytest.fixture(scope="class", autouse=True)
+    def db(self, wafer, chips, db):
+        ...
+    
+    def test_same_states(self, runner, ctx_obj):
+        with runner.isolated_filesystem():
+            result = runner.invoke(
+                compare_states, ["-w", wafer_name, "--from", "1", "--to", "1"], obj=ctx_obj
+            )
+        assert result.exit_code == 2
+    
+    def test_exit_code(self, runner, ctx_obj):
+        with runner.isolated_filesystem():
+            result = runner.invoke(
+                compare_states, ["-w", wafer_name, "--from", "1", "--to", "2", "--no-plot"],
+                obj=ctx_obj,
+            )
+        assert result.exit_code == 0
+
+
+class TestStatePairs:
+    @pytest.fixture
+    def pairs_df(self):
+        thresholds = ThresholdMatrix({"X": {Decimal("-1.00"): 1.0}}, "IV")
+        values_df = pd.DataFrame(
+            [
+                # chip 1 fails before and passes after, only its latest values count
+                (1, "X0101", 1, -1_000_000, 5.0),
+                (1, "X0101", 1, -1_000_000, 0.5),
+                (1, "X0101", 2, -1_000_000, 2.0),
+                # chip 2 passes in both states
+                (2, "X0102", 1, -1_000_000, 4.0),
+                (2, "X0102", 2, -1_000_000, 3.0),
+                # chip 3 is not measured after the transition
+                (3, "X0103", 1, -1_000_000, 4.0),
+                # there is no threshold at 6 V
+                (2, "X0102", 1, 6_000_000, 4.0),
+                (2, "X0102", 2, 6_000_000, 3.0),
+            ],
+            columns=["chip_id", "chip", "chip_state_id", "voltage", "value"],
+        ).assign(wafer_id=1, chip_type="X")
+        return get_state_pairs_frame(values_df, 1, 2, thresholds)
+    
+    def test_pairs(self, pairs_df):
+        assert pairs_df["chip"].tolist() == ["X0101", "X0102"]
+        assert pairs_df["voltage"].tolist() == [-1_000_000] * 2
+        assert pairs_df["delta"].tolist() == [1.5, -1.0]
+        assert pairs_df["ratio"].tolist() == [4.0, 0.75]
+        assert pairs_df["passed_from"].tolist() == [0, 1]
+        assert pairs_df["passed_to"].tolist() == [1, 1]
+    
+    def test_summary(self, pairs_df):
+        summary_df = get_state_transitions_summary(pairs_df)
+        row = summary_df.loc[("X", -1_000_000)]
+        assert row["Chips"] == 2
+        assert row["Yield from"] == 0.5
+        assert row["Yield to"] == 1
+        assert row["Passed → failed"] == 0
+        assert row["Failed → passed"] == 0.5
+        assert row["Delta 50%"] == 0.25
+
+
+class TestBootstrapIntervals:
+    @pytest.mark.parametrize("size", [1, 2, 7, 8])
+    def test_median(self, size):
+        rng = np.random.default_rng(1)
+        values = rng.lognormal(size=size)
+        df = get_bootstrap_intervals(
+            pd.Series(values, index=[0] * size), "median", 20000, 0.9, rng
+        )
+        resampled = values[rng.integers(0, size, size=(20000, size))]
+        expected = np.quantile(np.median(resampled, axis=1), [0.05, 0.95])
+        np.testing.assert_allclose(df.loc[0].to_numpy(), expected)
+    
+    def test_proportion(self):
+        samples = pd.Series([1, 1, 1, 0, 1, np.nan], index=["a", "a", "a", "b", "b", "b"])
+        df = get_bootstrap_intervals(samples, "proportion", 1000, 0.95, np.random.default_rng(1))
+        assert df.loc["a"].tolist() == [1, 1]
+        assert df.loc["b"].tolist() == [0, 1]
+    
+    def test_sheets_data(self):
+        thresholds = ThresholdMatrix({"X": {Decimal("-1.00"): 1.0}}, "IV")
+        values_df = pd.DataFrame(
+            [
+                (1, "X", 1, chip_id, -1_000_000, value)
+                for chip_id, value in enumerate([0.5, 2, 3, 4])
+            ],
+            columns=["wafer_id", "chip_type", "chip_state_id", "chip_id", "voltage", "value"],
+        )
+        intervals_df = get_compare_intervals(
+            *get_compare_frames(values_df, thresholds), 1000, 0.9, np.random.default_rng(1)
+        )
+        sheets_data = get_sheets_data_from_intervals(intervals_df, [Wafer(id=1, name="A")], 0.9)
+        yield_df = sheets_data["yield_ci"]["frame"]
+        assert sheets_data["yield_ci"]["title"] == "Yield 90% CI"
+        assert yield_df.index.tolist() == [("A", 1, "5.0%"), ("A", 1, "95.0%")]
+        assert yield_df[-1_000_000, "X"].tolist() == yield_df["Total", ""].tolist()
+        leakage = sheets_data["leakage_ci"]["frame"][-1_000_000, "X"].tolist()
+        assert 0.5 <= leakage[0] <= 2.5 <= leakage[1] <= 4
+
+
+class TestThresholdMatrix:
+    @pytest.fixture
+    def thresholds(self):
+        return {"X": {Decimal("-1.00"): 1.0, Decimal("10.00"): None}, "G": {Decimal("6.00"): 3.0}}
+    
+    def test_get_thresholds(self, thresholds):
+        matrix = ThresholdMatrix(thresholds, "IV")
+        np.testing.assert_array_equal(
+            matrix.get_thresholds(["G", "X", "XH"], [6_000_000, -1_000_000, 10_000_000]),
+            [[3, np.nan, np.nan], [np.nan, 1, np.nan], [np.nan, np.nan, np.nan]],
+        )
+    
+    def test_get_paired_thresholds(self, thresholds):
+        matrix = ThresholdMatrix(thresholds, "IV")
+        np.testing.assert_array_equal(
+            matrix.get_paired_thresholds(
+                ["G", "X", "XH"], [6_000_000, 6_000_000, -1_000_000]
+            ),
+            [3, np.nan, np.nan],
+        )
+    
+    @pytest.mark.parametrize("kind, expected", [("IV", [0, 1, 1]), ("CV", [1, 0, 0])])
+    def test_get_pass_mask(self, thresholds, kind, expected):
+        matrix = ThresholdMatrix(thresholds, kind)
+        mask = matrix.get_pass_mask(np.array([0.5, 1.0, 2.0, np.nan]), np.array([1.0]))
+        np.testing.assert_array_equal(mask, [*expected, np.nan])
+    
+    def test_version(self, thresholds):
+        assert ThresholdMatrix(thresholds, "IV").version == ThresholdMatrix(
+            {"G": {Decimal("6.00"): 3.0}, "X": {Decimal("10.00"): None, Decimal("-1.00"): 1.0}},
+            "IV",
+        ).version
+        assert ThresholdMatrix(thresholds, "IV").version != ThresholdMatrix(
+            {"X": {Decimal("-1.00"): 1.5}, "G": {Decimal("6.00"): 3.0}}, "IV"
+        ).version
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.summary.cv_profile import (
+    ELEMENTARY_CHARGE,
+    SILICON_PERMITTIVITY,
+    get_cv_profile,
+    get_cv_profile_frame,
+    get_ragged_gradient,
+)
+
+DOPING = 1e18  # m^-3
+THICKNESS = 100e-6  # m
+BUILT_IN_VOLTAGE = 0.5
+AREA = 1.0  # mm²
+
+
+@pytest.fixture
+def capacitance():
+    """
+    CV curves of an abrupt junction with uniform doping, that is fully depleted at ~7.2 V.
+    """
+    voltages = -np.arange(0, 20.1, 1.0)
+    width = np.minimum(
+        np.sqrt(
+            2 * SILICON_PERMITTIVITY * (BUILT_IN_VOLTAGE - voltages) / (ELEMENTARY_CHARGE * DOPING)
+        ),
+        THICKNESS,
+    )
+    values = SILICON_PERMITTIVITY * AREA * 1e-6 / width
+    df = pd.DataFrame(
+        [values, values, values],
+        index=["X01", "X02", "G01"],
+        columns=[Decimal(f"{v:.5f}") for v in voltages],
+    )
+    df.iloc[1, 3] = np.nan
+    return df
+
+
+@pytest.fixture
+def areas():
+    return pd.Series({"X01": AREA, "X02": AREA, "G01": np.nan})
+
+
+class TestGetRaggedGradient:
+    def test_skips_gaps(self):
+        y = np.array([[0.0, 1.0, 2.0, 3.0], [0.0, np.nan, 4.0, 6.0]])
+        gradient = get_ragged_gradient(y, np.array([0.0, 1.0, 2.0, 3.0]))
+        np.testing.assert_allclose(gradient[0], [1, 1, 1, 1])
+        np.testing.assert_allclose(gradient[1], [2, np.nan, 2, 2])
+
+
+class TestGetCVProfile:
+    def test_depletion_width(self, capacitance, areas):
+        profile = get_cv_profile(capacitance, areas)
+        assert profile.depletion_width.columns.equals(capacitance.columns)
+        assert profile.depletion_width.loc["X01"].max() == pytest.approx(THICKNESS * 1e6)
+        assert profile.depletion_width.loc["G01"].isna().all()
+    
+    def test_doping(self, capacitance, areas):
+        profile = get_cv_profile(capacitance, areas)
+        # below full depletion the doping of the junction is recovered
+        depleted = profile.doping.loc[["X01", "X02"]].iloc[:, 1:7]
+        np.testing.assert_allclose(depleted.dropna(axis=1), DOPING * 1e-6, rtol=1e-6)
+    
+    def test_full_depletion(self, capacitance, areas):
+        full_depletion = get_cv_profile(capacitance, areas).full_depletion
+        assert full_depletion["Full depletion voltage"].tolist()[:2] == [-9, -9]
+        assert full_depletion.loc["X01", "Depletion width [um]"] == pytest.approx(100)
+        # full depletion voltage doesn't depend on the area
+        assert full_depletion.loc["G01", "Full depletion voltage"] == -9
+        assert np.isnan(full_depletion.loc["G01", "Depletion width [um]"])
+    
+    def test_frame(self, capacitance, areas):
+        df = get_cv_profile_frame(capacitance, get_cv_profile(capacitance, areas))
+        assert df.columns.tolist() == [
+            "chip", "voltage", "capacitance", "depletion_width_um", "doping_cm3",
+            "full_depletion_voltage",
+        ]
+        assert len(df) == capacitance.count().sum()
+        assert (df.loc[df["chip"] == "X01", "full_depletion_voltage"] == -9).all()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.context import AnalyzerContext
+from analyzer.eqe import (
+    get_recalibrated_values,
+    read_calibration_file,
+    recalibrate_eqe,
+)
+
+
+@pytest.fixture
+def measurements_df():
+    return pd.DataFrame({
+        "id": [1, 2, 3, 4],
+        "wavelength": [400, 500, 600, 1200],
+        "responsivity": [0.1, None, 0.3, 0.4],
+    })
+
+
+class TestReadCalibrationFile:
+    def test_header_is_skipped(self, tmp_path):
+        file_path = tmp_path / "calibration.csv"
+        file_path.write_text("Wavelength (nm);Responsivity (A/W)\n500;0.3\n400;0.2\n")
+        curve = read_calibration_file(file_path)
+        assert curve.index.tolist() == [400, 500]
+        assert curve.tolist() == [0.2, 0.3]
+    
+    def test_no_data(self, tmp_path):
+        file_path = tmp_path / "calibration.csv"
+        file_path.write_text("Wavelength (nm)\tResponsivity (A/W)\n")
+        with pytest.raises(ValueError):
+            read_calibration_file(file_path)
+
+
+class TestGetRecalibratedValues:
+    def test_values(self, measurements_df):
+        previous = pd.Series([0.2, 0.4], index=[400, 800])
+        calibration = pd.Series([0.4, 0.4], index=[400, 800])
+        df = get_recalibrated_values(measurements_df, previous, calibration)
+        # measurements without responsivity or out of the curves are skipped
+        assert df["id"].tolist() == [1, 3]
+        np.testing.assert_allclose(df["responsivity"], [0.2, 0.3 * 0.4 / 0.3])
+        np.testing.assert_allclose(df["eqe"], df["responsivity"] * 1239.84 / [400, 600] * 100)
+
+
+class TestRecalibrateEqe:
+    def test_same_name_is_refused(self, tmp_path, runner):
+        file_path = tmp_path / "calibration.csv"
+        file_path.write_text("400;0.2\n800;0.4\n")
+        result = runner.invoke(
+            recalibrate_eqe, ["-c", str(file_path), "-p", str(file_path)], obj=AnalyzerContext()
+        )
+        assert result.exit_code == 2
+        assert "--new-name" in result.output
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.summary.eqe_spectrum import (
+    get_eqe_metrics,
+    parse_wavelength_range,
+    resample_curves,
+    smooth_curves,
+)
+
+
+@pytest.fixture
+def curves():
+    return pd.DataFrame(
+        [
+            [10.0, 20.0, 40.0, np.nan],
+            [np.nan, 30.0, np.nan, 10.0],
+        ],
+        columns=[400, 500, 600, 700],
+    )
+
+
+class TestParseWavelengthRange:
+    def test_grid(self):
+        assert parse_wavelength_range("300:1100:5", 3) == (300, 1100, 5)
+    
+    @pytest.mark.parametrize("value", ["300:1100", "1100:300:5", "300:1100:0", "a:b:c"])
+    def test_invalid(self, value):
+        with pytest.raises(ValueError):
+            parse_wavelength_range(value, 3)
+
+
+class TestResampleCurves:
+    def test_interpolation(self, curves):
+        df = resample_curves(curves, np.array([350, 400, 450, 550, 650]))
+        assert df.columns.tolist() == [350, 400, 450, 550, 650]
+        np.testing.assert_allclose(df.iloc[0], [np.nan, 10, 15, 30, np.nan])
+        # the gap at 600 nm is interpolated between 500 and 700 nm
+        np.testing.assert_allclose(df.iloc[1], [np.nan, np.nan, np.nan, 25, 15])
+    
+    def test_unsorted_columns(self, curves):
+        expected = resample_curves(curves, np.array([450, 650]))
+        actual = resample_curves(curves[[700, 400, 600, 500]], np.array([450, 650]))
+        pd.testing.assert_frame_equal(actual, expected)
+
+
+class TestSmoothCurves:
+    def test_moving_average(self):
+        df = pd.DataFrame([[1.0, 2.0, 6.0, np.nan, 4.0]])
+        np.testing.assert_allclose(smooth_curves(df, 3).iloc[0], [1.5, 3, 4, np.nan, 4])
+
+
+class TestGetEqeMetrics:
+    def test_metrics(self, curves):
+        df = get_eqe_metrics(curves, [(400, 500), (650, 700)])
+        assert df.columns.tolist() == [
+            "Peak wavelength, nm", "Peak EQE, %", "Mean EQE 400-500 nm, %",
+            "Mean EQE 650-700 nm, %",
+        ]
+        np.testing.assert_allclose(df.iloc[0], [600, 40, 15, np.nan])
+        np.testing.assert_allclose(df.iloc[1], [500, 30, 30, 10])
@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from analyzer.excel import (
+    ThresholdRange,
+    get_report_writer,
+)
+from analyzer.summary.common import get_threshold_ranges
+
+
+@pytest.fixture
+def summary_df():
+    df = pd.DataFrame(
+        np.arange(15, dtype=float).reshape(5, 3),
+        index=["AA01", "AA02", "X01", "X02", "XH01"],
+        columns=[Decimal("-1"), Decimal("0.01"), Decimal("5")],
+    )
+    df.iloc[1, 1] = np.nan
+    df.insert(0, "Temperature", "25.00")
+    return df
+
+
+@pytest.fixture
+def thresholds():
+    return {
+        "X": {Decimal("5.00"): 7},
+        "AA": {Decimal("-1.00"): 2, Decimal("0.01"): 3, Decimal("10.00"): 4},
+        "G": {Decimal("5.00"): 1},
+    }
+
+
+@pytest.fixture
+def compare_df():
+    columns = pd.MultiIndex.from_tuples(
+        [
+            (Decimal("-1.00"), "G", Decimal("0.600")),
+            (Decimal("-1.00"), "X", Decimal("0.500")),
+            (Decimal("5.00"), "X", Decimal("0.500")),
+        ],
+        names=["Voltage", "Chip type", "Perimeter / area"],
+    )
+    index = pd.MultiIndex.from_tuples(
+        [("W1", "ALL"), ("W1", "GOOD"), ("W2", "ALL")],
+        names=["Wafer", "Chip state"],
+    )
+    return pd.DataFrame(np.linspace(0, 1, 9).reshape(3, 3), index=index, columns=columns)
+
+
+class TestGetThresholdRanges:
+    def test_ranges(self, summary_df, thresholds):
+        ranges = get_threshold_ranges(summary_df, thresholds)
+        assert sorted(ranges) == [
+            ThresholdRange(first_row=0, last_row=1, column=1, threshold=2),
+            ThresholdRange(first_row=0, last_row=1, column=2, threshold=3),
+            ThresholdRange(first_row=2, last_row=3, column=3, threshold=7),
+        ]
+    
+    def test_chip_type_prefix_is_matched_fully(self, summary_df):
+        ranges = get_threshold_ranges(summary_df, {"XH": {Decimal("5.00"): 1}})
+        assert ranges == [ThresholdRange(first_row=4, last_row=4, column=3, threshold=1)]
+
+
+class TestReportWriters:
+    @pytest.fixture
+    def write_report(self, tmp_path, summary_df, thresholds, compare_df):
+        def write_report(engine: str):
+            file_name = str(tmp_path / f"report-{engine}.xlsx")
+            with get_report_writer(file_name, engine) as writer:
+                writer.write_frame(summary_df, "Summary")
+                writer.add_threshold_rules(
+                    "Summary",
+                    get_threshold_ranges(summary_df, thresholds),
+                    {"lessThan": "ee9090", "greaterThanOrEqual": "90ee90"},
+                )
+                writer.write_frame(compare_df, "Compare", "0.00E+00")
+                writer.write_frame(pd.Series({"Wafer": "W1", "Chip state": "ALL"}), "Info")
+            return file_name
+        
+        return write_report
+    
+    def test_same_content(self, write_report):
+        expected = pd.read_excel(write_report("openpyxl"), sheet_name=None, header=None)
+        actual = pd.read_excel(write_report("xlsxwriter"), sheet_name=None, header=None)
+        assert expected.keys() == actual.keys()
+        for sheet_name, df in expected.items():
+            pd.testing.assert_frame_equal(df, actual[sheet_name])
+    
+    @pytest.mark.parametrize("engine", ["openpyxl", "xlsxwriter"])
+    def test_conditional_formatting(self, write_report, engine):
+        sheet = openpyxl.load_workbook(write_report(engine))["Summary"]
+        ranges = sorted(str(rule.sqref) for rule in sheet.conditional_formatting)
+        assert ranges == ["C2:C3", "D2:D3", "E4:E5"]
+    
+    @pytest.mark.parametrize("engine", ["openpyxl", "xlsxwriter"])
+    def test_number_format(self, write_report, engine):
+        sheet = openpyxl.load_workbook(write_report(engine))["Compare"]
+        assert sheet["C5"].number_format == "0.00E+00"
+        assert sheet["E7"].number_format == "0.00E+00"
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.summary.iv_features import (
+    BOLTZMANN_OVER_CHARGE,
+    ZERO_CELSIUS,
+    get_iv_features,
+)
+
+IDEALITY_FACTOR = 1.5
+SATURATION_CURRENT = 1e-12  # A
+SERIES_RESISTANCE = 20.0  # Ohm
+TEMPERATURE = 25.0  # C
+
+
+def get_sweep(conditions_id: int) -> pd.DataFrame:
+    """
+    Sweep of a diode with series resistance in forward bias and ohmic leakage in reverse bias.
+    """
+    thermal_voltage = BOLTZMANN_OVER_CHARGE * (TEMPERATURE + ZERO_CELSIUS)
+    forward_current = np.logspace(-9, -2, 100)
+    forward_voltage = (
+        IDEALITY_FACTOR * thermal_voltage * np.log(forward_current / SATURATION_CURRENT + 1)
+        + forward_current * SERIES_RESISTANCE
+    )
+    reverse_voltage = np.arange(1.0, 11.0)
+    reverse_current = 1e-9 * reverse_voltage
+    return pd.DataFrame({
+        "conditions_id": conditions_id,
+        "voltage": np.concatenate([-forward_voltage, [0.0], reverse_voltage]),
+        "current": np.concatenate([forward_current, [0.0], -reverse_current]),
+        "temperature": TEMPERATURE,
+    })
+
+
+@pytest.fixture
+def sweeps_df():
+    breakdown = get_sweep(2)
+    breakdown.loc[breakdown["voltage"] == 10, "current"] = -1e-5
+    reverse_only = pd.DataFrame({
+        "conditions_id": 3,
+        "voltage": [1.0, 2.0, 3.0],
+        "current": [-1e-9, -2e-9, -3e-9],
+        "temperature": np.nan,
+    })
+    # shuffled to check that sweeps are sorted
+    return pd.concat([get_sweep(1), breakdown, reverse_only]).sample(frac=1, random_state=0)
+
+
+class TestGetIvFeatures:
+    def test_index(self, sweeps_df):
+        df = get_iv_features(sweeps_df)
+        assert df.index.tolist() == [1, 2, 3]
+    
+    def test_forward_branch(self, sweeps_df):
+        df = get_iv_features(sweeps_df)
+        np.testing.assert_allclose(df.loc[1, "ideality_factor"], IDEALITY_FACTOR, rtol=1e-2)
+        np.testing.assert_allclose(df.loc[1, "series_resistance"], SERIES_RESISTANCE, rtol=1e-2)
+        assert np.isnan(df.loc[3, "ideality_factor"])
+        assert np.isnan(df.loc[3, "series_resistance"])
+    
+    def test_reverse_branch(self, sweeps_df):
+        df = get_iv_features(sweeps_df)
+        assert np.isnan(df.loc[1, "breakdown_voltage"])
+        # log-interpolated between 9 V and 10 V
+        np.testing.assert_allclose(
+            df.loc[2, "breakdown_voltage"], 9 + np.log(1e-6 / 9e-9) / np.log(1e-5 / 9e-9)
+        )
+        np.testing.assert_allclose(df.loc[[1, 3], "leakage_slope"], 1e-9)
+        # points from breakdown are excluded
+        np.testing.assert_allclose(df.loc[2, "leakage_slope"], 1e-9)
+    
+    def test_breakdown_current(self, sweeps_df):
+        df = get_iv_features(sweeps_df, breakdown_current=2.5e-9)
+        np.testing.assert_allclose(
+            df.loc[[1, 3], "breakdown_voltage"], 2 + np.log(1.25) / np.log(1.5)
+        )
+    
+    def test_zero_crossing(self, sweeps_df):
+        df = get_iv_features(sweeps_df)
+        assert df.loc[1, "zero_crossing_voltage"] == 0
+        assert np.isnan(df.loc[3, "zero_crossing_voltage"])
+    
+    def test_interpolated_zero_crossing(self):
+        df = get_iv_features(pd.DataFrame({
+            "conditions_id": 1,
+            "voltage": [-2.0, -1.0, 1.0, 2.0],
+            "current": [-2e-9, -1e-9, 3e-9, 4e-9],
+            "temperature": TEMPERATURE,
+        }))
+        np.testing.assert_allclose(df.loc[1, "zero_crossing_voltage"], -0.5)
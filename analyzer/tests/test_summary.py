@@ -1,7 +1,14 @@
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
 import pytest
 from click.testing import CliRunner
 
+from PIL import Image
+
 from analyzer.summary import summary_group
+from analyzer.summary.common import stitch_images
 
 wafer_name = "PD5"
 chip_names = [
@@ -37,6 +44,50 @@ class TestSummaryIV:
     @pytest.mark.invoke(params=["iv", "-w", wafer_name])
     def test_exit_code(self, execution):
         assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["iv", "-w", wafer_name, "-t", "X", "--jobs", "2"])
+    def test_parallel_plotting_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["iv", "-w", wafer_name, "-t", "X", "--plot-format", "pdf"])
+    def test_pdf_plotting_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(
+        params=["iv", "-w", wafer_name, "-f", "parquet", "-f", "csv", "-f", "json", "--no-plot"]
+    )
+    def test_data_formats_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["iv", "-w", wafer_name, "--chunk-size", "3"])
+    def test_chunked_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["iv", "-w", wafer_name, "--features", "-f", "parquet", "--no-plot"])
+    def test_features_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    def test_update(self, runner: CliRunner, ctx_obj, log_handler):
+        params = ["iv", "-w", wafer_name, "-f", "parquet", "--no-plot"]
+        with runner.isolated_filesystem():
+            result = runner.invoke(summary_group, params, obj=ctx_obj)
+            assert result.exit_code == 0
+            previous_summary, = Path(".").glob("*.parquet")
+            result = runner.invoke(
+                summary_group, [*params, "--update", str(previous_summary)], obj=ctx_obj
+            )
+            assert result.exit_code == 0
+        assert log_handler.records[-1].message == "No new measurements found."
+    
+    def test_update_with_different_filters(self, runner: CliRunner, ctx_obj):
+        params = ["iv", "-w", wafer_name, "-f", "parquet", "--no-plot"]
+        with runner.isolated_filesystem():
+            runner.invoke(summary_group, params, obj=ctx_obj)
+            previous_summary, = Path(".").glob("*.parquet")
+            result = runner.invoke(
+                summary_group, [*params, "-t", "X", "--update", str(previous_summary)], obj=ctx_obj
+            )
+        assert result.exit_code == 2
 
 
 @pytest.mark.parametrize("wafer, chips", [(wafer_name, chip_names)], indirect=True)
@@ -49,6 +100,18 @@ class TestSummaryCV:
     @pytest.mark.invoke(params=["cv", "-w", "PD5"])
     def test_exit_code(self, execution):
         assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["cv", "-w", "PD5", "-f", "parquet", "--no-plot"])
+    def test_data_formats_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["cv", "-w", "PD5", "--chunk-size", "3"])
+    def test_chunked_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["cv", "-w", "PD5", "--profile", "--no-plot"])
+    def test_profile_exit_code(self, execution):
+        assert execution.exit_code == 0
 
 
 @pytest.mark.parametrize("wafer, chips", [(wafer_name, chip_names)], indirect=True)
@@ -61,3 +124,64 @@ class TestSummaryEQE:
     @pytest.mark.invoke(params=["eqe", "-w", "PD5"])
     def test_exit_code(self, execution):
         assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["eqe", "-w", "PD5", "--chunk-size", "3", "--no-plot"])
+    def test_chunked_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=[
+        "eqe", "-w", "PD5", "--grid", "300:1100:5", "--smooth", "3", "--band", "400:700",
+        "--no-plot",
+    ])
+    def test_grid_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["eqe", "-w", "PD5", "--max-lines", "1"])
+    def test_envelope_plot_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["eqe", "-w", "PD5", "--grid", "300:1100"])
+    def test_invalid_grid(self, execution):
+        assert execution.exit_code == 2
+
+
+@pytest.mark.parametrize("wafer, chips", [(wafer_name, chip_names)], indirect=True)
+class TestSummaryTS:
+    # set db to autouse it in all tests
+    @pytest.fixture(scope="class", autouse=True)
+    def db(self, wafer, chips, db):
+        ...
+    
+    @pytest.mark.invoke(params=["ts", "-w", "PD5"])
+    def test_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=[
+        "ts", "-w", "PD5", "--tlm-spacing", "10,20,40,80", "--tlm-width", "100", "-f", "parquet",
+    ])
+    def test_tlm_geometry_exit_code(self, execution):
+        assert execution.exit_code == 0
+    
+    @pytest.mark.invoke(params=["ts", "-w", "PD5", "--tlm-spacing", "10,-20"])
+    def test_invalid_tlm_spacing(self, execution):
+        assert execution.exit_code == 2
+
+
+def get_png(color: tuple[int, int, int], size: tuple[int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="png")
+    return buffer.getvalue()
+
+
+def test_stitch_images(tmp_path: Path):
+    file_name = str(tmp_path / "stitched.png")
+    images = [get_png((255, 0, 0), (300, 20)), get_png((0, 0, 255), (200, 10))]
+    stitch_images(file_name, "Title", images, 100)
+    with Image.open(file_name) as image:
+        pixels = np.asarray(image.convert("RGB"))
+        assert image.info["dpi"] == pytest.approx((100, 100), abs=0.01)
+    assert pixels.shape[1] == 300
+    red, blue = pixels[-30:-10], pixels[-10:]
+    assert (red == (255, 0, 0)).all()
+    assert (blue[:, :200] == (0, 0, 255)).all()
+    assert (blue[:, 200:] == 255).all()
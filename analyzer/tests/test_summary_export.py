@@ -0,0 +1,199 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from analyzer.summary.cv import (
+    get_cv_summary_frame,
+    get_sheets_cv_data,
+)
+from analyzer.summary.eqe import (
+    get_eqe_plot_figure,
+    get_sheets_eqe_data,
+)
+from analyzer.summary.export import save_summary_frame
+from analyzer.summary.iv import (
+    get_sheets_iv_data,
+    update_iv_summary_frame,
+)
+
+
+@pytest.fixture
+def values_df():
+    return pd.DataFrame(
+        {-1_000_000: [1.0, 2.0], 5_000_000: [3.0, np.nan]},
+        index=pd.Index(["X01", "X02"]),
+        dtype="float32",
+    )
+
+
+@pytest.fixture
+def iv_summary_df():
+    return pd.DataFrame({
+        "chip": ["X01", "X01", "X02"],
+        "voltage": [-1.0, 5.0, -1.0],
+        "anode_current": [1.0, 3.0, 2.0],
+        "anode_current_raw": [2.0, 6.0, 4.0],
+        "cathode_current": [3.0, 9.0, 6.0],
+        "guard_current": [4.0, 12.0, 8.0],
+        "temperature": [25.0, 27.0, 26.0],
+        "conditions_id": [1, 1, 2],
+        "datetime": pd.to_datetime(["2024-01-01", "2024-01-01", "2024-01-02"]),
+        "voltage_amplitude": [6.0, 6.0, 6.0],
+    })
+
+
+class TestSummaryFrames:
+    def test_sheets_iv_data(self, iv_summary_df):
+        sheets_data = get_sheets_iv_data(iv_summary_df)
+        assert list(sheets_data["anode"].columns) == [-1_000_000, 5_000_000]
+        assert sheets_data["anode_raw"].loc["X01", 5_000_000] == 6
+        assert np.isnan(sheets_data["guard_ring"].loc["X02", 5_000_000])
+        assert sheets_data["temperatures"]["Temperature"].tolist() == [26, 26]
+    
+    def test_update_iv_summary_frame(self, iv_summary_df):
+        new_df = pd.DataFrame({
+            "chip": ["X01", "X01", "X02"],
+            "voltage": [-1.0, 5.0, 0.01],
+            "anode_current": [10.0, 30.0, 40.0],
+            "anode_current_raw": [10.0, 30.0, 40.0],
+            "cathode_current": [10.0, 30.0, 40.0],
+            "guard_current": [10.0, 30.0, 40.0],
+            "temperature": [25.0, 25.0, 25.0],
+            "conditions_id": [3, 4, 4],
+            "datetime": pd.to_datetime(["2024-02-01", "2024-02-01", "2024-02-01"]),
+            "voltage_amplitude": [20.0, 0.02, 0.02],
+        })
+        df = update_iv_summary_frame(iv_summary_df, new_df)
+        assert df[["chip", "voltage", "conditions_id"]].values.tolist() == [
+            ["X01", -1, 3],
+            ["X01", 5, 4],
+            ["X02", -1, 2],
+            ["X02", 0.01, 4],
+        ]
+    
+    def test_update_iv_summary_frame_keeps_narrow_sweep(self, iv_summary_df):
+        new_df = iv_summary_df.iloc[:1].assign(
+            anode_current=100.0, conditions_id=3, voltage_amplitude=20.0
+        )
+        df = update_iv_summary_frame(iv_summary_df, new_df)
+        assert df["conditions_id"].tolist() == [1, 1, 2]
+    
+    def test_cv_summary_frame(self, values_df):
+        df = get_cv_summary_frame({
+            "capacitance": values_df.astype(object),
+            "chip_names": list(values_df.index),
+            "voltages": list(values_df.columns),
+        })
+        assert df.dtypes.to_dict() == {
+            "chip": np.dtype(object),
+            "voltage": np.dtype("float64"),
+            "capacitance": np.dtype("float64"),
+        }
+        assert df["capacitance"].tolist() == [1, 3, 2]
+        assert df["voltage"].tolist() == [-1, 5, -1]
+    
+    def test_sheets_cv_data(self):
+        sheets_data = get_sheets_cv_data(pd.DataFrame({
+            "chip_id": [2, 1, 1],
+            "chip": ["X02", "X01", "X01"],
+            "chip_type": ["X", "X", "X"],
+            "voltage": [-5_000_000, 0, -5_000_000],
+            "capacitance": [3.0, 2.0, 1.0],
+            "datetime": pd.to_datetime(["2024-01-01", "2024-01-01", "2024-01-01"]),
+        }))
+        assert sheets_data["chip_names"] == ["X01", "X02"]
+        assert sheets_data["voltages"] == [-5_000_000, 0]
+        assert (sheets_data["capacitance"].dtypes == "float64").all()
+        assert sheets_data["capacitance"].loc["X01"].tolist() == [1, 2]
+    
+    def test_sheets_eqe_data(self):
+        conditions_df = pd.DataFrame({
+            "conditions_id": [2, 1, 3],
+            "datetime": pd.to_datetime(["2024-01-02", "2024-01-01", "2024-01-03"]),
+            "wafer": ["W1", "W1", "REF"],
+            "chip": ["U01", "U02", "REF1"],
+            "bias": [0.0, 1.0, 0.0],
+            "averaging": [1, 2, 1],
+            "conditions_dark_current": [1e-9, 2e-9, 1e-9],
+            "temperature": [25.0, 25.0, 25.0],
+        })
+        measurements_df = pd.DataFrame({
+            "conditions_id": [2, 2, 1],
+            "wavelength": [500, 400, 500],
+            "eqe": [50.0, 40.0, 30.0],
+            "light_current": [1.0, 2.0, 3.0],
+            "dark_current": [1.0, 2.0, 3.0],
+            "responsivity": [0.5, 0.4, 0.3],
+            "std": [None, None, None],
+        })
+        sheets_data = get_sheets_eqe_data(conditions_df, measurements_df)
+        assert [sheet["name"] for sheet in sheets_data] == [
+            "Info", "EQE", "Light current", "Dark current", "Responsivity", "Standard deviation",
+        ]
+        info_df, eqe_df = sheets_data[0]["df"], sheets_data[1]["df"]
+        assert info_df["Chip"].tolist() == ["U02", "U01", "REF1"]
+        assert eqe_df.index.equals(info_df.index)
+        assert eqe_df.columns.tolist() == ["Wafer", "Chip", 400, 500]
+        assert eqe_df[[400, 500]].dtypes.eq("float64").all()
+        assert eqe_df.loc[pd.Timestamp("2024-01-02"), [400, 500]].tolist() == [40, 50]
+        assert eqe_df.iloc[2][[400, 500]].isna().all()
+
+
+class TestEqePlot:
+    @pytest.fixture
+    def sheets_data(self):
+        df = pd.DataFrame(
+            np.linspace(0, 1, 12).reshape(4, 3),
+            columns=[400, 500, 600],
+            index=pd.date_range("2024-01-01", periods=4, name="Datetime"),
+        )
+        df.insert(0, "Chip", ["REF1", "U01", "U02", "U01"])
+        df.insert(0, "Wafer", ["REF", "W1", "W1", "W1"])
+        return [{"name": "EQE", "df": df, "prop": "eqe", "unit": "%"}]
+    
+    def test_lines(self, sheets_data):
+        ax = get_eqe_plot_figure(sheets_data).axes[0]
+        assert len(ax.collections) == 1
+        # only the latest curve of every chip is plotted
+        assert [t.get_text() for t in ax.get_legend().get_texts()] == [
+            "REF REF1", "W1 U02", "W1 U01",
+        ]
+    
+    def test_envelope(self, sheets_data):
+        ax = get_eqe_plot_figure(sheets_data, no_ref=False, max_lines=2).axes[0]
+        assert [t.get_text() for t in ax.get_legend().get_texts()] == [
+            "5-95% of 2 chips", "25-75%", "Median", "REF REF1",
+        ]
+
+
+class TestSaveSummaryFrame:
+    @pytest.fixture
+    def summary_df(self):
+        return pd.DataFrame({"chip": ["X01", "X02"], "voltage": [-1.0, 5.0]})
+    
+    def test_file_names(self, tmp_path, summary_df):
+        file_names = save_summary_frame(
+            str(tmp_path / "summary"), summary_df, ["parquet", "csv", "json", "csv"]
+        )
+        assert file_names == [
+            str(tmp_path / "summary.parquet"),
+            str(tmp_path / "summary.csv"),
+            str(tmp_path / "summary.ndjson"),
+        ]
+    
+    def test_parquet_metadata(self, tmp_path, summary_df):
+        file_name, = save_summary_frame(
+            str(tmp_path / "summary"), summary_df, ["parquet"], {"type": "IV", "Wafer": "W1"}
+        )
+        metadata = json.loads(pq.read_schema(file_name).metadata[b"analyzer"])
+        assert metadata == {"schema_version": 1, "type": "IV", "Wafer": "W1"}
+        pd.testing.assert_frame_equal(pd.read_parquet(file_name), summary_df)
+    
+    def test_ndjson(self, tmp_path, summary_df):
+        file_name, = save_summary_frame(str(tmp_path / "summary"), summary_df, ["json"])
+        with open(file_name) as f:
+            rows = [json.loads(line) for line in f]
+        assert rows == [{"chip": "X01", "voltage": -1.0}, {"chip": "X02", "voltage": 5.0}]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.summary.common import fit_lines
+from analyzer.summary.ts import (
+    get_structures_frame,
+    get_tlm_frame,
+)
+
+SPACING = [10.0, 20.0, 40.0, 80.0]  # um
+WIDTH = 100.0  # um
+SHEET_RESISTANCE = 100.0  # Ohm/sq
+CONTACT_RESISTANCE = 50.0  # Ohm
+
+
+@pytest.fixture
+def measurements_df():
+    current = np.linspace(-1e-5, 1e-5, 21)
+    frames = []
+    for conditions_id, (chip, structure_type, ts_number, ts_step) in enumerate([
+        ("TS01", "TLM", 1, 1),
+        ("TS01", "TLM", 1, 2),
+        ("TS01", "TLM", 1, 3),
+        ("TS01", "TLM", 1, 4),
+        ("TS01", "AL", 1, 1),
+        ("TS02", "TLM", 1, 2),
+    ]):
+        resistance = SHEET_RESISTANCE / WIDTH * SPACING[ts_step - 1] + 2 * CONTACT_RESISTANCE
+        voltage_1 = 0.1 + current * 1e3
+        frames.append(pd.DataFrame({
+            "conditions_id": conditions_id,
+            "chip": chip,
+            "structure_type": structure_type,
+            "ts_number": ts_number,
+            "ts_step": ts_step,
+            "datetime": pd.Timestamp("2024-01-01"),
+            "current": current,
+            "voltage_1": voltage_1,
+            "voltage_2": voltage_1 + resistance * current + 1e-3,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+class TestFitLines:
+    def test_groups(self):
+        fit = fit_lines(
+            np.array([0, 0, 0, 1, 1, 2]),
+            np.array([0.0, 1.0, 2.0, 0.0, 1.0, 5.0]),
+            np.array([1.0, 3.0, 5.0, 2.0, 2.0, 1.0]),
+        )
+        np.testing.assert_allclose(fit["slope"], [2, 0, np.nan])
+        np.testing.assert_allclose(fit["intercept"], [1, 2, np.nan])
+        np.testing.assert_allclose(fit["r_squared"], [1, 1, np.nan])
+        assert fit["points"].tolist() == [3, 2, 1]
+
+
+class TestSummaryTs:
+    def test_structures(self, measurements_df):
+        df = get_structures_frame(measurements_df)
+        assert df[["chip", "structure_type", "ts_step"]].values.tolist() == [
+            ["TS01", "AL", 1],
+            ["TS01", "TLM", 1],
+            ["TS01", "TLM", 2],
+            ["TS01", "TLM", 3],
+            ["TS01", "TLM", 4],
+            ["TS02", "TLM", 2],
+        ]
+        np.testing.assert_allclose(df["resistance"], [110, 110, 120, 140, 180, 120])
+        np.testing.assert_allclose(df["offset_voltage"], 1e-3, atol=1e-12)
+    
+    def test_tlm(self, measurements_df):
+        df = get_tlm_frame(get_structures_frame(measurements_df), SPACING, WIDTH)
+        assert df["chip"].tolist() == ["TS01", "TS02"]
+        assert df["steps"].tolist() == [4, 1]
+        np.testing.assert_allclose(df.loc[0, "sheet_resistance"], SHEET_RESISTANCE)
+        np.testing.assert_allclose(df.loc[0, "contact_resistance"], CONTACT_RESISTANCE)
+        np.testing.assert_allclose(df.loc[0, "transfer_length"], 50)
+        # a single structure is not enough for the fit
+        assert np.isnan(df.loc[1, "contact_resistance"])
+    
+    def test_tlm_without_geometry(self, measurements_df):
+        df = get_tlm_frame(get_structures_frame(measurements_df))
+        assert df["sheet_resistance"].isna().all()
+        assert df.loc[0, "steps"] == 4
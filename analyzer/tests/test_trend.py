@@ -0,0 +1,72 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer.trend import (
+    decode_batch_ids,
+    get_trend_frame,
+    get_wafer_trend_values,
+)
+
+
+def test_decode_batch_ids():
+    df = decode_batch_ids(pd.Series(["PFM2236", "sch2236B", "PFM2B", "Pilotrun", "PFM2254"]))
+    assert df.loc[0, ["product", "method", "resistivity", "lot"]].tolist() == [
+        "PD", "Fz", "Medium", "PFM2236"
+    ]
+    assert df.loc[1, ["product", "method", "resistivity", "split"]].tolist() == [
+        "SM", "Cz", "High", "B"
+    ]
+    assert df.loc[1, "date"] == pd.Timestamp("2022-09-05")
+    assert df["date"].isna().tolist() == [False, False, True, True, True]
+
+
+def test_wafer_trend_values():
+    aggregates_df = pd.DataFrame(
+        [
+            (1, 1, "X", None, 10, 5, None),
+            (1, 2, "X", None, 10, 10, None),
+            (1, 1, "G", None, 5, 0, None),
+            (1, 1, "X", -1_000_000, 10, 6, -2.0),
+            (1, 1, "G", -1_000_000, 5, 0, 4.0),
+        ],
+        columns=[
+            "wafer_id", "chip_state_id", "chip_type", "voltage", "chips_number", "passed_number",
+            "median",
+        ],
+    ).astype({"voltage": "Int64"})
+    df = get_wafer_trend_values(aggregates_df, [1], voltage_key=-1_000_000)
+    assert df[["chips_number", "passed_number", "leakage"]].values.tolist() == [[15, 5, 3.0]]
+    df = get_wafer_trend_values(aggregates_df, [1, 2], "X")
+    assert df[["chips_number", "passed_number"]].values.tolist() == [[20, 15]]
+    assert np.isnan(df.loc[0, "leakage"])
+
+
+class TestTrendFrame:
+    @pytest.fixture
+    def wafers_df(self):
+        batch_ids = pd.Series(["PFM2301A", "PFM2301B", "PFH2302", "PFM2303"])
+        return decode_batch_ids(batch_ids).assign(
+            wafer_id=[1, 2, 3, 4],
+            chips_number=[10, 10, 20, 0],
+            passed_number=[5, 10, 10, 0],
+            leakage=[1e-9, 1e-7, 1e-8, np.nan],
+        )
+    
+    def test_by_lot(self, wafers_df):
+        df = get_trend_frame(wafers_df, "lot", 2, 0.95)
+        assert df["lot"].tolist() == ["PFM2301", "PFH2302", "PFM2303"]
+        assert df["wafers"].tolist() == [2, 1, 1]
+        assert df["yield"].tolist()[:2] == [0.75, 0.5]
+        assert df["rolling_yield"].tolist() == [0.75, 0.625, 0.5]
+        assert np.allclose(df["leakage"][:2], [1e-8, 1e-8])
+        assert np.isnan(df["leakage"][2])
+        assert np.allclose(df["rolling_leakage"], 1e-8)
+        assert (df["yield_low"] <= df["rolling_yield"]).all()
+        assert (df["yield_high"] >= df["rolling_yield"]).all()
+    
+    def test_by_resistivity(self, wafers_df):
+        df = get_trend_frame(wafers_df, "resistivity", 5, 0.95)
+        assert df["resistivity"].tolist() == ["High", "Medium", "Medium"]
+        assert df["rolling_yield"].tolist() == [0.5, 0.75, 0.75]
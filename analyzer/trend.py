@@ -0,0 +1,392 @@
+import re
+from decimal import Decimal
+from statistics import NormalDist
+from time import strftime
+from typing import (
+    Literal,
+    Sequence,
+)
+
+import click
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from orm import (
+    ChipState,
+    Wafer,
+)
+from utils import (
+    EntityOption,
+    ThresholdMatrix,
+    from_voltage_keys,
+    to_voltage_keys,
+    validate_chip_types,
+)
+from .compare import get_wafers_aggregates
+from .context import (
+    AnalyzerContext,
+    pass_analyzer_context,
+)
+from .summary.export import save_summary_frame
+
+# e.g. PFM2236A: product, growth method, resistivity, year, week and split letter
+BATCH_ID_PATTERN = (
+    r"^(?P<product>[A-Z])(?P<method>[A-Z])(?P<resistivity>[A-Z])"
+    r"(?P<year>\d{2})(?P<week>\d{2})(?P<split>[A-Z])?$"
+)
+PRODUCTS = {"P": "PD", "S": "SM"}
+METHODS = {"F": "Fz", "C": "Cz"}
+RESISTIVITIES = {"M": "Medium", "H": "High"}
+TREND_GROUPS = {
+    "lot": ["lot"],
+    "week": ["year", "week"],
+    "resistivity": ["resistivity", "year", "week"],
+}
+AGGREGATES_BATCH_SIZE = 20
+
+
+def batch_pattern_callback(ctx, param, value: str | None) -> re.Pattern | None:
+    if value is None:
+        return None
+    try:
+        return re.compile(value, re.I)
+    except re.error as e:
+        raise click.BadParameter(
+            f"{value!r} is not a valid regular expression: {e}", ctx=ctx, param=param
+        )
+
+
+@click.command(
+    name="trend",
+    help="""Show yield and leakage trends of wafers over time.
+
+\b Wafers are grouped by lot, week or resistivity class decoded from their batch id
+(see `show wafers`), the time of a group is the week of the batch. Yield and leakage are
+averaged over a rolling window of groups with confidence bands. The trend is saved as a
+chart (png) and a table (parquet).
+""",
+)
+@pass_analyzer_context
+@click.option(
+    "--by",
+    type=click.Choice(list(TREND_GROUPS), case_sensitive=False),
+    default="lot",
+    show_default=True,
+    help="Group wafers by lot, week or resistivity class and week.",
+)
+@click.option(
+    "-b",
+    "--batch",
+    "batch_pattern",
+    callback=batch_pattern_callback,
+    help="Regular expression to select batch ids, e.g. ^PF for Fz PD wafers.",
+)
+@click.option(
+    "-t", "--chips-type", help="Type of the chips to analyze. All chip types by default.",
+    callback=validate_chip_types,
+)
+@click.option(
+    "-s",
+    "--chip-state",
+    "chip_states",
+    help="States of chips to analyze",
+    default=["ALL"],
+    show_default=True,
+    multiple=True,
+    cls=EntityOption,
+    entity_type=ChipState,
+)
+@click.option(
+    "-v",
+    "--voltage",
+    type=float,
+    help="Voltage of the leakage trend. The leakage trend is skipped if not specified.",
+)
+@click.option(
+    "--window",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of groups in the rolling window.",
+)
+@click.option(
+    "--confidence",
+    type=click.FloatRange(min=0, max=1, min_open=True, max_open=True),
+    default=0.95,
+    show_default=True,
+    help="Confidence level of the bands.",
+)
+@click.option(
+    "--fresh",
+    is_flag=True,
+    default=False,
+    help="Aggregate all the wafers from the measurements instead of using stored aggregates.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "file_name",
+    default=lambda: f"trend-{strftime('%y%m%d-%H%M%S')}",
+    help="Output file name without extension.",
+    show_default="trend-{datetime}",
+)
+def trend(
+    ctx: AnalyzerContext,
+    by: Literal["lot", "week", "resistivity"],
+    batch_pattern: re.Pattern | None,
+    chips_type: str | None,
+    chip_states: Sequence[ChipState],
+    voltage: float | None,
+    window: int,
+    confidence: float,
+    fresh: bool,
+    file_name: str,
+):
+    wafers_df = pd.read_sql(
+        select(Wafer.id.label("wafer_id"), Wafer.name, Wafer.batch_id).where(
+            Wafer.batch_id.is_not(None)
+        ),
+        ctx.session.connection(),
+    )
+    if batch_pattern is not None:
+        wafers_df = wafers_df[
+            wafers_df["batch_id"].map(lambda batch_id: batch_pattern.search(batch_id) is not None)
+        ]
+    wafers_df = wafers_df.join(decode_batch_ids(wafers_df["batch_id"]))
+    undecoded = wafers_df["date"].isna()
+    if undecoded.any():
+        ctx.logger.info(
+            f"Batch ids of {undecoded.sum()} wafers can't be decoded. The wafers are skipped."
+        )
+        wafers_df = wafers_df[~undecoded]
+    if wafers_df.empty:
+        ctx.logger.warning("No wafers to analyze")
+        return
+    
+    thresholds = ThresholdMatrix.load(ctx.session, "IV")
+    aggregates_df = get_wafers_aggregates(
+        wafers_df["wafer_id"].tolist(), thresholds, fresh, AGGREGATES_BATCH_SIZE
+    )
+    voltage_key, leakage_voltage = None, None
+    if voltage is not None:
+        voltage_key = int(to_voltage_keys([voltage])[0])
+        leakage_voltage = from_voltage_keys([voltage_key])[0]
+    values_df = get_wafer_trend_values(
+        aggregates_df,
+        [state.id for state in chip_states],
+        chips_type,
+        voltage_key,
+    )
+    wafers_df = wafers_df.merge(values_df, on="wafer_id")
+    if wafers_df.empty:
+        ctx.logger.warning("No measurements of the wafers are found")
+        return
+    
+    trend_df = get_trend_frame(wafers_df, by, window, confidence)
+    plot_file_name = f"{file_name}.png"
+    plot_trend(trend_df, by, plot_file_name, leakage_voltage)
+    metadata = {
+        "type": "trend",
+        "by": by,
+        "batch": batch_pattern.pattern if batch_pattern else None,
+        "chips_type": chips_type,
+        "chip_states": [state.name for state in chip_states],
+        "voltage": leakage_voltage,
+        "window": window,
+        "confidence": confidence,
+    }
+    data_file_names = save_summary_frame(file_name, trend_df, ["parquet"], metadata)
+    for saved_file_name in [plot_file_name, *data_file_names]:
+        ctx.logger.info(f"Trend is saved to {saved_file_name}")
+
+
+def decode_batch_ids(batch_ids: pd.Series) -> pd.DataFrame:
+    """
+    Decode batch ids (e.g. PFM2236A) into product, growth method, resistivity class, year,
+    week, split letter and lot (the batch id without the split letter).
+    :param batch_ids: The batch ids to decode.
+    :return: Decoded fields with the index of the batch ids. The date is the Monday of the
+        week, fields of batch ids that don't match `BATCH_ID_PATTERN` are NaN.
+    """
+    df = batch_ids.str.upper().str.extract(BATCH_ID_PATTERN)
+    df["product"] = df["product"].map(PRODUCTS).fillna(df["product"])
+    df["method"] = df["method"].map(METHODS).fillna(df["method"])
+    df["resistivity"] = df["resistivity"].map(RESISTIVITIES).fillna(df["resistivity"])
+    df["lot"] = batch_ids.str.upper().str[:7].where(df["week"].notna())
+    df["date"] = pd.to_datetime(
+        "20" + df["year"] + "-W" + df["week"] + "-1", format="%G-W%V-%u", errors="coerce"
+    )
+    df["year"] = pd.to_numeric("20" + df["year"]).astype("Int64")
+    df["week"] = pd.to_numeric(df["week"]).astype("Int64")
+    return df
+
+
+def get_wafer_trend_values(
+    aggregates_df: pd.DataFrame,
+    chip_state_ids: Sequence[int],
+    chips_type: str | None = None,
+    voltage_key: int | None = None,
+) -> pd.DataFrame:
+    """
+    Get the numbers of chips and passed chips and the leakage of every wafer.
+    :param aggregates_df: Aggregates as returned by `get_wafers_aggregates`.
+    :param chip_state_ids: States of the chips to take into account.
+    :param chips_type: Type of the chips to take into account, all types if None.
+    :param voltage_key: Voltage key of the leakage, the leakage is NaN if None.
+    :return: One row per wafer. The leakage is the median of the medians of absolute currents
+        of all chip types and states at the voltage.
+    """
+    df = aggregates_df[aggregates_df["chip_state_id"].isin(chip_state_ids)]
+    if chips_type is not None:
+        df = df[df["chip_type"] == chips_type]
+    totals_df = (
+        df[df["voltage"].isna()]
+        .groupby("wafer_id")[["chips_number", "passed_number"]]
+        .sum()
+        .astype("int64")
+    )
+    is_leakage = df["voltage"].notna() & df["voltage"].eq(voltage_key).fillna(False)
+    leakage_df = df[is_leakage.astype(bool)]
+    leakage = leakage_df["median"].astype("float64").abs().groupby(leakage_df["wafer_id"]).median()
+    return totals_df.assign(leakage=leakage).reset_index()
+
+
+def get_trend_frame(
+    wafers_df: pd.DataFrame,
+    by: Literal["lot", "week", "resistivity"],
+    window: int,
+    confidence: float,
+) -> pd.DataFrame:
+    """
+    Group the wafers and calculate rolling yield and leakage over the groups ordered by time.
+    The yield band is the Wilson score interval of the pooled chips of the window, the leakage
+    band is the confidence interval of the geometric mean of the wafer leakages of the window
+    (normal approximation).
+    :param wafers_df: Wafers with decoded batch ids and their trend values as returned by
+        `get_wafer_trend_values`.
+    :param by: The grouping of the wafers, see `TREND_GROUPS`.
+    :param window: The number of groups in the rolling window.
+    :param confidence: The confidence level of the bands.
+    :return: One row per group ordered by series (resistivity class) and time.
+    """
+    keys = TREND_GROUPS[by]
+    series_keys = keys[:-2] if by == "resistivity" else []
+    with np.errstate(divide="ignore"):
+        log_leakage = np.log10(wafers_df["leakage"].astype("float64"))
+    log_leakage = log_leakage.where(np.isfinite(log_leakage))
+    df = wafers_df.assign(
+        log_leakage=log_leakage,
+        log_leakage_squared=log_leakage ** 2,
+        leakage_wafers=log_leakage.notna(),
+    )
+    trend_df = (
+        df.groupby(keys)
+        .agg(
+            date=("date", "min"),
+            wafers=("wafer_id", "size"),
+            chips_number=("chips_number", "sum"),
+            passed_number=("passed_number", "sum"),
+            log_leakage=("log_leakage", "sum"),
+            log_leakage_squared=("log_leakage_squared", "sum"),
+            leakage_wafers=("leakage_wafers", "sum"),
+        )
+        .reset_index()
+        .sort_values(list(dict.fromkeys([*series_keys, "date", *keys])), ignore_index=True)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend_df["yield"] = trend_df["passed_number"] / trend_df["chips_number"]
+        trend_df["leakage"] = 10 ** (trend_df["log_leakage"] / trend_df["leakage_wafers"])
+    
+    sums_columns = [
+        "chips_number", "passed_number", "log_leakage", "log_leakage_squared", "leakage_wafers"
+    ]
+    series = trend_df[series_keys[0]] if series_keys else pd.Series(0, index=trend_df.index)
+    rolling = (
+        trend_df[sums_columns].astype("float64")
+        .groupby(series.to_numpy())
+        .rolling(window, min_periods=1)
+        .sum()
+        .reset_index(level=0, drop=True)
+        .sort_index()
+    )
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = rolling["chips_number"]
+        p = rolling["passed_number"] / n
+        center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+        half_width = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+        
+        m = rolling["leakage_wafers"]
+        mean = rolling["log_leakage"] / m
+        variance = (rolling["log_leakage_squared"] - m * mean ** 2).clip(lower=0) / (m - 1)
+        standard_error = np.sqrt(variance / m)
+    trend_df = trend_df.assign(
+        rolling_yield=p,
+        yield_low=(center - half_width).clip(lower=0),
+        yield_high=(center + half_width).clip(upper=1),
+        rolling_leakage=10 ** mean,
+        leakage_low=10 ** (mean - z * standard_error),
+        leakage_high=10 ** (mean + z * standard_error),
+    )
+    return trend_df.drop(columns=["log_leakage", "log_leakage_squared"])
+
+
+def plot_trend(
+    trend_df: pd.DataFrame,
+    by: Literal["lot", "week", "resistivity"],
+    file_name: str,
+    voltage: Decimal | None = None,
+):
+    """
+    Plot yield and leakage of the groups (points) with rolling trends and confidence bands.
+    """
+    has_leakage = voltage is not None and trend_df["leakage"].notna().any()
+    fig, axes = plt.subplots(
+        2 if has_leakage else 1, 1, figsize=(12, 8 if has_leakage else 5), sharex=True,
+        squeeze=False,
+    )
+    yield_ax = axes[0, 0]
+    series_groups = trend_df.groupby("resistivity") if by == "resistivity" else [("", trend_df)]
+    for series_name, series_df in series_groups:
+        label = f"{series_name} resistivity" if series_name else None
+        line, = yield_ax.plot(series_df["date"], series_df["rolling_yield"] * 100, label=label)
+        yield_ax.fill_between(
+            series_df["date"],
+            series_df["yield_low"] * 100,
+            series_df["yield_high"] * 100,
+            color=line.get_color(),
+            alpha=0.2,
+        )
+        yield_ax.scatter(
+            series_df["date"], series_df["yield"] * 100, color=line.get_color(), s=12
+        )
+        if has_leakage:
+            leakage_ax = axes[1, 0]
+            leakage_ax.plot(series_df["date"], series_df["rolling_leakage"], color=line.get_color())
+            leakage_ax.fill_between(
+                series_df["date"],
+                series_df["leakage_low"],
+                series_df["leakage_high"],
+                color=line.get_color(),
+                alpha=0.2,
+            )
+            leakage_ax.scatter(
+                series_df["date"], series_df["leakage"], color=line.get_color(), s=12
+            )
+    yield_ax.set_ylabel("Yield, %")
+    yield_ax.set_title(f"Trend by {by}")
+    yield_ax.grid(True, alpha=0.3)
+    if by == "resistivity":
+        yield_ax.legend()
+    if has_leakage:
+        leakage_ax = axes[1, 0]
+        leakage_ax.set_yscale("log")
+        leakage_ax.set_ylabel(f"Leakage at {voltage} V, A")
+        leakage_ax.grid(True, alpha=0.3)
+    axes[-1, 0].set_xlabel("Batch week")
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(file_name, dpi=150)
+    plt.close(fig)
@@ -4,6 +4,7 @@ from orm import (
     CVMeasurement,
     ChipRepository,
     ChipState,
+    WaferRepository,
 )
 from utils import (
     EntityOption,
@@ -53,8 +54,8 @@ def cv(
     """
     Measure CV characteristics of the chips.
     """
-    chips = ChipRepository(ctx.session).get_or_create_chips_for_wafer(chip_names, wafer_name)
-    ctx.session.add_all(chips)
+    wafer, = WaferRepository(ctx.session).get_or_create_many([{"name": wafer_name}])
+    chips = ChipRepository(ctx.session).get_or_create_many_for_wafer(chip_names, wafer.id)
     ctx.session.commit()
     
     for setup_config in ctx.configs["setups"]:
@@ -13,6 +13,7 @@ from orm import (
     IvConditionsRepository,
     Matrix,
     MatrixRepository,
+    WaferRepository,
 )
 from utils import (
     EntityOption,
@@ -79,8 +80,8 @@ def measure_iv_command(
         )
         ctx.session.add(matrix)
     else:
-        chips = ChipRepository(ctx.session).get_or_create_chips_for_wafer(chip_names, wafer_name)
-        ctx.session.add_all(chips)
+        wafer, = WaferRepository(ctx.session).get_or_create_many([{"name": wafer_name}])
+        chips = ChipRepository(ctx.session).get_or_create_many_for_wafer(chip_names, wafer.id)
     ctx.session.commit()
     
     for setup_config in ctx.configs["setups"]:
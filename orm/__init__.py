@@ -9,9 +9,12 @@ from .eqe_measurement import EqeMeasurement
 from .eqe_session import EqeSession
 from .instrument import *
 from .iv_conditions import *
+from .iv_features import IvFeatures
 from .iv_measurement import IVMeasurement
 from .matrix import *
 from .misc import Misc
+from .reference_cache import *
 from .ts_conditions import TsConditions
 from .ts_measurement import TsMeasurement
 from .wafer import *
+from .wafer_iv_aggregate import WaferIvAggregate
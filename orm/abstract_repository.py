@@ -1,4 +1,22 @@
-from typing import TypeVar, Generic
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Mapping,
+    Sequence,
+    TypeVar,
+)
+
+from sqlalchemy import (
+    select,
+    tuple_,
+)
+from sqlalchemy.dialects import (
+    mysql,
+    postgresql,
+    sqlite,
+)
+
 from .base import Base
 
 
@@ -28,6 +46,66 @@ class AbstractRepository(Generic[Model]):
             return self.__class__.create(**kwargs)
         return existing
     
+    def get_or_create_many(
+        self,
+        keys: Sequence[Mapping[str, Any]],
+        defaults: Mapping[str, Any] | Callable[..., Mapping[str, Any]] | None = None,
+    ) -> list[Model]:
+        """
+        Get instances by unique keys, inserting the missing ones. Unlike `get_or_create`, rows
+        are inserted right away: all the keys are sent in a single insert that skips existing
+        rows and all the instances are fetched with a single select.
+        :param keys: Values of the columns of a unique constraint, the same columns for every key.
+        :param defaults: Values of other columns of inserted rows or a function that returns them
+            for a key.
+        :return: Instances in the order of the keys. Strings of the keys are matched with the rows
+            case-insensitively if there is no exact match.
+        :raises ValueError: If rows of some keys are neither inserted nor found.
+        """
+        if not keys:
+            return []
+        key_columns = list(keys[0])
+        if callable(defaults):
+            rows = [{**defaults(key), **key} for key in keys]
+        else:
+            rows = [{**(defaults or {}), **key} for key in keys]
+        self.session.execute(self._get_insert_ignore(rows))
+        
+        columns = [getattr(self.model, column) for column in key_columns]
+        key_tuples = [tuple(key[column] for column in key_columns) for key in keys]
+        if len(columns) == 1:
+            condition = columns[0].in_({key for key, in key_tuples})
+        else:
+            condition = tuple_(*columns).in_(set(key_tuples))
+        instances = {
+            tuple(getattr(instance, column) for column in key_columns): instance
+            for instance in self.session.scalars(select(self.model).where(condition))
+        }
+        # MySQL compares strings case-insensitively, thus a key may find a row that differs in case
+        folded_instances = {fold_key(key): instance for key, instance in instances.items()}
+        result = [
+            instances.get(key) or folded_instances.get(fold_key(key)) for key in key_tuples
+        ]
+        if any(instance is None for instance in result):
+            missing = [key for key, instance in zip(key_tuples, result) if instance is None]
+            raise ValueError(
+                f"{self.model.__name__} rows with {', '.join(key_columns)} in {missing} are "
+                "neither inserted nor found"
+            )
+        return result
+    
+    def _get_insert_ignore(self, rows: list[dict[str, Any]]):
+        table = self.model.__table__
+        dialect = self.session.get_bind().dialect.name
+        if dialect in ("mysql", "mariadb"):
+            statement = mysql.insert(table).values(rows)
+            return statement.on_duplicate_key_update(id=table.c.id)
+        if dialect == "postgresql":
+            return postgresql.insert(table).values(rows).on_conflict_do_nothing()
+        if dialect == "sqlite":
+            return sqlite.insert(table).values(rows).on_conflict_do_nothing()
+        raise NotImplementedError(f"Insert ignoring existing rows is not supported for {dialect}")
+    
     def get_id(self, **kwargs):
         if not hasattr(self.model, "id"):
             raise AttributeError(f"Model {self.model.__name__} has no id attribute")
@@ -47,3 +125,7 @@ class AbstractRepository(Generic[Model]):
                 .filter_by(**kwargs)
                 .order_by(order_by)
                 .all())
+
+
+def fold_key(key: tuple) -> tuple:
+    return tuple(value.casefold() if isinstance(value, str) else value for value in key)
@@ -1,13 +1,20 @@
 import re
 import sys
+from functools import cache
 from typing import (
+    Callable,
     ClassVar,
+    Iterable,
     Type,
     TypeGuard,
 )
 
+import numpy as np
+import pandas as pd
 from sqlalchemy import (
+    Double,
     ForeignKey,
+    Index,
     Integer,
     String,
     UniqueConstraint,
@@ -22,6 +29,8 @@ from sqlalchemy.orm import (
 from .abstract_repository import AbstractRepository
 from .base import Base
 
+GEOMETRY_COLUMNS = ("x", "y", "width", "height")
+
 
 class ChipMetaclass(type(Base)):
     """
@@ -53,7 +62,10 @@ class ChipMetaclass(type(Base)):
 
 class AbstractChip(Base, metaclass=ChipMetaclass):
     __tablename__ = "chip"
-    __table_args__ = tuple([UniqueConstraint("name", "wafer_id", name="unique_chip")])
+    __table_args__ = (
+        UniqueConstraint("name", "wafer_id", name="unique_chip"),
+        Index("ix_chip_wafer_id_x_y", "wafer_id", "x", "y"),
+    )
     __mapper_args__ = {
         "polymorphic_on": 'type',
         "polymorphic_abstract": True,
@@ -68,6 +80,10 @@ class AbstractChip(Base, metaclass=ChipMetaclass):
     wafer: Mapped["Wafer"] = relationship(back_populates="chips")  # noqa: F821
     name: Mapped[str] = mapped_column(String(length=20))
     type: Mapped[str] = mapped_column(String(length=8), index=True, nullable=True)
+    x: Mapped[float | None] = mapped_column(Double, comment="X coordinate on wafer maps")
+    y: Mapped[float | None] = mapped_column(Double, comment="Y coordinate on wafer maps")
+    width: Mapped[float | None] = mapped_column(Double, comment="Width on wafer maps")
+    height: Mapped[float | None] = mapped_column(Double, comment="Height on wafer maps")
     
     @validates("name")
     def validate_name(self, key: str, name: str) -> str:
@@ -122,14 +138,6 @@ class SimpleChip(AbstractChip):
             raise ValueError(f"Could not parse chip coordinate {self.name}. Expected format is chip type followed by 4 digits")
         return int(digits[:(len(digits)//2)])
     
-    @property
-    def width(self):
-        return 1
-    
-    @property
-    def height(self):
-        return 1
-    
     @classmethod
     def get_area(cls) -> float:
         chip_size = cls.get_chip_size()
@@ -182,20 +190,12 @@ class MatrixChip(SimpleChip):
         # get matrix coordinate * (matrix.width + 1) + 2nd index * chip_size[0]
         return int(match.group('matrix')) + int(match.group('px')) / (self.matrix.width + 1)
     
-    @property
-    def width(self):
-        return 1 / self.matrix.width
-    
     @property
     def y_coordinate(self):
         coords = re.sub(rf'^{self.type}', '', self.name)
         match = self.ycoord_re.match(coords)
         
         return int(match.group('matrix')) + int(match.group('px')) / (self.matrix.height + 1)
-    
-    @property
-    def height(self):
-        return 1 / self.matrix.height
 
 
 class EqeChip(SimpleChip):
@@ -291,12 +291,39 @@ class ChipRepository(AbstractRepository[AbstractChip], metaclass=ChipRepositoryM
             if chip_type not in cls.chip_types:
                 raise ValueError(f"Unknown chip type {chip_type}")
         model = cls.get_chip_class(chip_type)
+        if "x" not in kwargs:
+            matrix = kwargs.get("matrix")
+            rectangle = ChipGeometry.get_rectangle(
+                kwargs.get("name", "").upper(),
+                chip_type,
+                (matrix.width, matrix.height) if matrix is not None else None,
+            )
+            if rectangle is not None:
+                kwargs.update(zip(GEOMETRY_COLUMNS, rectangle))
         try:
             chip = model(**kwargs)
         except TypeError:
             raise ValueError(f"Could not create chip of type {model.__name__} with arguments {kwargs}")
         return chip
     
+    def get_or_create_many_for_wafer(
+        self, chip_names: Iterable[str], wafer_id: int
+    ) -> list[AbstractChip]:
+        """
+        Get chips of the wafer by names, inserting the missing ones with `get_or_create_many`.
+        Chip types are inferred from the names.
+        :return: Chips in the order of the names.
+        """
+        def get_defaults(key):
+            chip_type = self.infer_chip_type(key["name"])
+            rectangle = ChipGeometry.get_rectangle(key["name"], chip_type) or (None,) * 4
+            # all the inserted rows must have the same columns
+            return {"type": chip_type, **dict(zip(GEOMETRY_COLUMNS, rectangle))}
+        
+        return self.get_or_create_many(
+            [{"wafer_id": wafer_id, "name": name.upper()} for name in chip_names], get_defaults
+        )
+    
     def get_or_create_chips_for_wafer(self, chip_names, wafer_name) -> list[AbstractChip]:
         from .wafer import WaferRepository
         
@@ -318,6 +345,175 @@ class ChipRepository(AbstractRepository[AbstractChip], metaclass=ChipRepositoryM
         for chip_name in chip_names_to_create:
             chip = self.create(name=chip_name, wafer=wafer)
             created_chips.append(chip)
-
+        
         chips_dict = {chip.name: chip for chip in created_chips + existing_chips}
         return [chips_dict[chip_name] for chip_name in chip_names]  # preserve order
+
+
+class ChipGeometry:
+    """
+    Registry of chip geometry that works with arrays of chips at once. Sizes of chip types are
+    cached, coordinates are parsed from chip names. Coordinates, widths and heights are in units
+    of wafer maps, areas and perimeters are in mm² and mm. Geometry that can't be determined is
+    NaN.
+    """
+    
+    matrix_coordinates_re = r"^(?P<y>\d\d)(?P<x>\d\d)_(?P<py>\d)(?P<px>\d)$"
+    
+    @staticmethod
+    @cache
+    def get_chip_size(chip_type: str) -> tuple[float, float] | None:
+        """
+        Get the size of the chip type in mm, None if it is unknown.
+        """
+        chip_cls = ChipRepository.chip_types.get(chip_type)
+        if chip_cls is None or not is_simple_chip_type(chip_cls):
+            return None
+        return chip_cls.chip_size
+    
+    @classmethod
+    def get_areas(cls, chip_types: Iterable[str]) -> np.ndarray:
+        return cls._map_chip_types(chip_types, lambda size: size[0] * size[1])
+    
+    @classmethod
+    def get_perimeters(cls, chip_types: Iterable[str]) -> np.ndarray:
+        return cls._map_chip_types(chip_types, lambda size: (size[0] + size[1]) * 2)
+    
+    @classmethod
+    def _map_chip_types(
+        cls, chip_types: Iterable[str], function: Callable[[tuple[float, float]], float]
+    ) -> np.ndarray:
+        codes, uniques = pd.factorize(np.asarray(list(chip_types), dtype=object))
+        values = [
+            function(size) if (size := cls.get_chip_size(chip_type)) is not None else np.nan
+            for chip_type in uniques
+        ]
+        # the last value is for missing chip types (code -1)
+        return np.array([*values, np.nan], dtype="float64")[codes]
+    
+    @classmethod
+    def get_frame(
+        cls,
+        names: Iterable[str],
+        chip_types: Iterable[str],
+        matrix_widths: Iterable[float] | None = None,
+        matrix_heights: Iterable[float] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Get geometry of the chips.
+        :param names: Names of the chips.
+        :param chip_types: Types of the chips.
+        :param matrix_widths: Widths of the matrices of matrix chips, NaN for other chips.
+        :param matrix_heights: Heights of the matrices of matrix chips, NaN for other chips.
+        :return: x, y, width, height, area and perimeter columns in the order of the chips.
+        """
+        names = pd.Series(list(names), dtype=object)
+        chip_types = pd.Series(list(chip_types), dtype=object, index=names.index)
+        if matrix_widths is None or matrix_heights is None:
+            matrix_widths = matrix_heights = np.full(len(names), np.nan)
+        matrix_widths = np.asarray(list(matrix_widths), dtype="float64")
+        matrix_heights = np.asarray(list(matrix_heights), dtype="float64")
+        df = pd.DataFrame(
+            np.nan, index=names.index, columns=["x", "y", "width", "height"], dtype="float64"
+        )
+        for chip_type in chip_types.dropna().unique():
+            chip_cls = ChipRepository.chip_types.get(chip_type)
+            if chip_cls is None or not is_simple_chip_type(chip_cls):
+                continue
+            mask = (chip_types == chip_type).to_numpy()
+            digits = names[mask].str.removeprefix(chip_type)
+            if issubclass(chip_cls, MatrixChip):
+                df.loc[mask] = cls._get_matrix_geometry(
+                    digits, matrix_widths[mask], matrix_heights[mask]
+                )
+            else:
+                df.loc[mask] = cls._get_simple_geometry(digits)
+        df["area"] = cls.get_areas(chip_types)
+        df["perimeter"] = cls.get_perimeters(chip_types)
+        return df.reset_index(drop=True)
+    
+    @classmethod
+    def get_chips_frame(cls, chips: Iterable[AbstractChip]) -> pd.DataFrame:
+        """
+        Get geometry of the chip instances as returned by `get_frame`. Stored geometry is used
+        where it is known, otherwise it is parsed from the names and matrices of matrix chips are
+        expected to be loaded.
+        """
+        chips = list(chips)
+        df = pd.DataFrame(
+            [[getattr(chip, column) for column in GEOMETRY_COLUMNS] for chip in chips],
+            columns=list(GEOMETRY_COLUMNS),
+            dtype="float64",
+        )
+        df["area"] = cls.get_areas([chip.type for chip in chips])
+        df["perimeter"] = cls.get_perimeters([chip.type for chip in chips])
+        missing = df[list(GEOMETRY_COLUMNS)].isna().any(axis=1).to_numpy()
+        if missing.any():
+            missing_chips = [chip for chip, is_missing in zip(chips, missing) if is_missing]
+            matrices = [
+                chip.matrix if isinstance(chip, MatrixChip) else None for chip in missing_chips
+            ]
+            df.loc[missing] = cls.get_frame(
+                [chip.name for chip in missing_chips],
+                [chip.type for chip in missing_chips],
+                [np.nan if m is None else m.width for m in matrices],
+                [np.nan if m is None else m.height for m in matrices],
+            ).to_numpy()
+        return df
+    
+    @classmethod
+    def get_rectangle(
+        cls, name: str, chip_type: str, matrix_size: tuple[int, int] | None = None
+    ) -> tuple[float, float, float, float] | None:
+        """
+        Get geometry of a single chip as `get_frame` does.
+        :param name: Name of the chip.
+        :param chip_type: Type of the chip.
+        :param matrix_size: Width and height of the matrix of a matrix chip.
+        :return: x, y, width and height or None if they can't be determined.
+        """
+        chip_cls = ChipRepository.chip_types.get(chip_type)
+        if chip_cls is None or not is_simple_chip_type(chip_cls):
+            return None
+        digits = name.removeprefix(chip_type)
+        if issubclass(chip_cls, MatrixChip):
+            match = re.match(cls.matrix_coordinates_re, digits)
+            if match is None or matrix_size is None:
+                return None
+            width, height = matrix_size
+            return (
+                int(match["x"]) + int(match["px"]) / (width + 1),
+                int(match["y"]) + int(match["py"]) / (height + 1),
+                1 / width,
+                1 / height,
+            )
+        if not re.fullmatch(r"(?:\d\d)+", digits):
+            return None
+        half = len(digits) // 2
+        return int(digits[half:]), int(digits[:half]), 1, 1
+    
+    @staticmethod
+    def _get_simple_geometry(digits: pd.Series) -> np.ndarray:
+        # the first half of the digits is y, the second half is x
+        result = np.full((len(digits), 4), np.nan)
+        is_valid = digits.str.fullmatch(r"(?:\d\d)+").fillna(False).to_numpy(dtype=bool)
+        lengths = digits.str.len().to_numpy()
+        for length in np.unique(lengths[is_valid]):
+            rows = is_valid & (lengths == length)
+            half = int(length) // 2
+            result[rows, 0] = digits[rows].str[half:].astype("int64")
+            result[rows, 1] = digits[rows].str[:half].astype("int64")
+            result[rows, 2:] = 1
+        return result
+    
+    @classmethod
+    def _get_matrix_geometry(
+        cls, digits: pd.Series, matrix_widths: np.ndarray, matrix_heights: np.ndarray
+    ) -> np.ndarray:
+        parts = digits.str.extract(cls.matrix_coordinates_re).astype("float64")
+        return np.column_stack([
+            parts["x"].to_numpy() + parts["px"].to_numpy() / (matrix_widths + 1),
+            parts["y"].to_numpy() + parts["py"].to_numpy() / (matrix_heights + 1),
+            np.where(parts["x"].notna(), 1 / matrix_widths, np.nan),
+            np.where(parts["y"].notna(), 1 / matrix_heights, np.nan),
+        ])
@@ -0,0 +1,38 @@
+from typing import Optional
+
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+    relationship,
+)
+
+from .base import Base
+
+
+class IvFeatures(Base):
+    """
+    Stores the features extracted from a full Current-Voltage (IV) sweep, such as breakdown
+    voltage, ideality factor and series resistance. One row per IV conditions,
+    with NULL features where they can't be extracted.
+    """
+    __tablename__ = "iv_features"
+    
+    conditions_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "iv_conditions.id",
+            name="iv_features__conditions",
+            ondelete="CASCADE",
+            onupdate="CASCADE",
+        ),
+        primary_key=True,
+    )
+    conditions: Mapped["IvConditions"] = relationship()  # noqa: F821
+    breakdown_voltage: Mapped[Optional[float]]
+    leakage_slope: Mapped[Optional[float]]
+    ideality_factor: Mapped[Optional[float]]
+    series_resistance: Mapped[Optional[float]]
+    zero_crossing_voltage: Mapped[Optional[float]]
+    
+    def __repr__(self):
+        return f"<IvFeatures(conditions_id={self.conditions_id})>"
@@ -10,7 +10,11 @@ from sqlalchemy.orm import (
 
 from .abstract_repository import AbstractRepository
 from .base import Base
-from .chip import ChipRepository
+from .chip import (
+    ChipGeometry,
+    ChipRepository,
+)
+from .wafer import WaferRepository
 
 
 class Matrix(Base):
@@ -34,7 +38,14 @@ class MatrixRepository(AbstractRepository[Matrix]):
     def get_or_create_from_configs(self, matrix_name, wafer_name, matrix_config) -> Matrix:
         width, height = matrix_config['width'], matrix_config['height']
         chip_names = [f"{matrix_name}_{i}{j}" for i in range(width) for j in range(height)]
-        chips = ChipRepository(self.session).get_or_create_chips_for_wafer(chip_names, wafer_name)
+        wafer, = WaferRepository(self.session).get_or_create_many([{"name": wafer_name}])
+        chips = ChipRepository(self.session).get_or_create_many_for_wafer(chip_names, wafer.id)
         matrix = self.get_or_create(name=matrix_name, width=width, height=height)
         matrix.chips = chips
+        # geometry of matrix chips depends on the size of the matrix
+        for chip in chips:
+            if chip.x is None:
+                rectangle = ChipGeometry.get_rectangle(chip.name, chip.type, (width, height))
+                if rectangle is not None:
+                    chip.x, chip.y, chip.width, chip.height = rectangle
         return matrix
@@ -0,0 +1,95 @@
+from types import MappingProxyType
+from typing import (
+    Any,
+    Mapping,
+    TypeVar,
+)
+
+from sqlalchemy import select
+from sqlalchemy.orm import (
+    Session,
+    make_transient_to_detached,
+)
+
+from .base import Base
+from .misc import Misc
+
+Model = TypeVar("Model", bound=Base)
+
+
+class ReferenceCache:
+    """
+    Process-wide cache of small reference tables (chip states, carriers, instruments, misc data)
+    that are read by almost every command and rarely change. Every table is loaded once per
+    database and served from memory afterward. Cached instances are detached copies: they are
+    merged into the requesting session without a query, so they can be used in relationships as
+    usual. Misc data is served as read-only mappings. The cache must be invalidated explicitly
+    when the rows change.
+    """
+    
+    def __init__(self):
+        self._entries: dict[tuple[str, str, str | None], Any] = {}
+    
+    def get_all(self, session: Session, model: type[Model]) -> list[Model]:
+        """
+        Get all rows of a reference table ordered by id.
+        :return: Instances bound to the session.
+        """
+        key = self._get_key(session, model)
+        if key not in self._entries:
+            instances = session.scalars(select(model).order_by(model.id)).all()
+            self._entries[key] = [self._copy_detached(instance) for instance in instances]
+        return [session.merge(instance, load=False) for instance in self._entries[key]]
+    
+    def get_by_name(self, session: Session, model: type[Model]) -> dict[str, Model]:
+        return {instance.name: instance for instance in self.get_all(session, model)}
+    
+    def get_misc_data(self, session: Session, name: str) -> Mapping[str, Any]:
+        """
+        Get data of a misc row.
+        :raises NoResultFound: If there is no row with the name.
+        """
+        key = self._get_key(session, Misc, name)
+        if key not in self._entries:
+            data = session.execute(select(Misc.data).where(Misc.name == name)).scalar_one()
+            self._entries[key] = freeze_json(data)
+        return self._entries[key]
+    
+    def invalidate(self, *models: type[Base]) -> None:
+        """
+        Drop cached rows of the models, all of them if no models are given.
+        """
+        names = {model.__tablename__ for model in models}
+        for key in list(self._entries):
+            if not names or key[1] in names:
+                del self._entries[key]
+    
+    @staticmethod
+    def _get_key(
+        session: Session, model: type[Base], name: str | None = None
+    ) -> tuple[str, str, str | None]:
+        url = session.get_bind().url.render_as_string(hide_password=True)
+        return url, model.__tablename__, name
+    
+    @staticmethod
+    def _copy_detached(instance: Model) -> Model:
+        mapper = instance.__mapper__
+        copy = mapper.class_(
+            **{column.key: getattr(instance, column.key) for column in mapper.column_attrs}
+        )
+        make_transient_to_detached(copy)
+        return copy
+
+
+def freeze_json(data: Any) -> Any:
+    """
+    Make a read-only copy of JSON data: dicts become mappings and lists become tuples.
+    """
+    if isinstance(data, dict):
+        return MappingProxyType({key: freeze_json(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return tuple(freeze_json(value) for value in data)
+    return data
+
+
+reference_cache = ReferenceCache()
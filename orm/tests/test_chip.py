@@ -1,5 +1,6 @@
 from unittest.mock import patch
 
+import numpy as np
 import pytest
 
 from orm.chip import (
@@ -7,6 +8,7 @@ from orm.chip import (
     AbstractChip,
     BChip,  # noqa
     CChip,  # noqa
+    ChipGeometry,
     ChipRepository,
     GChip,  # noqa
     FChip,  # noqa
@@ -14,6 +16,7 @@ from orm.chip import (
     SimpleChip,
     TestStructureChip,
 )
+from orm.wafer import WaferRepository
 
 ALL_CHIP_TYPES = [
     "A", "B", "C", "D", "E", "F", "G", "I", "IH", "IM", "J", "JH", "JM", "L", "LH", "LM", "REF",
@@ -177,3 +180,79 @@ class TestChipRepository:
         chips = repo.get_or_create_chips_for_wafer(['A1234', 'B1234'], 'wafer')
         assert len(chips) == 2
         assert all(isinstance(chip, SimpleChip) for chip in chips)
+    
+    def test_get_or_create_many_for_wafer(self, repo, session):
+        wafer = WaferRepository(session).create(name="wafer")
+        session.add(wafer)
+        session.flush()
+        chips = repo.get_or_create_many_for_wafer(["a1234", "B1234"], wafer.id)
+        assert [chip.name for chip in chips] == ["A1234", "B1234"]
+        assert isinstance(chips[0], AChip)
+        assert isinstance(chips[1], BChip)
+        
+        chips_again = repo.get_or_create_many_for_wafer(["B1234", "A1234", "C1234"], wafer.id)
+        assert chips_again[:2] == [chips[1], chips[0]]
+        assert isinstance(chips_again[2], CChip)
+        assert session.query(AbstractChip).count() == 3
+    
+    def test_get_or_create_many_matches_case(self, session):
+        wafer_repo = WaferRepository(session)
+        wafer = wafer_repo.create(name="ABC123")
+        session.add(wafer)
+        session.flush()
+        # the database compares wafer names case-insensitively
+        assert wafer_repo.get_or_create_many([{"name": "abc123"}, {"name": "ABC123"}]) == [
+            wafer, wafer
+        ]
+        assert wafer_repo.get_or_create_many([{"name": "abc124"}])[0].name == "abc124"
+
+
+class TestChipGeometry:
+    def test_get_areas(self):
+        np.testing.assert_allclose(
+            ChipGeometry.get_areas(["A", "TS", "REF", "Z", "A"]),
+            [2.8561, np.nan, np.nan, np.nan, 2.8561],
+        )
+    
+    def test_get_perimeters(self):
+        np.testing.assert_allclose(ChipGeometry.get_perimeters(["F", "TS"]), [7.62, np.nan])
+    
+    def test_get_frame(self):
+        df = ChipGeometry.get_frame(
+            ["A1234", "A123", "Q0102_21", "TS1"],
+            ["A", "A", "Q", "TS"],
+            [np.nan, np.nan, 3, np.nan],
+            [np.nan, np.nan, 2, np.nan],
+        )
+        np.testing.assert_allclose(df["x"], [34, np.nan, 2.25, np.nan])
+        np.testing.assert_allclose(df["y"], [12, np.nan, 1 + 2 / 3, np.nan])
+        np.testing.assert_allclose(df["width"], [1, np.nan, 1 / 3, np.nan])
+        np.testing.assert_allclose(df["height"], [1, np.nan, 1 / 2, np.nan])
+    
+    def test_get_frame_matches_chip_coordinates(self):
+        chip = ChipRepository.create(name="XH0512")
+        df = ChipGeometry.get_chips_frame([chip])
+        assert (df.loc[0, "x"], df.loc[0, "y"]) == (chip.x_coordinate, chip.y_coordinate)
+    
+    @pytest.mark.parametrize("name, chip_type, matrix_size", [
+        ("A1234", "A", None),
+        ("XH120034", "XH", None),
+        ("Q0102_21", "Q", (3, 2)),
+        ("A123", "A", None),
+        ("TS1", "TS", None),
+    ])
+    def test_get_rectangle_matches_get_frame(self, name, chip_type, matrix_size):
+        width, height = matrix_size or (np.nan, np.nan)
+        df = ChipGeometry.get_frame([name], [chip_type], [width], [height])
+        rectangle = ChipGeometry.get_rectangle(name, chip_type, matrix_size)
+        expected = df.loc[0, ["x", "y", "width", "height"]].tolist()
+        np.testing.assert_allclose(rectangle or [np.nan] * 4, expected)
+    
+    def test_create_sets_geometry(self):
+        chip = ChipRepository.create(name="X0512")
+        assert (chip.x, chip.y, chip.width, chip.height) == (12, 5, 1, 1)
+    
+    def test_get_chips_frame_uses_stored_geometry(self):
+        chip = ChipRepository.create(name="X0512", x=1.5, y=2.5, width=0.5, height=0.5)
+        df = ChipGeometry.get_chips_frame([chip])
+        assert df.loc[0, ["x", "y", "width", "height"]].tolist() == [1.5, 2.5, 0.5, 0.5]
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import (
+    event,
+    insert,
+)
+from sqlalchemy.orm import Session
+
+from orm import (
+    ChipState,
+    Misc,
+)
+from orm.reference_cache import (
+    ReferenceCache,
+    freeze_json,
+)
+
+
+@pytest.fixture
+def statements(session):
+    executed = []
+    
+    def before_cursor_execute(conn, cursor, statement, *args):
+        executed.append(statement)
+    
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class TestReferenceCache:
+    def test_get_all_loads_once(self, session, statements):
+        cache = ReferenceCache()
+        chip_states = cache.get_all(session, ChipState)
+        assert [s.id for s in chip_states] == sorted(s.id for s in chip_states)
+        assert len(statements) == 1
+        assert [s.name for s in cache.get_all(session, ChipState)] == [
+            s.name for s in chip_states
+        ]
+        assert len(statements) == 1
+    
+    def test_get_all_binds_to_session(self, session):
+        cache = ReferenceCache()
+        cache.get_all(session, ChipState)
+        with Session(bind=session.get_bind()) as other_session:
+            chip_states = cache.get_all(other_session, ChipState)
+            assert all(s in other_session for s in chip_states)
+            assert chip_states[0] is other_session.get(ChipState, chip_states[0].id)
+    
+    def test_invalidate(self, session):
+        cache = ReferenceCache()
+        chip_states = cache.get_all(session, ChipState)
+        session.add(ChipState(name="Cache test state"))
+        session.flush()
+        assert cache.get_all(session, ChipState) == chip_states
+        cache.invalidate(ChipState)
+        assert [s.name for s in cache.get_all(session, ChipState)][-1] == "Cache test state"
+    
+    def test_get_misc_data(self, session):
+        cache = ReferenceCache()
+        session.execute(
+            insert(Misc).values(name="cache_test", data={"X": {"-1": 1, "6": [2, 3]}})
+        )
+        data = cache.get_misc_data(session, "cache_test")
+        assert data["X"]["6"] == (2, 3)
+        with pytest.raises(TypeError):
+            data["X"]["-1"] = 5  # type: ignore[index]
+
+
+def test_freeze_json():
+    data = {"a": [1, {"b": None}], "c": "d"}
+    frozen = freeze_json(data)
+    assert frozen == {"a": (1, {"b": None}), "c": "d"}
+    with pytest.raises(TypeError):
+        frozen["a"][1]["b"] = 1
+    assert data == {"a": [1, {"b": None}], "c": "d"}
@@ -0,0 +1,85 @@
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import (
+    BigInteger,
+    DECIMAL,
+    Double,
+    ForeignKey,
+    String,
+    UniqueConstraint,
+    VARCHAR,
+)
+from sqlalchemy.orm import (
+    Mapped,
+    mapped_column,
+)
+
+from .base import Base
+
+
+class WaferIvAggregate(Base):
+    """
+    Stores aggregates of IV measurements of a wafer by chip state, chip type and voltage, so that
+    wafers can be compared without reading all their measurements. Rows without voltage
+    summarize all voltages of the chip type: the number of chips passed at all voltages.
+    The unique constraint covers only rows with voltage, since NULLs are not equal in unique
+    keys. Rows of a wafer are replaced while the wafer row is locked, see `db refresh-aggregates`.
+    """
+    __tablename__ = "wafer_iv_aggregate"
+    __table_args__ = (
+        UniqueConstraint(
+            "wafer_id",
+            "chip_state_id",
+            "chip_type",
+            "voltage",
+            name="unique_wafer_iv_aggregate",
+        ),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    wafer_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "wafer.id",
+            name="wafer_iv_aggregate__wafer",
+            ondelete="CASCADE",
+            onupdate="CASCADE",
+        ),
+        index=True,
+    )
+    chip_state_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "chip_state.id",
+            name="wafer_iv_aggregate__chip_state",
+            ondelete="RESTRICT",
+            onupdate="CASCADE",
+        ),
+        index=True,
+    )
+    chip_type: Mapped[str] = mapped_column(String(length=8))
+    voltage: Mapped[Optional[Decimal]] = mapped_column(DECIMAL(precision=10, scale=5))
+    chips_number: Mapped[int]
+    passed_number: Mapped[int]
+    median: Mapped[Optional[float]] = mapped_column(Double)
+    std: Mapped[Optional[float]] = mapped_column(Double)
+    density: Mapped[Optional[float]] = mapped_column(Double)
+    conditions_watermark: Mapped[int] = mapped_column(
+        comment="The greatest id of IV conditions of the wafer included in the aggregates",
+    )
+    conditions_count: Mapped[int] = mapped_column(
+        comment="Number of IV conditions of the wafer included in the aggregates",
+    )
+    conditions_checksum: Mapped[int] = mapped_column(
+        BigInteger,
+        comment="Checksum of ids, chips and chip states of IV conditions of the wafer",
+    )
+    thresholds_version: Mapped[str] = mapped_column(
+        VARCHAR(length=40),
+        comment="Hash of IV thresholds the aggregates are calculated with",
+    )
+    
+    def __repr__(self):
+        return (
+            f"<WaferIvAggregate(wafer_id={self.wafer_id}, chip_type='{self.chip_type}', "
+            f"voltage={self.voltage})>"
+        )
@@ -8,3 +8,4 @@ from .get_db_url import get_db_url
 from .logger import get_logger
 from .thresholds import *
 from .validators import *
+from .voltages import *
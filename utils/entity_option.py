@@ -7,6 +7,7 @@ import click
 from click import Context
 from sqlalchemy.orm import Session
 
+from orm import reference_cache
 from .name_id_interface import NameIdInterface
 
 
@@ -31,7 +32,7 @@ class EntityOption(click.Option):
     
     def get_options(self, ctx: Context):
         session: Session = ctx.obj.session
-        return session.query(self.entity_type).order_by(self.entity_type.id).all()
+        return reference_cache.get_all(session, self.entity_type)
     
     def get_help_record(self, ctx: Context) -> Optional[tuple[str, str]]:
         descriptions = [f"{o.id} - {o.name};" for o in self.get_options(ctx)]
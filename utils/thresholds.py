@@ -1,23 +1,27 @@
+import hashlib
+import json
 from decimal import Decimal
-from typing import Literal
+from typing import (
+    Iterable,
+    Literal,
+    Mapping,
+)
 
-from sqlalchemy import select
+import numpy as np
+import pandas as pd
 from sqlalchemy.orm import Session
 
-from orm import Misc
+from orm import reference_cache
+from .voltages import to_voltage_keys
 
 
 def get_thresholds(
     session: Session, kind: Literal["IV", "CV"], precision=Decimal("1e-2")
 ) -> dict[str, dict[Decimal, float]]:
     if kind == "IV":
-        thresholds = session.execute(
-            select(Misc.data).where(Misc.name == "iv_thresholds")
-        ).scalar_one()
+        thresholds = reference_cache.get_misc_data(session, "iv_thresholds")
     elif kind == "CV":
-        thresholds = session.execute(
-            select(Misc.data).where(Misc.name == "cv_thresholds")
-        ).scalar_one()
+        thresholds = reference_cache.get_misc_data(session, "cv_thresholds")
     else:
         raise ValueError(f"Unknown threshold kind: {kind}")
     
@@ -28,3 +32,82 @@ def get_thresholds(
         }
         for chip_type, chip_type_thresholds in thresholds.items()
     }
+
+
+class ThresholdMatrix:
+    """
+    Thresholds of all chip types as a dense matrix with chip types as rows and voltages as
+    columns, so that thresholds of any chips and voltages are looked up at once.
+    IV values pass when they are greater than or equal to the threshold, CV values pass when
+    they are less than the threshold. The version is a hash of the thresholds, it changes
+    whenever any threshold changes. Thresholds are looked up by voltage keys (see
+    `to_voltage_keys`).
+    """
+    
+    def __init__(
+        self,
+        thresholds: Mapping[str, Mapping[Decimal, float | None]],
+        kind: Literal["IV", "CV"],
+    ):
+        self.kind = kind
+        self.version = hashlib.sha1(
+            json.dumps(
+                {
+                    "kind": kind,
+                    "thresholds": {
+                        chip_type: {str(v): t for v, t in chip_type_thresholds.items()}
+                        for chip_type, chip_type_thresholds in thresholds.items()
+                    },
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+        self.chip_types = pd.Index(list(thresholds), dtype=object)
+        self.voltages = pd.Index(
+            sorted({voltage for values in thresholds.values() for voltage in values}), dtype=object
+        )
+        self.voltage_keys = pd.Index(to_voltage_keys(self.voltages), dtype="int64")
+        # the last row and column stay empty for unknown chip types and voltages
+        self.matrix = np.full((len(self.chip_types) + 1, len(self.voltages) + 1), np.nan)
+        for row, chip_type_thresholds in enumerate(thresholds.values()):
+            for voltage, threshold in chip_type_thresholds.items():
+                if threshold is not None:
+                    self.matrix[row, self.voltages.get_loc(voltage)] = threshold
+    
+    @classmethod
+    def load(
+        cls, session: Session, kind: Literal["IV", "CV"], precision=Decimal("1e-2")
+    ) -> "ThresholdMatrix":
+        return cls(get_thresholds(session, kind, precision), kind)
+    
+    def get_thresholds(
+        self, chip_types: Iterable[str], voltage_keys: Iterable[int]
+    ) -> np.ndarray:
+        """
+        Get thresholds of every chip type (rows) at every voltage (columns).
+        :return: 2d array, NaN where there is no threshold.
+        """
+        rows = self.chip_types.get_indexer(list(chip_types))
+        columns = self.voltage_keys.get_indexer(list(voltage_keys))
+        return self.matrix[rows[:, None], columns[None, :]]
+    
+    def get_paired_thresholds(
+        self, chip_types: Iterable[str], voltage_keys: Iterable[int]
+    ) -> np.ndarray:
+        """
+        Get thresholds of pairs of chip types and voltages of the same length.
+        :return: 1d array, NaN where there is no threshold.
+        """
+        rows = self.chip_types.get_indexer(list(chip_types))
+        columns = self.voltage_keys.get_indexer(list(voltage_keys))
+        return self.matrix[rows, columns]
+    
+    def get_pass_mask(self, values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+        """
+        Check the values against the thresholds of the same shape (or broadcastable).
+        :return: 1 for passed values, 0 for failed ones and NaN where the value or the threshold
+            is missing.
+        """
+        with np.errstate(invalid="ignore"):
+            passed = values >= thresholds if self.kind == "IV" else values < thresholds
+        return np.where(np.isnan(values) | np.isnan(thresholds), np.nan, passed)
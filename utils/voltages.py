@@ -0,0 +1,37 @@
+from decimal import Decimal
+from typing import Iterable
+
+import numpy as np
+from sqlalchemy import (
+    BigInteger,
+    ColumnElement,
+    cast,
+    func,
+)
+
+MICROVOLTS_PER_VOLT = 1_000_000
+VOLTAGE_PRECISION = Decimal("1e-5")  # scale of voltage columns in the database
+
+
+def to_voltage_keys(voltages: Iterable) -> np.ndarray:
+    """
+    Convert voltages in V (Decimal, float or str) to voltage keys: integer microvolts, so that
+    voltages are compared, pivoted and joined as plain integers.
+    :return: int64 array of the keys.
+    """
+    volts = np.asarray([float(v) for v in voltages], dtype="float64")
+    return np.rint(volts * MICROVOLTS_PER_VOLT).astype("int64")
+
+
+def from_voltage_keys(keys: Iterable[int], precision=Decimal("1e-2")) -> list[Decimal]:
+    """
+    Convert voltage keys back to voltages in V, e.g. for reports.
+    """
+    return [Decimal(int(key)).scaleb(-6).quantize(precision) for key in keys]
+
+
+def voltage_key_expression(column) -> ColumnElement[int]:
+    """
+    Convert a voltage column in V to voltage keys on the database side.
+    """
+    return cast(func.round(column * MICROVOLTS_PER_VOLT), BigInteger)